@@ -1,28 +1,18 @@
 
 import logging
-import os
-import google.generativeai as genai
-from dotenv import load_dotenv
 
-load_dotenv()
+from . import gateway
 
-# Configure Gemini
-GENAI_API_KEY = os.getenv("GENAI_API_KEY")
-if GENAI_API_KEY:
-    genai.configure(api_key=GENAI_API_KEY)
-    
 logger = logging.getLogger(__name__)
 
 async def generate_progress_insight(context_summary: str) -> str:
     """
     Generates a short, personalized insight or motivational message based on the user's data context.
     """
-    if not GENAI_API_KEY:
+    if not gateway.API_KEY:
         return "AI Pilot is offline. Great work keeping active!"
 
     try:
-        model = genai.GenerativeModel('gemini-2.0-flash-exp')
-        
         prompt = f"""
         You are an elite fitness coach.
         Analyze this user's recent workout data summary: "{context_summary}"
@@ -33,8 +23,7 @@ async def generate_progress_insight(context_summary: str) -> str:
         Do not use technical jargon. Be human, encouraging, and brief.
         """
         
-        response = await model.generate_content_async(prompt)
-        return response.text.strip()
+        return await gateway.generate(prompt, feature="insight")
         
     except Exception as e:
         logger.error(f"Error generating AI insight: {e}")
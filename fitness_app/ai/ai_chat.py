@@ -1,6 +1,7 @@
 import logging
-from typing import List, Dict
+from typing import AsyncIterator, List, Dict, Optional
 from pydantic import BaseModel
+from . import gateway
 from .gemini_api import _call_gemini_api
 from .. import models
 
@@ -12,32 +13,46 @@ class ChatMessage(BaseModel):
 
 class ChatRequest(BaseModel):
     message: str
-    history: List[ChatMessage]
+    history: List[ChatMessage] = [] # Ignored when session_id is given: the server keeps that history
+    session_id: Optional[int] = None
 
-async def chat_with_coach(request: ChatRequest) -> str:
-    """
-    Handles chat interaction with the AI Coach.
-    Constructs a prompt with history and system context.
-    """
-    
-    system_prompt = """
+SYSTEM_PROMPT = """
     You are an expert AI Fitness Coach for the 'FitnessPro' app.
     Your goal is to help users with their workouts, nutrition, and motivation.
     
     Guidelines:
     - Be encouraging, professional, and concise.
     - Provide evidence-based advice but disclaim that you are an AI, not a doctor.
-    - If asked about the user's data (weight, workouts), you can say you don't have access to live data in this chat yet.
+    - Use the user's profile and recent activity below when it helps; if something you're asked about isn't there, say you don't have it.
     - Keep answers under 150 words unless asked for a detailed plan.
     """
 
+def with_user_context(context: Optional[str]) -> str:
+    """The system prompt followed by the user's data block (see user_context.build), if any."""
+    return f"{SYSTEM_PROMPT}\n\n{context}" if context else SYSTEM_PROMPT
+
+def build_chat_prompt(request: ChatRequest, context: Optional[str] = None) -> str:
+    """
+    Constructs a prompt with history and system context.
+    """
     # Construct the full prompt context
-    full_prompt = f"{system_prompt}\n\nChat History:\n"
+    full_prompt = f"{with_user_context(context)}\n\nChat History:\n"
     for msg in request.history[-5:]: # Keep last 5 messages for context window
         full_prompt += f"{msg.role.capitalize()}: {msg.content}\n"
     
     full_prompt += f"User: {request.message}\nAssistant:"
-    
+    return full_prompt
+
+async def chat_with_coach(request: ChatRequest, context: Optional[str] = None) -> str:
+    """
+    Handles chat interaction with the AI Coach.
+    """
     # Call Gemini
-    response_text = await _call_gemini_api(full_prompt)
+    response_text = await _call_gemini_api(build_chat_prompt(request, context), feature="chat")
     return response_text
+
+def stream_chat_with_coach(request: ChatRequest, context: Optional[str] = None) -> AsyncIterator[str]:
+    """
+    Same as chat_with_coach, but yields the reply as it is generated.
+    """
+    return gateway.stream(build_chat_prompt(request, context), feature="chat")
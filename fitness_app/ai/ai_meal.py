@@ -1,6 +1,8 @@
+import base64
 import json
 import logging
 from .gemini_api import _call_gemini_api
+from .meal_images import meal_photo_cache, prepare
 
 logger = logging.getLogger(__name__)
 
@@ -25,7 +27,7 @@ async def analyze_meal_image(image_base64: str) -> dict:
     """
 
     try:
-        response_text = await _call_gemini_api(prompt, image_data=image_base64)
+        response_text = await _call_gemini_api(prompt, image_data=image_base64, feature="meal_analysis")
         
         # Clean up potential markdown formatting
         response_text = response_text.replace("```json", "").replace("```", "").strip()
@@ -50,3 +52,18 @@ async def analyze_meal_image(image_base64: str) -> dict:
             "carbs_g": None,
             "fats_g": None
         }
+
+async def analyze_meal_photo(user_id: int, data: bytes) -> dict:
+    """
+    Downscales the raw photo before analysis and reuses the user's earlier analysis
+    of the same photo (matched by perceptual hash). Raises meal_images.UploadError for non-images.
+    """
+    jpeg, image_hash = await prepare(data)
+    cached = meal_photo_cache.get(user_id, image_hash)
+    if cached is not None:
+        return cached
+    logger.info(f"Meal photo downscaled from {len(data)} to {len(jpeg)} bytes")
+    meal_data = await analyze_meal_image(base64.b64encode(jpeg).decode("ascii"))
+    if isinstance(meal_data, dict) and meal_data.get("calories") is not None:
+        meal_photo_cache.set(user_id, image_hash, meal_data)
+    return meal_data
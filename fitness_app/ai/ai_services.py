@@ -1,40 +1,23 @@
-import httpx
-import os
 import json
 from typing import List, Optional
 from fitness_app import schemas
+from . import gateway
 
-# IMPORTANT: In a real application, get this from environment variables!
-AI_API_KEY = os.getenv("AI_API_KEY", "")
-# Using Google Gemini API endpoint
-AI_API_URL = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-pro:generateContent?key={AI_API_KEY}"
-
-async def call_gemini(prompt: str) -> str:
-    if not AI_API_KEY:
-        return "AI_API_KEY_MISSING"
-        
-    headers = {"Content-Type": "application/json"}
-    payload = {
-        "contents": [{
-            "parts": [{"text": prompt}]
-        }]
-    }
-    
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.post(AI_API_URL, headers=headers, json=payload, timeout=10.0)
-            response.raise_for_status()
-            data = response.json()
-            return data['candidates'][0]['content']['parts'][0]['text']
-        except Exception as e:
-            print(f"Gemini API Error: {e}")
-            return "AI_ERROR"
+async def call_gemini(prompt: str, feature: str = "default") -> str:
+    try:
+        return await gateway.generate(prompt, feature=feature)
+    except gateway.AIUnavailable as e:
+        print(f"Gemini API Error: {e}")
+        return "AI_API_KEY_MISSING" if not gateway.API_KEY else "AI_ERROR"
+    except gateway.AIError as e:
+        print(f"Gemini API Error: {e}")
+        return "AI_ERROR"
 
 async def check_toxicity(text: str) -> tuple[bool, Optional[str]]:
     """
     Returns (is_toxic, reason)
     """
-    if not AI_API_KEY:
+    if not gateway.API_KEY:
         return False, None # Fail open if no key
 
     prompt = f"""
@@ -48,7 +31,7 @@ async def check_toxicity(text: str) -> tuple[bool, Optional[str]]:
     Strictly JSON only.
     """
     
-    response_text = await call_gemini(prompt)
+    response_text = await call_gemini(prompt, feature="moderation")
     if response_text in ["AI_API_KEY_MISSING", "AI_ERROR"]:
         return False, None
         
@@ -72,7 +55,7 @@ async def generate_challenge_idea() -> dict:
     Strictly JSON only.
     """
     
-    response_text = await call_gemini(prompt)
+    response_text = await call_gemini(prompt, feature="challenge")
     try:
         clean_text = response_text.replace("```json", "").replace("```", "").strip()
         return json.loads(clean_text)
@@ -104,7 +87,7 @@ async def get_workout_suggestion(user: schemas.User, recent_workouts: List[schem
     prompt += "\nSuggest one specific, effective workout session for today. Keep it short and motivating (2 sentences max)."
 
     # 2. Call Gemini
-    response = await call_gemini(prompt)
+    response = await call_gemini(prompt, feature="workout_suggestion")
     if response in ["AI_API_KEY_MISSING", "AI_ERROR"]:
         # Fallback
         import random
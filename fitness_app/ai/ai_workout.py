@@ -1,15 +1,11 @@
-import os
 import logging
-import httpx
-from typing import List, Optional
+from typing import AsyncIterator, List, Optional
 from pydantic import BaseModel
 from .. import schemas, models
+from . import gateway
 
 logger = logging.getLogger(__name__)
 
-AI_API_KEY = os.getenv("GEMINI_API_KEY")
-AI_API_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-flash-latest:generateContent"
-
 class WorkoutPlanRequest(BaseModel):
     days_per_week: int
     duration_minutes: int
@@ -19,39 +15,17 @@ class WorkoutPlanRequest(BaseModel):
 
 async def _call_gemini_api(prompt: str) -> str:
     """Helper to call Gemini API."""
-    if not AI_API_KEY:
-        logger.error("GEMINI_API_KEY is not set.")
+    try:
+        return await gateway.generate(prompt, feature="workout_plan")
+    except gateway.AIUnavailable as e:
+        logger.error(f"Gemini API Error: {e}")
         return "AI service is currently unavailable."
+    except gateway.AIError as e:
+        logger.error(f"Gemini API Error: {e}")
+        return "An error occurred while generating the workout plan."
 
-    headers = {
-        'Content-Type': 'application/json',
-        'x-goog-api-key': AI_API_KEY
-    }
-    
-    json_data = {
-        "contents": [
-            {"parts": [{"text": prompt}]}
-        ]
-    }
-
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.post(AI_API_URL, headers=headers, json=json_data, timeout=45.0)
-            response.raise_for_status()
-            
-            candidates = response.json().get('candidates', [])
-            if candidates and 'content' in candidates[0] and 'parts' in candidates[0]['content']:
-                return candidates[0]['content']['parts'][0].get('text', '').strip()
-            else:
-                return "Failed to generate content."
-        except Exception as e:
-            logger.error(f"Gemini API Error: {e}")
-            return "An error occurred while generating the workout plan."
-
-async def generate_workout_plan(user: models.User, request: WorkoutPlanRequest) -> str:
-    """Generates a personalized workout plan."""
-    
-    prompt = f"""
+def build_workout_plan_prompt(user: models.User, request: WorkoutPlanRequest) -> str:
+    return f"""
     Act as an elite personal trainer. Create a personalized {request.days_per_week}-day weekly workout plan for a client with the following profile:
 
     **Client Profile:**
@@ -74,5 +48,11 @@ async def generate_workout_plan(user: models.User, request: WorkoutPlanRequest)
     - Give a brief nutritional tip based on their goal.
     - Format usage of Markdown is encouraged for readability.
     """
-    
-    return await _call_gemini_api(prompt)
+
+async def generate_workout_plan(user: models.User, request: WorkoutPlanRequest) -> str:
+    """Generates a personalized workout plan."""
+    return await _call_gemini_api(build_workout_plan_prompt(user, request))
+
+def stream_workout_plan(user: models.User, request: WorkoutPlanRequest) -> AsyncIterator[str]:
+    """Generates a personalized workout plan, yielding it as it is written."""
+    return gateway.stream(build_workout_plan_prompt(user, request), feature="workout_plan")
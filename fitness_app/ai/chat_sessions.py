@@ -0,0 +1,172 @@
+"""
+Server-side AI coach conversations.
+
+Turns are stored per session, so clients send only the new message. Each
+prompt carries the session's rolling summary plus the most recent turns that
+fit in HISTORY_TOKENS, so its size stays bounded however long the
+conversation gets. Once the turns not yet summarized pass HISTORY_TOKENS,
+a background task folds the oldest of them into the summary (one
+"chat_summary" call, at most FOLD_MAX_TOKENS of turns at a time) until what
+is left fits in KEEP_TOKENS.
+"""
+import asyncio
+import logging
+import os
+from typing import AsyncIterator, List, Optional
+
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from .. import crud, models
+from ..core.database import SessionLocal
+from . import gateway, user_context
+from .ai_chat import with_user_context
+
+logger = logging.getLogger(__name__)
+
+HISTORY_TOKENS = int(os.getenv("CHAT_HISTORY_TOKENS", 1500)) # Verbatim recent turns per prompt
+KEEP_TOKENS = HISTORY_TOKENS // 2 # Left unsummarized after a fold, so folds don't run every turn
+FOLD_MAX_TOKENS = 3000 # Turns folded per summary call
+MAX_MESSAGE_TOKENS = 1000 # A longer single message is cut to this in prompts
+MAX_TURNS_LOADED = 50
+
+SUMMARY_PROMPT = """
+    You keep a running summary of a conversation between a user and their AI fitness coach.
+    Update the summary with the new messages below. Keep what the coach needs later: goals,
+    injuries, preferences, numbers mentioned, plans and advice already given. Drop small talk.
+    At most 150 words. Return only the summary text.
+    """
+
+_summarizing = set()
+
+
+def _clip(text: str) -> str:
+    max_chars = MAX_MESSAGE_TOKENS * 4
+    return text if len(text) <= max_chars else text[:max_chars] + " [...]"
+
+
+def _recent_within_budget(turns: List[models.ChatTurn]) -> List[models.ChatTurn]:
+    """turns newest first; returns the newest ones fitting HISTORY_TOKENS, oldest first."""
+    kept, used = [], 0
+    for turn in turns:
+        tokens = min(turn.tokens, MAX_MESSAGE_TOKENS)
+        if kept and used + tokens > HISTORY_TOKENS:
+            break
+        kept.append(turn)
+        used += tokens
+    return kept[::-1]
+
+
+def build_prompt(session: models.ChatSession, turns: List[models.ChatTurn], message: str, context: Optional[str] = None) -> str:
+    prompt = with_user_context(context)
+    if session.summary:
+        prompt += f"\n\nSummary of the earlier conversation:\n{session.summary}"
+    prompt += "\n\nChat History:\n"
+    for turn in _recent_within_budget(turns):
+        prompt += f"{turn.role.capitalize()}: {_clip(turn.content)}\n"
+    prompt += f"User: {_clip(message)}\nAssistant:"
+    return prompt
+
+
+def _prepare(db: Session, session: models.ChatSession, message: str, context: Optional[str]) -> str:
+    turns = crud.get_recent_chat_turns(db, session.id, session.summarized_through, MAX_TURNS_LOADED)
+    return build_prompt(session, turns, message, context)
+
+
+def _save(db: Session, session_id: int, message: str, reply: str):
+    crud.add_chat_turns(db, session_id, [
+        ("user", message, gateway.estimate_tokens(message)),
+        ("assistant", reply, gateway.estimate_tokens(reply)),
+    ])
+
+
+async def reply(db: Session, user: models.User, session: models.ChatSession, message: str) -> str:
+    """Answers a message in the session and stores both turns. Failed replies aren't stored."""
+    context = await user_context.for_prompt(db, user)
+    prompt = await run_in_threadpool(_prepare, db, session, message, context)
+    try:
+        answer = await gateway.generate(prompt, feature="chat")
+    except gateway.AIUnavailable:
+        return "I'm having a little trouble connecting right now. Please try again in a moment."
+    except gateway.AIError:
+        return "I'm sorry, there was an error with the AI service. The developers have been notified."
+    await run_in_threadpool(_save, db, session.id, message, answer)
+    schedule_summary(session.id)
+    return answer
+
+
+async def stream_reply(db: Session, user: models.User, session: models.ChatSession, message: str) -> AsyncIterator[str]:
+    """Same as reply, but yields the answer as it is generated; stored once it completes."""
+    context = await user_context.for_prompt(db, user)
+    prompt = await run_in_threadpool(_prepare, db, session, message, context)
+    parts = []
+    async for chunk in gateway.stream(prompt, feature="chat"):
+        parts.append(chunk)
+        yield chunk
+    # Not reached when the client disconnects or the stream fails: nothing is stored then.
+    await run_in_threadpool(_save, db, session.id, message, "".join(parts))
+    schedule_summary(session.id)
+
+
+# --- Rolling summary ---
+
+def _load_fold(session_id: int) -> Optional[tuple]:
+    """Returns (previous summary, summarized_through, turns to fold) if the session is over budget."""
+    db = SessionLocal()
+    try:
+        session = db.get(models.ChatSession, session_id)
+        if session is None or crud.unsummarized_chat_tokens(db, session_id, session.summarized_through) <= HISTORY_TOKENS:
+            return None
+        turns = crud.get_recent_chat_turns(db, session_id, session.summarized_through, limit=None)[::-1]
+        remaining = sum(turn.tokens for turn in turns)
+        fold, fold_tokens = [], 0
+        for turn in turns:
+            if remaining <= KEEP_TOKENS or (fold and fold_tokens + turn.tokens > FOLD_MAX_TOKENS):
+                break
+            fold.append((turn.id, turn.role, turn.content))
+            fold_tokens += turn.tokens
+            remaining -= turn.tokens
+        return session.summary, session.summarized_through, fold
+    finally:
+        db.close()
+
+
+def _store_summary(session_id: int, summary: str, previous_through: int, summarized_through: int) -> bool:
+    db = SessionLocal()
+    try:
+        return crud.update_chat_summary(db, session_id, summary, previous_through, summarized_through)
+    finally:
+        db.close()
+
+
+async def summarize(session_id: int):
+    """Folds the oldest unsummarized turns into the session summary until the rest fit in KEEP_TOKENS."""
+    while True:
+        loaded = await run_in_threadpool(_load_fold, session_id)
+        if loaded is None or not loaded[2]:
+            return
+        previous, previous_through, fold = loaded
+        messages = "\n".join(f"{role.capitalize()}: {_clip(content)}" for _, role, content in fold)
+        prompt = f"{SUMMARY_PROMPT}\nCurrent summary:\n{previous or '(none yet)'}\n\nNew messages:\n{messages}\n\nUpdated summary:"
+        try:
+            summary = await gateway.generate(prompt, feature="chat_summary")
+        except gateway.AIError as e:
+            # The turns stay unsummarized; the next reply tries again.
+            logger.warning(f"Summarizing chat session {session_id} failed: {e}")
+            return
+        if not await run_in_threadpool(_store_summary, session_id, summary, previous_through, fold[-1][0]):
+            return # Another worker summarized meanwhile
+
+
+def schedule_summary(session_id: int):
+    if session_id in _summarizing:
+        return
+    _summarizing.add(session_id)
+    task = asyncio.create_task(summarize(session_id))
+    task.add_done_callback(lambda task: _summary_done(session_id, task))
+
+
+def _summary_done(session_id: int, task: asyncio.Task):
+    _summarizing.discard(session_id)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"Summarizing chat session {session_id} failed: {task.exception()!r}")
@@ -0,0 +1,437 @@
+"""
+Single entry point for calls to the Gemini API.
+
+Owns one long-lived httpx.AsyncClient (HTTP/2, keep-alive pool), created at
+application startup and closed at shutdown, so AI requests reuse warm
+connections instead of paying DNS/TCP/TLS setup each time. Every call names a
+feature, which selects its timeout (and optionally its model) and its bulkhead;
+see resilience.py for the breaker and concurrency limits every call passes.
+"""
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import time
+from typing import AsyncIterator, Dict, Optional, Tuple
+
+import httpx
+
+from . import resilience
+from .response_cache import cache_key, response_cache
+
+logger = logging.getLogger(__name__)
+
+# Environment only: an empty key keeps the offline / fail-open paths reachable.
+API_KEY = (
+    os.getenv("GEMINI_API_KEY")
+    or os.getenv("API_KEY")
+    or os.getenv("AI_API_KEY")
+    or os.getenv("GENAI_API_KEY")
+    or ""
+)
+API_BASE_URL = os.getenv("GEMINI_API_BASE_URL", "https://generativelanguage.googleapis.com/v1beta")
+DEFAULT_MODEL = os.getenv("GEMINI_MODEL", "gemini-flash-latest")
+
+HTTP2 = os.getenv("AI_HTTP2", "1") == "1"
+MAX_CONNECTIONS = int(os.getenv("AI_MAX_CONNECTIONS", 20))
+MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("AI_MAX_KEEPALIVE_CONNECTIONS", 10))
+KEEPALIVE_EXPIRY = float(os.getenv("AI_KEEPALIVE_EXPIRY", 60))
+CONNECT_TIMEOUT = 5.0
+
+
+# Hedging: a slow call gets one duplicate after the feature's observed latency percentile
+# (never later than its SLO). When the primary model itself is missing its SLO, the duplicate
+# goes to the cheaper fallback model instead.
+HEDGING = os.getenv("AI_HEDGING", "1") == "1"
+HEDGE_PERCENTILE = float(os.getenv("AI_HEDGE_PERCENTILE", 0.95))
+HEDGE_MIN_DELAY = float(os.getenv("AI_HEDGE_MIN_DELAY", 0.25))
+FALLBACK_MODEL = os.getenv("GEMINI_FALLBACK_MODEL", "gemini-flash-lite-latest")
+# A success slower than this many times its feature's SLO counts as slow for the adaptive
+# limit and the model's breaker. Features without an SLO are judged on errors only.
+SLOW_CALL_SLO_MULTIPLE = float(os.getenv("AI_SLOW_CALL_SLO_MULTIPLE", 2))
+
+
+class FeatureConfig:
+    def __init__(self, timeout: float, model: Optional[str] = None, cache_ttl: float = 0, max_in_flight: int = 8, max_queue: int = 16, slo: float = 0):
+        self.timeout = timeout
+        self.model = model
+        self.fallback_model = FALLBACK_MODEL
+        self.slo = slo # Latency objective in seconds; 0 = no hedging or SLO fallback
+        self.cache_ttl = cache_ttl # Seconds to reuse identical responses; 0 = never cached
+        self.max_in_flight = max_in_flight # Bulkhead: concurrent Gemini calls for this feature
+        self.max_queue = max_queue # Bulkhead: callers allowed to wait for a slot
+
+    @property
+    def slow_after(self) -> Optional[float]:
+        return self.slo * SLOW_CALL_SLO_MULTIPLE if self.slo else None
+
+
+HOUR = 3600
+DAY = 24 * HOUR
+
+# Read timeouts in seconds. Models can be overridden per feature with GEMINI_MODEL_<FEATURE>
+# (fallback models with GEMINI_FALLBACK_MODEL_<FEATURE>, SLOs with AI_SLO_<FEATURE>),
+# cache TTLs with AI_CACHE_TTL_<FEATURE>, bulkhead sizes with AI_MAX_IN_FLIGHT_<FEATURE> and
+# AI_MAX_QUEUE_<FEATURE>. Only features whose answer should be the same for the same input
+# are cached; conversational ones are not.
+FEATURES = {
+    "default": FeatureConfig(timeout=30.0, slo=10.0),
+    "chat": FeatureConfig(timeout=30.0, max_in_flight=12, max_queue=24, slo=8.0),
+    "chat_summary": FeatureConfig(timeout=30.0, max_in_flight=4, max_queue=32), # Background; nobody waits on it
+    "coach": FeatureConfig(timeout=30.0, slo=8.0),
+    "meal_analysis": FeatureConfig(timeout=60.0, cache_ttl=7 * DAY, max_in_flight=4, max_queue=8), # Image upload + vision; too costly to hedge
+    "workout_plan": FeatureConfig(timeout=45.0, cache_ttl=DAY, max_in_flight=4, max_queue=8, slo=20.0),
+    "workout_parse": FeatureConfig(timeout=20.0, cache_ttl=30 * DAY, slo=5.0),
+    "workout_import": FeatureConfig(timeout=90.0, cache_ttl=30 * DAY, max_in_flight=4, max_queue=16), # Many entries per call; too large to hedge
+    "workout_suggestion": FeatureConfig(timeout=10.0, max_in_flight=4, max_queue=4, slo=4.0),
+    "moderation": FeatureConfig(timeout=10.0, cache_ttl=7 * DAY, max_queue=32, slo=3.0),
+    "challenge": FeatureConfig(timeout=20.0, max_in_flight=4, max_queue=8, slo=8.0),
+    "motivation": FeatureConfig(timeout=15.0, max_in_flight=2, max_queue=4),
+    "mind": FeatureConfig(timeout=30.0, slo=10.0),
+    "insight": FeatureConfig(timeout=15.0, cache_ttl=6 * HOUR, max_in_flight=4, max_queue=8, slo=6.0),
+}
+for _name, _config in FEATURES.items():
+    _config.model = os.getenv(f"GEMINI_MODEL_{_name.upper()}", _config.model)
+    _config.fallback_model = os.getenv(f"GEMINI_FALLBACK_MODEL_{_name.upper()}", _config.fallback_model)
+    _config.slo = float(os.getenv(f"AI_SLO_{_name.upper()}", _config.slo))
+    _config.cache_ttl = float(os.getenv(f"AI_CACHE_TTL_{_name.upper()}", _config.cache_ttl))
+    _config.max_in_flight = int(os.getenv(f"AI_MAX_IN_FLIGHT_{_name.upper()}", _config.max_in_flight))
+    _config.max_queue = int(os.getenv(f"AI_MAX_QUEUE_{_name.upper()}", _config.max_queue))
+
+
+class AIError(Exception):
+    """The AI service could not produce a response."""
+
+
+class AIUnavailable(AIError):
+    """Not configured, unreachable or timed out."""
+
+
+class AIResponseError(AIError):
+    """The API returned an error status or an unexpected body."""
+
+
+class AIOverloaded(AIUnavailable):
+    """Turned away without calling Gemini: circuit open or bulkhead full."""
+
+
+def _is_upstream_failure(status_code: int) -> bool:
+    # Counts against the breaker and the adaptive limit; other 4xx are our own bad requests.
+    return status_code == 429 or status_code >= 500
+
+
+# Monotonic time by which the current HTTP request wants its answer (set by main.py's middleware).
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("ai_deadline", default=None)
+
+
+def set_deadline(seconds: float) -> contextvars.Token:
+    return _deadline.set(time.monotonic() + seconds)
+
+
+def reset_deadline(token: contextvars.Token):
+    _deadline.reset(token)
+
+
+def time_left() -> Optional[float]:
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def _create_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        base_url=API_BASE_URL,
+        http2=HTTP2,
+        limits=httpx.Limits(
+            max_connections=MAX_CONNECTIONS,
+            max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(FEATURES["default"].timeout, connect=CONNECT_TIMEOUT),
+        headers={"Content-Type": "application/json", "x-goog-api-key": API_KEY},
+    )
+
+
+async def startup():
+    global _client
+    if _client is None:
+        _client = _create_client()
+        logger.info(f"AI gateway client ready (http2={HTTP2}, max_connections={MAX_CONNECTIONS})")
+
+
+async def shutdown():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def get_client() -> httpx.AsyncClient:
+    # Created lazily for scripts that don't run the app's startup hooks.
+    global _client
+    if _client is None:
+        _client = _create_client()
+    return _client
+
+
+def feature_config(feature: str) -> FeatureConfig:
+    return FEATURES.get(feature, FEATURES["default"])
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token for English text; good enough for prompt budgets.
+    return len(text) // 4 + 1
+
+
+def build_payload(prompt: str, image_data: Optional[str] = None, mime_type: str = "image/jpeg") -> dict:
+    parts = [{"text": prompt}]
+    if image_data:
+        parts.append({"inline_data": {"mime_type": mime_type, "data": image_data}})
+    return {"contents": [{"parts": parts}]}
+
+
+def extract_text(body: dict) -> str:
+    candidates = body.get("candidates", [])
+    if candidates and "content" in candidates[0] and "parts" in candidates[0]["content"]:
+        return candidates[0]["content"]["parts"][0].get("text", "").strip()
+    raise AIResponseError("Unexpected Gemini API response format")
+
+
+async def _generate_once(prompt: str, feature: str, config: FeatureConfig, model: str, image_data: Optional[str], mime_type: str, timeout: float) -> str:
+    logger.info(f"[{feature}] Sending prompt to Gemini ({model}): {prompt[:200]}... (Image included: {bool(image_data)})")
+    try:
+        async with resilience.admit(feature, model, config.max_in_flight, config.max_queue, config.slow_after) as call:
+            try:
+                response = await get_client().post(
+                    f"/models/{model}:generateContent",
+                    json=build_payload(prompt, image_data, mime_type),
+                    timeout=httpx.Timeout(timeout, connect=min(timeout, CONNECT_TIMEOUT)),
+                )
+                call.responded()
+                response.raise_for_status()
+            except httpx.HTTPStatusError as e:
+                if _is_upstream_failure(e.response.status_code):
+                    call.fail()
+                logger.error(f"[{feature}] Gemini API request failed with status {e.response.status_code}: {e.response.text}")
+                raise AIResponseError(f"Gemini API returned {e.response.status_code}") from e
+            except httpx.HTTPError as e:
+                call.fail()
+                logger.error(f"[{feature}] Gemini API request failed: {e!r}")
+                raise AIUnavailable(str(e) or e.__class__.__name__) from e
+    except resilience.Rejected as e:
+        logger.warning(f"[{feature}] Gemini call rejected: {e}")
+        raise AIOverloaded(str(e)) from e
+    logger.info(f"[{feature}] Received response from Gemini ({model}): {response.text[:200]}...")
+    try:
+        body = response.json()
+    except ValueError as e:
+        raise AIResponseError("Gemini API returned invalid JSON") from e
+    return extract_text(body)
+
+
+def _hedge_delay(feature: str, model: str, config: FeatureConfig) -> float:
+    observed = resilience.latency_percentile(feature, model, HEDGE_PERCENTILE)
+    if observed is None:
+        return config.slo
+    return min(config.slo, max(HEDGE_MIN_DELAY, observed))
+
+
+def _hedge_model(feature: str, model: str, config: FeatureConfig) -> str:
+    # Duplicate on the same model, unless the primary is currently missing its SLO.
+    if not config.fallback_model:
+        return model
+    observed = resilience.latency_percentile(feature, model, HEDGE_PERCENTILE)
+    if resilience.breaker(model).state != resilience.CircuitBreaker.CLOSED or (observed is not None and observed > config.slo):
+        return config.fallback_model
+    return model
+
+
+async def _generate_hedged(prompt: str, feature: str, config: FeatureConfig, model: str, image_data: Optional[str], mime_type: str) -> Tuple[str, str]:
+    """
+    Races the primary call against one hedge, launched after the feature's observed latency
+    percentile (capped at its SLO). If the primary fails as unavailable, the fallback model
+    is tried at once. First success wins; the rest are cancelled. Returns (text, model).
+    """
+    budget = config.timeout
+    left = time_left()
+    if left is not None:
+        if left <= 0:
+            raise AIUnavailable("Request deadline exceeded before calling Gemini")
+        budget = min(budget, left)
+    started = time.monotonic()
+    ends_at = started + budget
+
+    def launch(target: str) -> asyncio.Task:
+        timeout = max(0.1, ends_at - time.monotonic())
+        task = asyncio.ensure_future(_generate_once(prompt, feature, config, target, image_data, mime_type, timeout))
+        tasks[task] = target
+        return task
+
+    tasks: Dict[asyncio.Task, str] = {}
+    primary = launch(model)
+    hedge_at = started + _hedge_delay(feature, model, config) if HEDGING and config.slo > 0 else None
+    fallback_tried = False
+    error: Optional[Exception] = None
+    try:
+        while tasks:
+            wait_until = min(ends_at, hedge_at) if hedge_at is not None else ends_at
+            done, _ = await asyncio.wait(tasks, timeout=max(0.0, wait_until - time.monotonic()), return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                answered_by = tasks.pop(task)
+                if task.exception() is None:
+                    if task is not primary:
+                        resilience.record_hedge(feature, "hedge_wins")
+                    if answered_by != model:
+                        resilience.record_hedge(feature, "fallback_answers")
+                    return task.result(), answered_by
+                error = task.exception()
+                fallback = config.fallback_model if config.fallback_model != model else None
+                if isinstance(error, AIUnavailable) and fallback and not fallback_tried and fallback not in tasks.values() and time.monotonic() < ends_at:
+                    logger.warning(f"[{feature}] {answered_by} unavailable ({error}); falling back to {fallback}")
+                    resilience.record_hedge(feature, "fallbacks")
+                    fallback_tried = True
+                    hedge_at = None
+                    launch(fallback)
+            if done:
+                continue
+            now = time.monotonic()
+            if hedge_at is not None and now >= hedge_at:
+                hedge_at = None
+                if resilience.adaptive_limiter.in_flight >= resilience.adaptive_limiter.capacity:
+                    continue # No spare capacity; hedging would only add load
+                target = _hedge_model(feature, model, config)
+                fallback_tried = fallback_tried or target == config.fallback_model
+                logger.info(f"[{feature}] No answer from {model} after {now - started:.2f}s; hedging on {target}")
+                resilience.record_hedge(feature, "hedges")
+                launch(target)
+            elif now >= ends_at:
+                raise AIUnavailable(f"No answer from Gemini within {budget:.1f}s")
+        raise error
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def generate(prompt: str, feature: str = "default", image_data: Optional[str] = None, mime_type: str = "image/jpeg", use_cache: bool = True) -> str:
+    """
+    Returns the model's text for the prompt. Raises AIError subclasses on failure;
+    callers decide what fallback to show. Only successful responses are cached.
+    Slow calls may be hedged and may be answered by the feature's fallback model
+    (those answers are not cached).
+    """
+    if not API_KEY:
+        raise AIUnavailable("Gemini API key is not configured")
+    config = feature_config(feature)
+    model = config.model or DEFAULT_MODEL
+
+    key = None
+    if use_cache and config.cache_ttl > 0:
+        key = cache_key(model, prompt, image_data, mime_type)
+        cached = await response_cache.get(feature, key)
+        if cached is not None:
+            return cached
+
+    started = time.monotonic()
+    text, answered_by = await _generate_hedged(prompt, feature, config, model, image_data, mime_type)
+    if key is not None and text and answered_by == model:
+        await response_cache.set(feature, key, text, config.cache_ttl, (time.monotonic() - started) * 1000)
+    return text
+
+
+async def stream(prompt: str, feature: str = "default", image_data: Optional[str] = None, mime_type: str = "image/jpeg", use_cache: bool = True) -> AsyncIterator[str]:
+    """
+    Yields the response text in chunks as Gemini produces them (streamGenerateContent).
+    Closing the generator (e.g. the client disconnected) closes the upstream stream.
+    Cached responses are yielded in one chunk; complete streamed responses are cached.
+    """
+    if not API_KEY:
+        raise AIUnavailable("Gemini API key is not configured")
+    config = feature_config(feature)
+    model = config.model or DEFAULT_MODEL
+
+    key = None
+    if use_cache and config.cache_ttl > 0:
+        key = cache_key(model, prompt, image_data, mime_type)
+        cached = await response_cache.get(feature, key)
+        if cached is not None:
+            yield cached
+            return
+
+    timeout = config.timeout
+    left = time_left()
+    if left is not None:
+        if left <= 0:
+            raise AIUnavailable("Request deadline exceeded before calling Gemini")
+        timeout = min(timeout, left)
+
+    started = time.monotonic()
+    chunks = []
+    logger.info(f"[{feature}] Streaming prompt to Gemini ({model}): {prompt[:200]}... (Image included: {bool(image_data)})")
+    try:
+        async with resilience.admit(feature, model, config.max_in_flight, config.max_queue, config.slow_after, track_latency=False) as call:
+            try:
+                async with get_client().stream(
+                    "POST",
+                    f"/models/{model}:streamGenerateContent",
+                    params={"alt": "sse"},
+                    json=build_payload(prompt, image_data, mime_type),
+                    timeout=httpx.Timeout(timeout, connect=min(timeout, CONNECT_TIMEOUT)),
+                ) as response:
+                    call.responded()
+                    if response.is_error:
+                        if _is_upstream_failure(response.status_code):
+                            call.fail()
+                        await response.aread()
+                        logger.error(f"[{feature}] Gemini API stream failed with status {response.status_code}: {response.text}")
+                        raise AIResponseError(f"Gemini API returned {response.status_code}")
+                    async for line in response.aiter_lines():
+                        if not line.startswith("data:"):
+                            continue
+                        try:
+                            body = json.loads(line[len("data:"):].strip())
+                        except ValueError:
+                            continue
+                        for candidate in body.get("candidates", [])[:1]:
+                            for part in candidate.get("content", {}).get("parts", []):
+                                if part.get("text"):
+                                    chunks.append(part["text"])
+                                    yield part["text"]
+            except httpx.HTTPError as e:
+                call.fail()
+                logger.error(f"[{feature}] Gemini API stream failed: {e!r}")
+                raise AIUnavailable(str(e) or e.__class__.__name__) from e
+    except resilience.Rejected as e:
+        logger.warning(f"[{feature}] Gemini stream rejected: {e}")
+        raise AIOverloaded(str(e)) from e
+
+    text = "".join(chunks).strip()
+    if not text:
+        raise AIResponseError("Gemini API stream returned no text")
+    logger.info(f"[{feature}] Streamed {len(text)} characters from Gemini in {time.monotonic() - started:.2f}s")
+    if key is not None:
+        await response_cache.set(feature, key, text, config.cache_ttl, (time.monotonic() - started) * 1000)
+
+
+async def sse_relay(request, chunks: AsyncIterator[str]) -> AsyncIterator[str]:
+    """
+    Server-Sent Events body relaying streamed text: 'token' events, then 'done' or 'error'.
+    Stops pulling from upstream as soon as the client goes away.
+    """
+    try:
+        async for chunk in chunks:
+            if await request.is_disconnected():
+                logger.info("Client disconnected; cancelling upstream AI stream")
+                break
+            yield f"event: token\ndata: {json.dumps({'text': chunk})}\n\n"
+        else:
+            yield "event: done\ndata: {}\n\n"
+    except AIUnavailable:
+        yield f"event: error\ndata: {json.dumps({'detail': 'AI service is currently unavailable.'})}\n\n"
+    except AIError:
+        yield f"event: error\ndata: {json.dumps({'detail': 'There was an error with the AI service.'})}\n\n"
+    finally:
+        # Closes the HTTP stream to Gemini if we stopped early
+        await chunks.aclose()
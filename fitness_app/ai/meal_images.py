@@ -0,0 +1,203 @@
+"""
+Meal photo intake: streaming multipart reads with a size cap, downscaling in
+a process pool, and a per-user perceptual-hash cache of analyses.
+
+Phone photos are 3-12 MB; Gemini needs far less to recognise a meal, so
+images are shrunk to MAX_DIMENSION and re-encoded as JPEG before upload.
+Decoding and resizing are CPU-bound, hence the process pool. The dHash of
+the prepared image lets a re-upload of the same photo (re-compressed,
+resized or screenshotted) reuse the earlier analysis without an AI call.
+"""
+import asyncio
+import io
+import logging
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Tuple
+
+from python_multipart.multipart import MultipartParser, parse_options_header
+
+logger = logging.getLogger(__name__)
+
+MAX_UPLOAD_BYTES = int(os.getenv("MEAL_IMAGE_MAX_BYTES", 10 * 1024 * 1024))
+MAX_DIMENSION = int(os.getenv("MEAL_IMAGE_MAX_DIMENSION", 1024))
+JPEG_QUALITY = int(os.getenv("MEAL_IMAGE_JPEG_QUALITY", 85))
+MAX_PIXELS = 50_000_000 # Refuse decompression bombs
+WORKERS = int(os.getenv("MEAL_IMAGE_WORKERS", 2))
+HASH_DISTANCE = int(os.getenv("MEAL_IMAGE_HASH_DISTANCE", 4)) # Max differing bits of 64 to count as the same photo
+HASHES_PER_USER = 50
+MAX_USERS = 10000
+
+
+class UploadError(ValueError):
+    """The upload is not a usable image."""
+
+
+class UploadTooLarge(UploadError):
+    pass
+
+
+async def read_multipart_file(request, field: str = "image", max_bytes: int = MAX_UPLOAD_BYTES) -> bytes:
+    """
+    Reads one file field from a multipart/form-data request body as it streams in.
+    Other fields are skipped; reading stops with UploadTooLarge as soon as the file passes max_bytes.
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise UploadError("Expected a multipart/form-data upload")
+    declared = request.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > max_bytes + 64 * 1024: # Allow for multipart framing
+        raise UploadTooLarge(f"Image exceeds {max_bytes // (1024 * 1024)} MB")
+
+    state = {"header_field": b"", "header_value": b"", "headers": {}, "in_field": False, "found": False}
+    data = bytearray()
+
+    def on_part_begin():
+        state["headers"] = {}
+
+    def on_header_field(buffer, start, end):
+        state["header_field"] += buffer[start:end]
+
+    def on_header_value(buffer, start, end):
+        state["header_value"] += buffer[start:end]
+
+    def on_header_end():
+        state["headers"][state["header_field"].lower()] = state["header_value"]
+        state["header_field"] = state["header_value"] = b""
+
+    def on_headers_finished():
+        _, disposition = parse_options_header(state["headers"].get(b"content-disposition", b""))
+        state["in_field"] = disposition.get(b"name") == field.encode() and not state["found"]
+        state["found"] = state["found"] or state["in_field"]
+
+    def on_part_data(buffer, start, end):
+        if state["in_field"]:
+            data.extend(buffer[start:end])
+
+    parser = MultipartParser(params[b"boundary"], {
+        "on_part_begin": on_part_begin,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+    })
+    async for chunk in request.stream():
+        parser.write(chunk)
+        if len(data) > max_bytes:
+            raise UploadTooLarge(f"Image exceeds {max_bytes // (1024 * 1024)} MB")
+    parser.finalize()
+    if not state["found"] or not data:
+        raise UploadError(f"Missing '{field}' file field")
+    return bytes(data)
+
+
+def _dhash(image) -> int:
+    # 64-bit difference hash: brightness gradients of a 9x8 greyscale thumbnail
+    from PIL import Image
+    pixels = list(image.convert("L").resize((9, 8), Image.Resampling.LANCZOS).getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return value
+
+
+def _prepare(data: bytes, max_dimension: int, quality: int) -> Tuple[bytes, int]:
+    # Runs in a worker process.
+    from PIL import Image, ImageOps
+    Image.MAX_IMAGE_PIXELS = MAX_PIXELS
+    try:
+        image = Image.open(io.BytesIO(data))
+        image.draft("RGB", (max_dimension, max_dimension)) # JPEG: decode at reduced scale directly
+        image = ImageOps.exif_transpose(image)
+        image = image.convert("RGB")
+    except Image.DecompressionBombError:
+        raise ValueError("Image dimensions are too large") from None
+    except (OSError, ValueError):
+        raise ValueError("Not a usable image") from None
+    image.thumbnail((max_dimension, max_dimension), Image.Resampling.LANCZOS)
+    out = io.BytesIO()
+    image.save(out, format="JPEG", quality=quality, optimize=True)
+    return out.getvalue(), _dhash(image)
+
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=WORKERS)
+        return _pool
+
+
+def shutdown():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+async def prepare(data: bytes) -> Tuple[bytes, int]:
+    """Returns (downscaled JPEG bytes, perceptual hash). Raises UploadError for non-images."""
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(_get_pool(), _prepare, data, MAX_DIMENSION, JPEG_QUALITY)
+    except ValueError as e:
+        raise UploadError(str(e)) from e
+
+
+class PerceptualCache:
+    """Recent analyses per user, matched by Hamming distance between dHashes."""
+
+    def __init__(self, per_user: int = HASHES_PER_USER, max_users: int = MAX_USERS, max_distance: int = HASH_DISTANCE):
+        self.per_user = per_user
+        self.max_users = max_users
+        self.max_distance = max_distance
+        self._users: "OrderedDict[int, OrderedDict[int, dict]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id: int, image_hash: int) -> Optional[dict]:
+        with self._lock:
+            entries = self._users.get(user_id)
+            if entries:
+                self._users.move_to_end(user_id)
+                for known_hash, result in entries.items():
+                    if (known_hash ^ image_hash).bit_count() <= self.max_distance:
+                        entries.move_to_end(known_hash)
+                        self.hits += 1
+                        return dict(result)
+            self.misses += 1
+            return None
+
+    def set(self, user_id: int, image_hash: int, result: dict):
+        with self._lock:
+            entries = self._users.setdefault(user_id, OrderedDict())
+            self._users.move_to_end(user_id)
+            entries[image_hash] = dict(result)
+            entries.move_to_end(image_hash)
+            while len(entries) > self.per_user:
+                entries.popitem(last=False)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "users": len(self._users),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+meal_photo_cache = PerceptualCache()
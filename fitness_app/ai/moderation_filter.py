@@ -0,0 +1,203 @@
+"""
+Local pre-filter in front of AI moderation.
+
+Each text goes through three cheap stages and only reaches Gemini when none
+of them is confident:
+
+1. rejected-content hashes: exact (normalised) repeats of text already
+   rejected are rejected again;
+2. lexicon: one compiled regex over block phrases (threats, self-harm
+   encouragement, solicitation) rejects outright, unless the post also talks
+   about training ("ill kill you at the squat comp haha"), which escalates;
+3. score: a small hand-weighted linear model over suspect words, targeting,
+   shouting, links and fitness vocabulary. High scores are rejected only when
+   the abuse is aimed at "you" and the post doesn't talk about training;
+   untargeted swearing ("this is fucking shit") and banter ("leg day is
+   going to kill you lol") go to the model. A post only passes locally on positive evidence: short,
+   low score, some fitness vocabulary, nothing aimed at "you" and no
+   self-harm or distress terms. Anything else is escalated, and so is every
+   post with a risk phrase or a link.
+
+Abuse is matched on leetspeak-decoded text ("1d10t"), fitness vocabulary on
+the plain lowercased text, so "100kg" stays a weight instead of "iookg".
+
+Python's re alternation stands in for an Aho-Corasick automaton: the lexicon
+is small enough that one pass of a compiled pattern takes microseconds.
+"""
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+SAFE = "safe"
+UNSAFE = "unsafe"
+ESCALATE = "escalate"
+
+REJECTED_HASHES_MAX = 50000
+SAFE_MAX_CHARS = 280 # Longer posts always get a second opinion unless rejected locally
+SAFE_SCORE = 0.0
+UNSAFE_SCORE = 4.0
+
+BLOCK_PHRASES = [
+    "kill yourself", "kill urself", "kys", "go die", "hope you die", "i will kill you", "ill kill you", "i ll kill you",
+    "neck yourself", "slit your wrists", "end your life", "nobody would miss you",
+    "send nudes", "send me nudes",
+]
+SUSPECT_WORDS = [
+    "idiot", "stupid", "loser", "moron", "dumb", "ugly", "pathetic", "worthless", "trash", "disgusting",
+    "shut up", "hate you", "fat ass", "fatass", "fuck", "fucking", "shit", "bitch", "bastard", "asshole",
+    "die", "kill", "hurt", "nude", "nudes", "sexy",
+]
+# Self-harm, eating-disorder and distress language: never decided locally, always escalated.
+RISK_PHRASES = [
+    "kill myself", "killing myself", "end it all", "end my life", "want to die", "wanna die", "better off dead",
+    "suicide", "suicidal", "self harm", "selfharm", "cut myself", "cutting myself", "hurt myself", "hate myself",
+    "nobody cares", "no one cares", "no reason to live", "cant go on", "can t go on", "give up on life",
+    "worthless", "hopeless", "depressed", "starve", "starving", "starved", "purge", "purging", "throw up",
+    "laxatives", "thinspo", "pro ana", "proana", "skip meals", "stop eating", "not eating",
+]
+FITNESS_WORDS = [
+    "pr", "pb", "workout", "workouts", "training", "trained", "gym", "squat", "squats", "bench", "deadlift",
+    "deadlifts", "reps", "sets", "lift", "lifts", "lifting", "run", "running", "cardio", "protein", "meal", "progress", "goal", "streak", "stretch",
+    "rest day", "leg day", "personal best", "kg", "lbs", "km", "miles", "proud", "great job", "well done",
+    "keep going", "you got this", "congrats", "congratulations", "nice", "awesome", "thanks",
+]
+
+_LEET = str.maketrans({"0": "o", "1": "i", "3": "e", "4": "a", "5": "s", "7": "t", "@": "a", "$": "s"})
+
+
+def _phrase_pattern(phrases) -> re.Pattern:
+    # Longest first, so "fucking" wins over "fuck"; whole words only ("die" but not "diet").
+    alternatives = "|".join(re.escape(p) for p in sorted(phrases, key=len, reverse=True))
+    return re.compile(rf"\b(?:{alternatives})\b")
+
+
+_BLOCK = _phrase_pattern(BLOCK_PHRASES)
+_SUSPECT = _phrase_pattern(SUSPECT_WORDS)
+_FITNESS = _phrase_pattern(FITNESS_WORDS)
+_RISK = _phrase_pattern(RISK_PHRASES)
+_SECOND_PERSON = re.compile(r"\b(?:you|your|youre|u|ur)\b")
+_URL = re.compile(r"https?://|www\.|\b[a-z0-9-]+\.(?:com|net|org|io|co|me|ly|gg|xyz|info|biz|app|link)\b")
+# Weights, distances and set schemes: "100kg", "5 km", "3x10", "12 reps"
+_UNITS = re.compile(r"\b\d+(?:\s*x\s*\d+|\s*(?:kgs?|lbs?|km|mi|miles?|reps?|sets?|min|mins)\b)")
+_REPEATS = re.compile(r"(.)\1{2,}")
+
+
+def normalize(text: str, leet: bool = True) -> str:
+    """Lowercase, undo common leetspeak, squeeze letter runs ("stuuupid" -> "stuupid") and spacing."""
+    text = text.lower()
+    if leet:
+        text = text.translate(_LEET)
+    text = _REPEATS.sub(r"\1\1", text)
+    text = re.sub(r"[^a-z0-9\s]", " ", text)
+    return " ".join(text.split())
+
+
+def _fitness_count(plain: str) -> int:
+    return len(_FITNESS.findall(plain)) + len(_UNITS.findall(plain))
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha1(normalize(text).encode("utf-8")).hexdigest()
+
+
+class Verdict:
+    def __init__(self, decision: str, stage: str, reason: Optional[str] = None, score: float = 0.0):
+        self.decision = decision
+        self.stage = stage
+        self.reason = reason
+        self.score = score
+
+
+class ModerationFilter:
+    def __init__(self, max_rejected: int = REJECTED_HASHES_MAX):
+        self.max_rejected = max_rejected
+        self._rejected: "OrderedDict[str, str]" = OrderedDict() # hash -> reason
+        self._lock = threading.Lock()
+        self._counts: Dict[str, Dict[str, int]] = {}
+
+    def score(self, text: str) -> float:
+        normalized = normalize(text)
+        suspect = len(_SUSPECT.findall(normalized))
+        fitness = _fitness_count(normalize(text, leet=False))
+        letters = [c for c in text if c.isalpha()]
+        caps_ratio = sum(1 for c in letters if c.isupper()) / len(letters) if letters else 0.0
+
+        score = 2.0 * suspect
+        if suspect and _SECOND_PERSON.search(normalized):
+            score += 1.5 # Insults aimed at someone
+        if caps_ratio > 0.6 and len(letters) > 10:
+            score += 1.0
+        if text.count("!") >= 4:
+            score += 0.5
+        if _URL.search(text.lower()):
+            score += 1.0
+        score -= min(2, fitness)
+        return score
+
+    def check(self, text: str) -> Verdict:
+        digest = content_hash(text)
+        with self._lock:
+            reason = self._rejected.get(digest)
+            if reason is not None:
+                self._rejected.move_to_end(digest)
+        if reason is not None:
+            return self._count(Verdict(UNSAFE, "hash", reason))
+
+        normalized = normalize(text)
+        plain = normalize(text, leet=False)
+        fitness = _fitness_count(plain) > 0
+        match = _BLOCK.search(normalized)
+        if match:
+            if fitness:
+                # Gym banter trips the lexicon too; let the model read it in context.
+                return self._count(Verdict(ESCALATE, "lexicon", f"Blocked phrase in fitness context: {match.group(0)}"))
+            return self._count(Verdict(UNSAFE, "lexicon", f"Blocked phrase: {match.group(0)}"))
+        if _RISK.search(normalized):
+            return self._count(Verdict(ESCALATE, "risk"))
+        if _URL.search(text.lower()):
+            # Spam and phishing links look harmless to a word list
+            return self._count(Verdict(ESCALATE, "link"))
+
+        score = self.score(text)
+        suspect = _SUSPECT.search(normalized) is not None
+        # "you got this" is encouragement; any other "you" means the post is aimed at someone.
+        targeted = _SECOND_PERSON.search(_FITNESS.sub(" ", normalized)) is not None
+        if score >= UNSAFE_SCORE and suspect and targeted and not fitness:
+            return self._count(Verdict(UNSAFE, "score", "Abusive language", score))
+        if score <= SAFE_SCORE and len(text) <= SAFE_MAX_CHARS and fitness and not targeted and not suspect:
+            return self._count(Verdict(SAFE, "score", score=score))
+        return self._count(Verdict(ESCALATE, "score", score=score))
+
+    def remember_rejected(self, text: str, reason: Optional[str]):
+        with self._lock:
+            self._rejected[content_hash(text)] = reason or "Inappropriate content"
+            while len(self._rejected) > self.max_rejected:
+                self._rejected.popitem(last=False)
+
+    def record_llm(self, is_safe: bool):
+        self._count(Verdict(SAFE if is_safe else UNSAFE, "llm"))
+
+    def _count(self, verdict: Verdict) -> Verdict:
+        with self._lock:
+            stage = self._counts.setdefault(verdict.stage, {SAFE: 0, UNSAFE: 0, ESCALATE: 0})
+            stage[verdict.decision] += 1
+        return verdict
+
+    def stats(self) -> dict:
+        with self._lock:
+            stages = {name: dict(counts) for name, counts in self._counts.items()}
+            rejected = len(self._rejected)
+        local = sum(c[SAFE] + c[UNSAFE] for name, c in stages.items() if name != "llm")
+        escalated = sum(c[ESCALATE] for c in stages.values())
+        return {
+            "stages": stages,
+            "decided_locally": local,
+            "escalated": escalated,
+            "local_rate": round(local / (local + escalated), 4) if local + escalated else 0.0,
+            "rejected_hashes": rejected,
+        }
+
+
+moderation_filter = ModerationFilter()
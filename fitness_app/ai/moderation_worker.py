@@ -0,0 +1,134 @@
+"""
+Background moderation of new community posts.
+
+create_post only queues the post id. A periodic job drains the queue, runs
+each post through the local pre-filter (moderation_filter.py), classifies
+the ambiguous ones, up to BATCH_SIZE per Gemini call, and writes the resulting
+MonitoringLog rows and deletions in one transaction per batch, using its own
+database sessions. Ids still queued when the process dies are not moderated.
+"""
+import asyncio
+import logging
+import os
+import threading
+from collections import deque
+from typing import Deque, Dict, List
+
+from starlette.concurrency import run_in_threadpool
+
+from .. import crud
+from ..core.database import SessionLocal
+from . import gateway, moderator
+from .moderation_filter import ESCALATE, SAFE, moderation_filter
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = int(os.getenv("MODERATION_BATCH_SIZE", 20))
+FLUSH_SECONDS = float(os.getenv("MODERATION_FLUSH_SECONDS", 2))
+MAX_ATTEMPTS = 3
+MAX_CONTENT_CHARS = 2000 # Per post in the prompt; longer posts are judged on their start
+
+_pending: Deque[int] = deque()
+_attempts: Dict[int, int] = {}
+_lock = threading.Lock()
+stats = {"posts_checked": 0, "posts_removed": 0, "ai_calls": 0, "failed_calls": 0, "given_up": 0}
+
+
+def enqueue(post_id: int):
+    with _lock:
+        _pending.append(post_id)
+
+
+def _take(limit: int) -> List[int]:
+    with _lock:
+        return [_pending.popleft() for _ in range(min(limit, len(_pending)))]
+
+
+def _retry_or_give_up(post_ids: List[int]):
+    # Fails open like the single-post check: after MAX_ATTEMPTS the post stays up.
+    with _lock:
+        for post_id in post_ids:
+            _attempts[post_id] = _attempts.get(post_id, 0) + 1
+            if _attempts[post_id] >= MAX_ATTEMPTS:
+                del _attempts[post_id]
+                stats["given_up"] += 1
+                logger.error(f"Giving up moderating post {post_id} after {MAX_ATTEMPTS} attempts")
+            else:
+                _pending.append(post_id)
+
+
+def _load(post_ids: List[int]) -> Dict[int, tuple]:
+    db = SessionLocal()
+    try:
+        return {post.id: (post.user_id, post.content or "") for post in crud.get_posts_by_ids(db, post_ids)}
+    finally:
+        db.close()
+
+
+def _remove(removals: List[tuple]) -> int:
+    db = SessionLocal()
+    try:
+        return crud.remove_unsafe_posts(db, removals)
+    finally:
+        db.close()
+
+
+async def _moderate_batch(post_ids: List[int]):
+    posts = await run_in_threadpool(_load, post_ids) # Deleted meanwhile -> simply absent
+    if not posts:
+        return
+
+    # Clear-cut posts are decided locally; only the rest go to Gemini.
+    verdicts = {}
+    escalated = {}
+    for post_id, (_, content) in posts.items():
+        local = moderation_filter.check(content)
+        if local.decision == ESCALATE:
+            escalated[post_id] = content[:MAX_CONTENT_CHARS]
+        else:
+            verdicts[post_id] = (local.decision == SAFE, local.reason)
+
+    if escalated:
+        stats["ai_calls"] += 1
+        try:
+            verdicts.update(await moderator.check_batch(escalated))
+        except gateway.AIError as e:
+            stats["failed_calls"] += 1
+            logger.warning(f"Batch moderation of {len(escalated)} posts failed ({e}); will retry")
+
+    missing = [post_id for post_id in escalated if post_id not in verdicts]
+    if missing:
+        _retry_or_give_up(missing)
+    with _lock:
+        for post_id in verdicts:
+            _attempts.pop(post_id, None)
+    removals = [
+        (post_id, posts[post_id][0], posts[post_id][1], reason)
+        for post_id, (is_safe, reason) in verdicts.items()
+        if not is_safe
+    ]
+    removed = await run_in_threadpool(_remove, removals)
+    stats["posts_checked"] += len(verdicts)
+    stats["posts_removed"] += removed
+    if removed:
+        logger.info(f"Moderation removed {removed} of {len(verdicts)} posts")
+
+
+async def drain():
+    """Moderates everything queued so far, BATCH_SIZE posts per call, batches in parallel."""
+    batches = []
+    while True:
+        batch = _take(BATCH_SIZE)
+        if not batch:
+            break
+        batches.append(batch)
+    results = await asyncio.gather(*[_moderate_batch(batch) for batch in batches], return_exceptions=True)
+    for batch, result in zip(batches, results):
+        if isinstance(result, Exception):
+            logger.error(f"Moderation batch failed: {result!r}")
+            _retry_or_give_up(batch)
+
+
+def queue_stats() -> dict:
+    with _lock:
+        return {**stats, "queued": len(_pending), "batch_size": BATCH_SIZE, "prefilter": moderation_filter.stats()}
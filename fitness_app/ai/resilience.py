@@ -0,0 +1,338 @@
+"""
+Load protection around calls to the Gemini API.
+
+- Bulkheads: each feature gets its own cap on in-flight calls and a short,
+  bounded wait queue, so a slow feature can't take every connection.
+- Adaptive limit: one AIMD limit on total in-flight calls. It grows by one
+  per limit's worth of fast successes and halves on timeouts, upstream
+  errors or slow responses.
+- Circuit breakers (one per model): trip when the recent error rate or
+  slow-call rate is too high; while open, calls are rejected immediately so
+  callers serve their fallback messages without waiting on Gemini.
+
+"Slow" is per feature: each call passes its feature's slow_after threshold
+(derived from the feature's SLO by the gateway), so a 20s workout plan isn't
+judged by a chat's target. Calls without one (features with no SLO) only
+count for errors.
+- Latency samples per (feature, model), which the gateway uses to decide
+  when to hedge a slow call.
+
+All state is per process.
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+QUEUE_TIMEOUT = float(os.getenv("AI_QUEUE_TIMEOUT", 5))
+
+ADAPTIVE_INITIAL_LIMIT = float(os.getenv("AI_ADAPTIVE_INITIAL_LIMIT", 10))
+ADAPTIVE_MIN_LIMIT = float(os.getenv("AI_ADAPTIVE_MIN_LIMIT", 2))
+ADAPTIVE_MAX_LIMIT = float(os.getenv("AI_ADAPTIVE_MAX_LIMIT", 50))
+ADAPTIVE_MAX_QUEUE = int(os.getenv("AI_ADAPTIVE_MAX_QUEUE", 100))
+ADAPTIVE_DECREASE_COOLDOWN = 1.0 # One burst of failures halves the limit once, not once per call
+
+BREAKER_WINDOW_SECONDS = float(os.getenv("AI_BREAKER_WINDOW_SECONDS", 30))
+BREAKER_MIN_CALLS = int(os.getenv("AI_BREAKER_MIN_CALLS", 10))
+BREAKER_ERROR_RATE = float(os.getenv("AI_BREAKER_ERROR_RATE", 0.5))
+BREAKER_SLOW_CALL_RATE = float(os.getenv("AI_BREAKER_SLOW_CALL_RATE", 0.8))
+BREAKER_OPEN_SECONDS = float(os.getenv("AI_BREAKER_OPEN_SECONDS", 30))
+BREAKER_HALF_OPEN_CALLS = int(os.getenv("AI_BREAKER_HALF_OPEN_CALLS", 1))
+
+LATENCY_SAMPLES = 200
+LATENCY_MIN_SAMPLES = 20
+
+
+class Rejected(Exception):
+    """The call was not admitted (breaker open, queue full or queue wait timed out)."""
+
+
+class ConcurrencyLimiter:
+    """In-flight cap with a FIFO wait queue of bounded length and wait time."""
+
+    def __init__(self, name: str, limit: float, max_queue: int, queue_timeout: float = QUEUE_TIMEOUT):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.rejected = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    @property
+    def capacity(self) -> int:
+        return max(1, int(self.limit))
+
+    async def acquire(self):
+        if self.in_flight < self.capacity and not self._waiters:
+            self.in_flight += 1
+            return
+        if len(self._waiters) >= self.max_queue:
+            self.rejected += 1
+            raise Rejected(f"{self.name}: queue full ({self.max_queue} waiting)")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed to us as we gave up; pass it on.
+                self.release()
+            elif waiter in self._waiters:
+                self._waiters.remove(waiter)
+            if isinstance(e, asyncio.TimeoutError):
+                self.rejected += 1
+                raise Rejected(f"{self.name}: no slot within {self.queue_timeout}s") from e
+            raise
+
+    def release(self):
+        self.in_flight -= 1
+        self._wake()
+
+    def _wake(self):
+        # Slots are handed over directly, so a new arrival can't jump the queue.
+        while self._waiters and self.in_flight < self.capacity:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    def stats(self) -> dict:
+        return {
+            "limit": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "queued": len(self._waiters),
+            "max_queue": self.max_queue,
+            "rejected": self.rejected,
+        }
+
+
+class AdaptiveLimiter(ConcurrencyLimiter):
+    """ConcurrencyLimiter whose limit follows AIMD: +1/limit per fast success, x0.5 on overload."""
+
+    def __init__(self, name: str, initial: float, min_limit: float, max_limit: float, max_queue: int):
+        super().__init__(name, initial, max_queue)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self._last_decrease = 0.0
+
+    def on_success(self, slow: bool):
+        if slow:
+            self.on_overload()
+            return
+        self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+        self._wake()
+
+    def on_overload(self):
+        now = time.monotonic()
+        if now - self._last_decrease < ADAPTIVE_DECREASE_COOLDOWN:
+            return
+        self._last_decrease = now
+        previous = self.limit
+        self.limit = max(self.min_limit, self.limit / 2)
+        if self.limit < previous:
+            logger.warning(f"AI adaptive limit decreased {previous:.1f} -> {self.limit:.1f}")
+
+    def stats(self) -> dict:
+        return {**super().stats(), "min_limit": self.min_limit, "max_limit": self.max_limit}
+
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str):
+        self.name = name
+        self.state = self.CLOSED
+        self.opened_at = 0.0
+        self.trips = 0
+        self.rejected = 0
+        self._probes = 0
+        self._calls: Deque[Tuple[float, bool, bool]] = deque() # (time, failed, slow)
+
+    def allow(self):
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < BREAKER_OPEN_SECONDS:
+                self.rejected += 1
+                raise Rejected(f"circuit for {self.name} is open")
+            self.state = self.HALF_OPEN
+            self._probes = 0
+            logger.info(f"AI circuit for {self.name} half-open; probing")
+        if self.state == self.HALF_OPEN:
+            if self._probes >= BREAKER_HALF_OPEN_CALLS:
+                self.rejected += 1
+                raise Rejected(f"circuit for {self.name} is half-open")
+            self._probes += 1
+
+    def record(self, failed: bool, slow: bool):
+        if self.state == self.HALF_OPEN:
+            self._probes -= 1
+            if failed or slow:
+                self._trip("probe failed")
+            else:
+                self.state = self.CLOSED
+                self._calls.clear()
+                logger.info(f"AI circuit for {self.name} closed")
+            return
+        if self.state == self.OPEN:
+            return # Late result of a call admitted before the trip
+
+        now = time.monotonic()
+        self._calls.append((now, failed, slow))
+        while self._calls and self._calls[0][0] < now - BREAKER_WINDOW_SECONDS:
+            self._calls.popleft()
+        if len(self._calls) < BREAKER_MIN_CALLS:
+            return
+        error_rate = sum(1 for _, f, _ in self._calls if f) / len(self._calls)
+        slow_rate = sum(1 for _, _, s in self._calls if s) / len(self._calls)
+        if error_rate >= BREAKER_ERROR_RATE:
+            self._trip(f"error rate {error_rate:.0%}")
+        elif slow_rate >= BREAKER_SLOW_CALL_RATE:
+            self._trip(f"slow-call rate {slow_rate:.0%}")
+
+    def release_probe(self):
+        # An admitted probe ended without a verdict (e.g. the client went away).
+        if self.state == self.HALF_OPEN and self._probes > 0:
+            self._probes -= 1
+
+    def _trip(self, reason: str):
+        self.state = self.OPEN
+        self.opened_at = time.monotonic()
+        self.trips += 1
+        self._calls.clear()
+        logger.error(f"AI circuit for {self.name} opened ({reason}); serving fallbacks for {BREAKER_OPEN_SECONDS:.0f}s")
+
+    def stats(self) -> dict:
+        calls = len(self._calls)
+        return {
+            "state": self.state,
+            "trips": self.trips,
+            "rejected": self.rejected,
+            "window_calls": calls,
+            "window_error_rate": round(sum(1 for _, f, _ in self._calls if f) / calls, 4) if calls else 0.0,
+            "window_slow_rate": round(sum(1 for _, _, s in self._calls if s) / calls, 4) if calls else 0.0,
+            "retry_in_s": round(max(0.0, self.opened_at + BREAKER_OPEN_SECONDS - time.monotonic()), 1) if self.state == self.OPEN else 0.0,
+        }
+
+
+adaptive_limiter = AdaptiveLimiter(
+    "gemini",
+    initial=ADAPTIVE_INITIAL_LIMIT,
+    min_limit=ADAPTIVE_MIN_LIMIT,
+    max_limit=ADAPTIVE_MAX_LIMIT,
+    max_queue=ADAPTIVE_MAX_QUEUE,
+)
+_bulkheads: Dict[str, ConcurrencyLimiter] = {}
+_breakers: Dict[str, CircuitBreaker] = {}
+_latencies: Dict[Tuple[str, str], Deque[float]] = {}
+_hedging: Dict[str, Dict[str, int]] = {}
+
+
+def bulkhead(feature: str, max_in_flight: int, max_queue: int) -> ConcurrencyLimiter:
+    if feature not in _bulkheads:
+        _bulkheads[feature] = ConcurrencyLimiter(f"bulkhead:{feature}", max_in_flight, max_queue)
+    return _bulkheads[feature]
+
+
+def breaker(model: str) -> CircuitBreaker:
+    if model not in _breakers:
+        _breakers[model] = CircuitBreaker(model)
+    return _breakers[model]
+
+
+def latency_percentile(feature: str, model: str, q: float) -> Optional[float]:
+    """Recent successful-call latency at quantile q, or None until enough samples exist."""
+    samples = _latencies.get((feature, model))
+    if not samples or len(samples) < LATENCY_MIN_SAMPLES:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def record_hedge(feature: str, event: str):
+    counters = _hedging.setdefault(feature, {"hedges": 0, "hedge_wins": 0, "fallbacks": 0, "fallback_answers": 0})
+    counters[event] += 1
+
+
+class Call:
+    """Handed to the caller inside admit(); the caller reports upstream failures on it."""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.latency: Optional[float] = None
+        self.failed = False
+
+    def responded(self):
+        # Response headers arrived: full generation time, or time to first token when streaming.
+        if self.latency is None:
+            self.latency = time.monotonic() - self.started
+
+    def fail(self):
+        self.failed = True
+
+
+@asynccontextmanager
+async def admit(feature: str, model: str, max_in_flight: int, max_queue: int, slow_after: Optional[float] = None, track_latency: bool = True):
+    """
+    Admits one Gemini call through the model's breaker, the feature's bulkhead and the
+    adaptive limit, in that order. Raises Rejected when any of them turns it away.
+    A success slower than slow_after seconds counts as slow; None never does.
+    track_latency=False keeps calls with a different latency profile (streams) out of the samples.
+    """
+    circuit = breaker(model)
+    circuit.allow()
+    feature_bulkhead = bulkhead(feature, max_in_flight, max_queue)
+    try:
+        await feature_bulkhead.acquire()
+    except BaseException:
+        circuit.release_probe()
+        raise
+    try:
+        await adaptive_limiter.acquire()
+    except BaseException:
+        feature_bulkhead.release()
+        circuit.release_probe()
+        raise
+
+    call = Call()
+    completed = False
+    try:
+        yield call
+        completed = True
+    finally:
+        feature_bulkhead.release()
+        adaptive_limiter.release()
+        latency = call.latency if call.latency is not None else time.monotonic() - call.started
+        if call.failed:
+            circuit.record(True, False)
+            adaptive_limiter.on_overload()
+        elif completed or call.latency is not None:
+            slow = slow_after is not None and latency > slow_after
+            circuit.record(False, slow)
+            adaptive_limiter.on_success(slow)
+            if track_latency and call.latency is not None:
+                _latencies.setdefault((feature, model), deque(maxlen=LATENCY_SAMPLES)).append(latency)
+        else:
+            # Cancelled before Gemini answered: no verdict on its health.
+            circuit.release_probe()
+
+
+def stats() -> dict:
+    return {
+        "breakers": {name: circuit.stats() for name, circuit in _breakers.items()},
+        "adaptive_limit": adaptive_limiter.stats(),
+        "bulkheads": {feature: limiter.stats() for feature, limiter in _bulkheads.items()},
+        "hedging": {feature: dict(counters) for feature, counters in _hedging.items()},
+        "latency_p95_s": {
+            f"{feature}:{model}": round(p95, 3)
+            for (feature, model) in list(_latencies)
+            if (p95 := latency_percentile(feature, model, 0.95)) is not None
+        },
+    }
@@ -0,0 +1,194 @@
+"""
+Content-addressed cache for AI responses.
+
+Keys are a hash of (model, prompt, image digest), so identical requests share
+an entry no matter which user or endpoint made them. Entries live in an
+in-memory LRU and, when AI_CACHE_DB_PATH is set, in a SQLite file that
+survives restarts and is shared by the workers on one host.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+MEMORY_MAX_ENTRIES = int(os.getenv("AI_CACHE_MEMORY_ENTRIES", 2000))
+DISK_PATH = os.getenv("AI_CACHE_DB_PATH", "")
+DISK_MAX_ENTRIES = int(os.getenv("AI_CACHE_DISK_ENTRIES", 50000))
+
+
+def cache_key(model: str, prompt: str, image_data: Optional[str] = None, mime_type: Optional[str] = None) -> str:
+    image_digest = hashlib.sha256(image_data.encode("utf-8")).hexdigest() if image_data else None
+    raw = json.dumps(
+        {"model": model, "prompt": prompt, "image": image_digest, "mime_type": mime_type if image_data else None},
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class _DiskTier:
+    def __init__(self, path: str, max_entries: int):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._stores_since_prune = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5.0)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS ai_response_cache ("
+                "key TEXT PRIMARY KEY, feature TEXT, response TEXT NOT NULL, "
+                "latency_ms REAL, expires_at REAL NOT NULL, created_at REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS ix_ai_response_cache_expires ON ai_response_cache (expires_at)")
+            self._conn.commit()
+
+    def get(self, key: str) -> Optional[Tuple[str, float, float]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, latency_ms, expires_at FROM ai_response_cache WHERE key = ? AND expires_at > ?",
+                (key, time.time()),
+            ).fetchone()
+        return row
+
+    def set(self, key: str, feature: str, response: str, latency_ms: float, expires_at: float):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO ai_response_cache (key, feature, response, latency_ms, expires_at, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, feature, response, latency_ms, expires_at, time.time()),
+            )
+            self._conn.commit()
+            self._stores_since_prune += 1
+            if self._stores_since_prune >= 100:
+                self._stores_since_prune = 0
+                self._prune_locked()
+
+    def prune(self):
+        with self._lock:
+            self._prune_locked()
+
+    def _prune_locked(self):
+        self._conn.execute("DELETE FROM ai_response_cache WHERE expires_at <= ?", (time.time(),))
+        # Keep the newest max_entries
+        self._conn.execute(
+            "DELETE FROM ai_response_cache WHERE key IN ("
+            "SELECT key FROM ai_response_cache ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+        self._conn.commit()
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM ai_response_cache").fetchone()[0]
+
+
+class ResponseCache:
+    def __init__(self, max_entries: int = MEMORY_MAX_ENTRIES, disk_path: str = DISK_PATH, disk_max_entries: int = DISK_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict() # key -> (expires_at, response, latency_ms)
+        self._lock = threading.Lock()
+        self._disk = None
+        if disk_path:
+            try:
+                self._disk = _DiskTier(disk_path, disk_max_entries)
+            except sqlite3.Error as e:
+                logger.error(f"AI response cache: disk tier disabled ({e})")
+        self._metrics: dict = {}
+
+    def _feature_metrics(self, feature: str) -> dict:
+        return self._metrics.setdefault(feature, {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "latency_saved_ms": 0.0})
+
+    async def get(self, feature: str, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                metrics = self._feature_metrics(feature)
+                metrics["memory_hits"] += 1
+                metrics["latency_saved_ms"] += entry[2]
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+
+        row = None
+        if self._disk is not None:
+            try:
+                row = await asyncio.to_thread(self._disk.get, key)
+            except sqlite3.Error as e:
+                logger.warning(f"AI response cache: disk read failed ({e})")
+        with self._lock:
+            metrics = self._feature_metrics(feature)
+            if row is None:
+                metrics["misses"] += 1
+                return None
+            response, latency_ms, expires_at = row
+            metrics["disk_hits"] += 1
+            metrics["latency_saved_ms"] += latency_ms or 0.0
+            self._put_memory(key, expires_at, response, latency_ms or 0.0)
+            return response
+
+    async def set(self, feature: str, key: str, response: str, ttl_seconds: float, latency_ms: float):
+        expires_at = time.time() + ttl_seconds
+        with self._lock:
+            self._put_memory(key, expires_at, response, latency_ms)
+            self._feature_metrics(feature)["stores"] += 1
+        if self._disk is not None:
+            try:
+                await asyncio.to_thread(self._disk.set, key, feature, response, latency_ms, expires_at)
+            except sqlite3.Error as e:
+                logger.warning(f"AI response cache: disk write failed ({e})")
+
+    def _put_memory(self, key: str, expires_at: float, response: str, latency_ms: float):
+        # Caller holds the lock
+        self._entries[key] = (expires_at, response, latency_ms)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def prune(self):
+        now = time.time()
+        with self._lock:
+            for key in [k for k, entry in self._entries.items() if entry[0] <= now]:
+                del self._entries[key]
+        if self._disk is not None:
+            self._disk.prune()
+
+    def stats(self) -> dict:
+        with self._lock:
+            features = {name: dict(metrics) for name, metrics in self._metrics.items()}
+            entries = len(self._entries)
+        totals = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "latency_saved_ms": 0.0}
+        for metrics in features.values():
+            for name in totals:
+                totals[name] += metrics[name]
+        lookups = totals["memory_hits"] + totals["disk_hits"] + totals["misses"]
+        for metrics in features.values():
+            feature_lookups = metrics["memory_hits"] + metrics["disk_hits"] + metrics["misses"]
+            metrics["hit_rate"] = round((metrics["memory_hits"] + metrics["disk_hits"]) / feature_lookups, 4) if feature_lookups else 0.0
+            metrics["latency_saved_ms"] = round(metrics["latency_saved_ms"], 1)
+        return {
+            "name": "ai_responses",
+            "memory_entries": entries,
+            "memory_max_entries": self.max_entries,
+            "disk_enabled": self._disk is not None,
+            "disk_entries": self._disk.count() if self._disk is not None else 0,
+            **{name: round(value, 1) if isinstance(value, float) else value for name, value in totals.items()},
+            "hit_rate": round((totals["memory_hits"] + totals["disk_hits"]) / lookups, 4) if lookups else 0.0,
+            "features": features,
+        }
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,96 @@
+"""
+Compact summary of a user's profile and recent activity for AI coach prompts
+(/ai/chat, with or without a server-side session).
+
+Only the latest few rows of each kind are read, each with one limited query
+on an (owner_id, date) index, so the cost doesn't grow with the user's
+history. The rendered text is cached per user until their next write (crud
+invalidates user_context_cache on profile, workout, meal and habit writes).
+"""
+import logging
+from typing import Optional
+
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from .. import models
+from ..analytics.cache import user_context_cache
+
+logger = logging.getLogger(__name__)
+
+RECENT_WORKOUTS = 5
+RECENT_MEALS = 5
+RECENT_HABITS = 3
+CACHE_KEY = "coach"
+
+
+def _recent(db: Session, model, columns, user_id: int, limit: int) -> list:
+    return (
+        db.query(*columns)
+        .filter(model.owner_id == user_id)
+        .order_by(model.date.desc(), model.id.desc())
+        .limit(limit)
+        .all()
+    )
+
+
+def render(db: Session, user: models.User) -> str:
+    workouts = _recent(db, models.WorkoutLog, (models.WorkoutLog.date, models.WorkoutLog.name, models.WorkoutLog.notes), user.id, RECENT_WORKOUTS)
+    habits = _recent(
+        db, models.Habit, (models.Habit.date, models.Habit.sleep_hours, models.Habit.water_liters, models.Habit.steps), user.id, RECENT_HABITS
+    )
+    meals = _recent(
+        db,
+        models.MealLog,
+        (models.MealLog.date, models.MealLog.meal_type, models.MealLog.description, models.MealLog.calories,
+         models.MealLog.protein_g, models.MealLog.carbs_g, models.MealLog.fats_g),
+        user.id,
+        RECENT_MEALS,
+    )
+
+    workout_summary = "\n".join(
+        f"- On {w.date}: {w.name} (Notes: {w.notes or 'None'})" for w in workouts
+    ) or "No recent workouts logged."
+    habit_summary = "\n".join(
+        f"- On {h.date}: Sleep: {h.sleep_hours or 'N/A'}h, Water: {h.water_liters or 'N/A'}L, Steps: {h.steps or 'N/A'}" for h in habits
+    ) or "No habit data logged yet."
+    meal_summary = "\n".join(
+        f"- On {m.date} ({m.meal_type}): {m.description} (~{m.calories} cal, P:{m.protein_g}g, C:{m.carbs_g}g, F:{m.fats_g}g)" for m in meals
+    ) or "No recent meals logged."
+
+    return f"""User Profile:
+    - Age: {user.age if user.age else 'N/A'}
+    - Weight: {user.weight}kg
+    - Height: {user.height}cm
+    - Goals: {user.goals if user.goals else 'Not specified'}
+
+User's Recent Activity:
+[Workouts]
+{workout_summary}
+
+[Habits]
+{habit_summary}
+
+[Meals]
+{meal_summary}"""
+
+
+def build(db: Session, user: models.User) -> str:
+    """Returns the user's context block, rendering it only after a write made the cached one stale."""
+    cached = user_context_cache.get(user.id, CACHE_KEY)
+    if cached is not None:
+        return cached
+    # Read the generation first: a write that lands while rendering keeps this result out of the cache.
+    generation = user_context_cache.generation(user.id)
+    context = render(db, user)
+    user_context_cache.set(user.id, CACHE_KEY, context, generation)
+    return context
+
+
+async def for_prompt(db: Session, user: models.User) -> Optional[str]:
+    """build() off the event loop; None if it fails, so chat still answers without the user's data."""
+    try:
+        return await run_in_threadpool(build, db, user)
+    except Exception as e:
+        logger.error(f"Could not build coach context for user {user.id}: {e}")
+        return None
@@ -0,0 +1,477 @@
+"""
+Bulk import of workout history pasted from notes apps.
+
+A job splits the document into entries at date headings ("2024-03-05",
+"Mon 5 March", "3/5/24 - Push day"), parses each entry with the local
+shorthand parser (workout_parser.parse_locally) and sends only the rest to
+Gemini, many entries per call: entries are packed in document order until
+the prompt's input budget or the estimated output budget is reached. Exercise
+names are resolved against the exercise catalogue (exact, alias, singular,
+fuzzy). Names that still don't match are not imported: the exercise catalogue
+is shared and admin-curated, so they are reported on the job instead.
+Everything is written in one bulk transaction together with the job's
+completion, so a job that is retried after a worker died can't import twice.
+
+Jobs are rows in workout_import_jobs, claimed with a compare-and-set on their
+attempt counter; progress is written back as the job advances.
+"""
+import asyncio
+import difflib
+import json
+import logging
+import os
+import re
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from .. import crud, models
+from ..core.database import SessionLocal
+from . import gateway
+from .workout_parser import parse_locally
+
+logger = logging.getLogger(__name__)
+
+POLL_SECONDS = int(os.getenv("WORKOUT_IMPORT_POLL_SECONDS", 10))
+STALE_SECONDS = int(os.getenv("WORKOUT_IMPORT_STALE_SECONDS", 600)) # Running job without progress this long -> worker presumed dead
+JOBS_PER_WORKER = 2
+AI_CONCURRENCY = int(os.getenv("WORKOUT_IMPORT_AI_CONCURRENCY", 2))
+PROMPT_INPUT_TOKENS = int(os.getenv("WORKOUT_IMPORT_INPUT_TOKENS", 2000)) # Entry text per call
+PROMPT_OUTPUT_TOKENS = int(os.getenv("WORKOUT_IMPORT_OUTPUT_TOKENS", 6000)) # Estimated JSON per call, below the model's output limit
+MAX_ENTRIES_PER_PROMPT = 25
+MAX_ENTRY_CHARS = 2000
+MAX_ERRORS = 50 # Error samples kept on the job
+MAX_UNMATCHED = 100 # Unmatched exercise names kept on the job
+MAX_ACTIVE_JOBS_PER_USER = int(os.getenv("WORKOUT_IMPORT_MAX_ACTIVE_JOBS", 1))
+DATE_ORDER = os.getenv("WORKOUT_IMPORT_DATE_ORDER", "dmy") # For all-ambiguous numeric dates like 3/5/24
+MAX_SETS = 20
+MAX_REPS = 100
+MAX_WEIGHT = 1000
+
+_MONTHS = {
+    "jan": 1, "feb": 2, "mar": 3, "apr": 4, "may": 5, "jun": 6, "jul": 7, "aug": 8,
+    "sep": 9, "oct": 10, "nov": 11, "dec": 12,
+}
+_MONTH = r"(?P<month>jan(?:uary)?|feb(?:ruary)?|mar(?:ch)?|apr(?:il)?|may|june?|july?|aug(?:ust)?|sept?(?:ember)?|oct(?:ober)?|nov(?:ember)?|dec(?:ember)?)\.?"
+_WEEKDAY = r"(?:(?:mon|tue|wed|thu|fri|sat|sun)[a-z]*\.?,?\s+)?"
+_DAY = r"(?P<day>\d{1,2})(?:st|nd|rd|th)?"
+_YEAR = r"(?:,?\s+(?P<year>\d{4}))?"
+_END = r"(?=$|[\s,:\-–|)])"
+_HEADINGS = [
+    re.compile(rf"^{_WEEKDAY}(?P<year>\d{{4}})-(?P<month>\d{{1,2}})-(?P<day>\d{{1,2}}){_END}"),
+    re.compile(rf"^{_WEEKDAY}(?P<first>\d{{1,2}})(?P<sep>[/.])(?P<second>\d{{1,2}})(?:(?P=sep)(?P<year>\d{{4}}|\d{{2}}))?{_END}"),
+    re.compile(rf"^{_WEEKDAY}{_DAY}\s+{_MONTH}{_YEAR}{_END}"),
+    re.compile(rf"^{_WEEKDAY}{_MONTH}\s+{_DAY}{_YEAR}{_END}"),
+]
+_NOT_A_TITLE = re.compile(r"^\s*(?:reps?\b|x\b|@|kg|lb|km\b|mi\b|miles?\b|m\b|mins?\b|minutes?\b|secs?\b|hrs?\b|hours?\b)")
+_BULLET = re.compile(r"^[\s#*>\-•]+")
+
+# Common shorthand -> catalogue name; applied after normalisation.
+ALIASES = {
+    "bench": "bench press", "bp": "bench press", "ohp": "overhead press", "military press": "overhead press",
+    "dl": "deadlift", "rdl": "romanian deadlift", "squat": "squat", "back squat": "squat",
+    "pullup": "pull up", "chinup": "chin up", "pushup": "push up", "situp": "sit up",
+}
+
+
+class Entry:
+    def __init__(self, index: int, day: Optional[date], title: Optional[str], lines: List[str]):
+        self.index = index
+        self.date = day
+        self.title = title
+        self.text = "\n".join(lines)[:MAX_ENTRY_CHARS]
+
+
+# --- Splitting ---
+
+def _dated(match: Optional[re.Match]) -> Optional[re.Match]:
+    # "2.5 km run" is a distance: a dotted d.m only counts as a date with a year.
+    if match and match.groupdict().get("sep") == "." and not match.group("year"):
+        return None
+    return match
+
+
+def _numeric_order(lines: List[str]) -> str:
+    # Decides d/m vs m/d once per document, from any date that can only be read one way.
+    pattern = _HEADINGS[1]
+    for line in lines:
+        match = _dated(pattern.match(line))
+        if match and int(match.group("first")) > 12:
+            return "dmy"
+        if match and int(match.group("second")) > 12:
+            return "mdy"
+    return DATE_ORDER
+
+
+def _heading_date(line: str, today: date, order: str, previous: Optional[date] = None) -> Optional[Tuple[date, str]]:
+    """
+    Returns (date, rest of the line) if the line starts with a date.
+    A date without a year follows the previous heading's year, or is the latest such date up to today.
+    """
+    for pattern in _HEADINGS:
+        match = _dated(pattern.match(line))
+        if not match:
+            continue
+        groups = match.groupdict()
+        if "first" in groups:
+            day, month = int(groups["first"]), int(groups["second"])
+            if order == "mdy":
+                day, month = month, day
+        else:
+            day = int(groups["day"])
+            month = int(groups["month"]) if groups["month"].isdigit() else _MONTHS[groups["month"][:3]]
+        year = groups.get("year")
+        try:
+            if year:
+                return date(int(year) + (2000 if len(year) == 2 else 0), month, day), line[match.end():]
+            if previous is not None:
+                candidate = date(previous.year, month, day)
+                if candidate < previous - timedelta(days=183): # Log crossed into a new year
+                    candidate = date(previous.year + 1, month, day)
+            else:
+                candidate = date(today.year, month, day)
+                if candidate > today:
+                    candidate = date(today.year - 1, month, day)
+            return candidate, line[match.end():]
+        except ValueError:
+            return None # 31/02 and friends
+    return None
+
+
+def split_entries(text: str, today: Optional[date] = None) -> List[Entry]:
+    """
+    Splits a document into workout entries at date headings.
+    Documents without any headings are split at blank lines and dated today.
+    """
+    today = today or date.today()
+    lines = [_BULLET.sub("", line).strip() for line in text.splitlines()]
+    order = _numeric_order([line.lower() for line in lines])
+    blocks: List[Tuple[Optional[date], Optional[str], List[str]]] = []
+    has_headings = False
+    previous = None
+    for line in lines:
+        heading = _heading_date(line.lower(), today, order, previous) if line else None
+        if heading and not _NOT_A_TITLE.match(heading[1]):
+            has_headings = True
+            previous = heading[0]
+            rest = line[len(line) - len(heading[1]):].strip(" ,:-–|()")
+            title = rest if rest and not any(c.isdigit() for c in rest) else None
+            blocks.append((heading[0], title, [rest] if rest and title is None else []))
+        elif not line:
+            if not has_headings and blocks and blocks[-1][2]:
+                blocks.append((None, None, []))
+        elif blocks:
+            blocks[-1][2].append(line)
+        else:
+            blocks.append((None, None, [line]))
+
+    entries = []
+    for day, title, body in blocks:
+        if not body and not title:
+            continue
+        if not has_headings:
+            day = today
+        if title is None and len(body) > 1 and not any(c.isdigit() for c in body[0]) and len(body[0]) <= 60:
+            title, body = body[0], body[1:] # "Push day" above the exercises
+        entries.append(Entry(len(entries) + 1, day, title, body))
+    return entries
+
+
+# --- Packing entries into prompts ---
+
+def _estimated_output_tokens(entry: Entry) -> int:
+    # Shorthand expands a lot: "3x10 @ 60" becomes three set objects of ~15 tokens each.
+    return 40 + 8 * gateway.estimate_tokens(entry.text)
+
+
+def pack(entries: List[Entry]) -> List[List[Entry]]:
+    """Groups entries, in document order, into prompts that stay within the input and output budgets."""
+    batches: List[List[Entry]] = []
+    current: List[Entry] = []
+    input_tokens = output_tokens = 0
+    for entry in entries:
+        entry_in, entry_out = gateway.estimate_tokens(entry.text), _estimated_output_tokens(entry)
+        if current and (
+            input_tokens + entry_in > PROMPT_INPUT_TOKENS
+            or output_tokens + entry_out > PROMPT_OUTPUT_TOKENS
+            or len(current) >= MAX_ENTRIES_PER_PROMPT
+        ):
+            batches.append(current)
+            current, input_tokens, output_tokens = [], 0, 0
+        current.append(entry)
+        input_tokens += entry_in
+        output_tokens += entry_out
+    if current:
+        batches.append(current)
+    return batches
+
+
+def build_prompt(batch: List[Entry]) -> str:
+    numbered = "\n\n".join(f"Entry {n}:\n{entry.text}" for n, entry in enumerate(batch, start=1))
+    return f"""
+    You convert workout log entries into JSON. Each numbered entry below is one workout session.
+    Return ONLY a JSON array with one object per entry that describes a workout:
+    {{"entry": 1, "name": "Short workout name", "logged_exercises": [{{"exercise_name": "Bench Press", "notes": null, "sets": [{{"reps": 10, "weight": 60.0, "weight_unit": "kg"}}]}}]}}
+
+    Rules:
+    - One set object per set: "3x10" is three sets of 10 reps.
+    - Bodyweight exercises have weight 0. Use "kg" unless the entry says lb or lbs.
+    - Leave out entries that are not workouts (rest days, notes).
+    - No markdown.
+
+    {numbered}
+    """
+
+
+def _workout_from_ai(item: dict) -> Optional[dict]:
+    exercises = []
+    for raw in item.get("logged_exercises") or []:
+        sets = []
+        for raw_set in raw.get("sets") or []:
+            reps, weight = int(raw_set.get("reps") or 0), float(raw_set.get("weight") or 0.0)
+            if not (0 < reps <= MAX_REPS and 0 <= weight <= MAX_WEIGHT):
+                continue
+            unit = "lbs" if str(raw_set.get("weight_unit", "kg")).lower().startswith("lb") else "kg"
+            sets.append({"set_number": len(sets) + 1, "reps": reps, "weight": weight, "weight_unit": unit})
+        name = str(raw.get("exercise_name") or raw.get("exercise_name_guess") or "").strip()
+        if name and sets:
+            exercises.append({"exercise_id": None, "exercise_name_guess": name, "notes": raw.get("notes"), "sets": sets[:MAX_SETS]})
+    if not exercises:
+        return None
+    return {"name": str(item.get("name") or "Workout")[:100], "logged_exercises": exercises}
+
+
+def parse_response(text: str, batch_size: int) -> Dict[int, dict]:
+    """Maps 1-based entry numbers to parsed workouts. Raises ValueError for a malformed answer."""
+    data = json.loads(text.replace("```json", "").replace("```", "").strip())
+    if not isinstance(data, list):
+        raise ValueError("Expected a JSON array")
+    parsed = {}
+    for item in data:
+        if not isinstance(item, dict):
+            continue
+        try:
+            number = int(item.get("entry"))
+            workout = _workout_from_ai(item)
+        except (TypeError, ValueError):
+            continue
+        if 1 <= number <= batch_size and workout is not None:
+            parsed[number] = workout
+    return parsed
+
+
+# --- Exercise resolution ---
+
+def _exercise_key(name: str) -> str:
+    words = re.sub(r"[^a-z0-9 ]", " ", name.lower().replace("-", " ")).split()
+    words = [w[:-1] if len(w) > 3 and w.endswith("s") and not w.endswith("ss") else w for w in words]
+    phrase = " ".join(words)
+    return ALIASES.get(phrase, phrase).replace(" ", "")
+
+
+class ExerciseResolver:
+    """Matches free-text exercise names to catalogue ids: normalised/alias match, then fuzzy."""
+
+    def __init__(self, catalogue: List[Tuple[int, str]]):
+        self._by_key: Dict[str, int] = {}
+        for exercise_id, name in sorted(catalogue, key=lambda row: len(row[1])):
+            self._by_key.setdefault(_exercise_key(name), exercise_id)
+        self._keys = list(self._by_key)
+        self._memo: Dict[str, Optional[int]] = {}
+
+    def resolve(self, name: str) -> Optional[int]:
+        key = _exercise_key(name)
+        if key not in self._memo:
+            exercise_id = self._by_key.get(key)
+            if exercise_id is None and key:
+                close = difflib.get_close_matches(key, self._keys, n=1, cutoff=0.85)
+                exercise_id = self._by_key[close[0]] if close else None
+            self._memo[key] = exercise_id
+        return self._memo[key]
+
+
+def _with_exercise_ids(workout: dict, resolver: ExerciseResolver) -> List[str]:
+    """Sets exercise ids and drops exercises not in the catalogue; returns the dropped names."""
+    matched, unmatched = [], []
+    for exercise in workout["logged_exercises"]:
+        guess = exercise.pop("exercise_name_guess")
+        exercise["exercise_id"] = resolver.resolve(guess)
+        if exercise["exercise_id"] is None:
+            unmatched.append(" ".join(guess.split()).title()[:100])
+        else:
+            matched.append(exercise)
+    workout["logged_exercises"] = matched
+    return unmatched
+
+
+# --- Job execution ---
+
+def _db_call(func, *args, **kwargs):
+    db = SessionLocal()
+    try:
+        return func(db, *args, **kwargs)
+    finally:
+        db.close()
+
+
+def _exercise_catalogue(db) -> List[Tuple[int, str]]:
+    return db.query(models.Exercise.id, models.Exercise.name).all()
+
+
+class _Lost(Exception):
+    """Another worker took the job over."""
+
+
+async def _parse_batch(batch: List[Entry], progress: dict, errors: list, results: Dict[int, dict], limit: asyncio.Semaphore):
+    async with limit:
+        progress["ai_calls"] += 1
+        try:
+            answer = await gateway.generate(build_prompt(batch), feature="workout_import")
+            parsed = parse_response(answer, len(batch))
+        except (gateway.AIResponseError, ValueError) as e:
+            if len(batch) > 1:
+                # Often a truncated answer: retry as two smaller prompts
+                logger.info(f"Import batch of {len(batch)} entries unusable ({e}); splitting")
+                middle = len(batch) // 2
+                parsed = None
+            else:
+                parsed = {}
+                errors.append({"entry": batch[0].index, "reason": "AI answer could not be read"})
+        except gateway.AIError as e:
+            logger.warning(f"Import batch of {len(batch)} entries failed: {e}")
+            parsed = {}
+            errors.extend({"entry": entry.index, "reason": "AI service unavailable"} for entry in batch)
+    if parsed is None:
+        await asyncio.gather(
+            _parse_batch(batch[:middle], progress, errors, results, limit),
+            _parse_batch(batch[middle:], progress, errors, results, limit),
+        )
+        return
+    for number, workout in parsed.items():
+        results[batch[number - 1].index] = workout
+    progress["parsed_by_ai"] += len(parsed)
+    reported = {e["entry"] for e in errors}
+    errors.extend(
+        {"entry": entry.index, "reason": "Not recognised as a workout"}
+        for number, entry in enumerate(batch, start=1)
+        if number not in parsed and entry.index not in reported
+    )
+
+
+async def process(job_id: int, attempt: int, user_id: int, text: str):
+    progress = {"total_entries": 0, "parsed_locally": 0, "parsed_by_ai": 0, "failed_entries": 0, "ai_calls": 0}
+    errors: List[dict] = []
+
+    async def report(**fields):
+        progress["failed_entries"] = len(errors)
+        if not await run_in_threadpool(_db_call, crud.update_workout_import_job, job_id, attempt, **progress, errors=json.dumps(errors[:MAX_ERRORS]), **fields):
+            raise _Lost()
+
+    try:
+        entries = split_entries(text)
+        progress["total_entries"] = len(entries)
+        workouts: Dict[int, dict] = {}
+        remaining = []
+        for entry in entries:
+            if entry.date is None:
+                errors.append({"entry": entry.index, "reason": "No date before this entry"})
+                continue
+            if not entry.text:
+                errors.append({"entry": entry.index, "reason": "No exercises"})
+                continue
+            parsed = parse_locally(entry.text, today=entry.date)
+            if parsed is None:
+                remaining.append(entry)
+            else:
+                workouts[entry.index] = parsed
+        progress["parsed_locally"] = len(workouts)
+        await report()
+
+        limit = asyncio.Semaphore(AI_CONCURRENCY)
+        ai_results: Dict[int, dict] = {}
+        batches = pack(remaining)
+        for start in range(0, len(batches), AI_CONCURRENCY):
+            await asyncio.gather(*[_parse_batch(batch, progress, errors, ai_results, limit) for batch in batches[start:start + AI_CONCURRENCY]])
+            await report() # Doubles as the heartbeat that keeps the job from looking stale
+
+        by_index = {entry.index: entry for entry in entries}
+        for index, workout in ai_results.items():
+            workout["date"] = by_index[index].date.isoformat()
+            workout["notes"] = by_index[index].text
+            workouts[index] = workout
+
+        resolver = ExerciseResolver(await run_in_threadpool(_db_call, _exercise_catalogue))
+        rows = []
+        unmatched: Dict[str, int] = {}
+        for index in sorted(workouts):
+            workout = workouts[index]
+            names = _with_exercise_ids(workout, resolver)
+            for name in names:
+                unmatched[name] = unmatched.get(name, 0) + 1
+            if not workout["logged_exercises"]:
+                errors.append({"entry": index, "reason": f"No known exercises ({', '.join(names)})"})
+                continue
+            title = by_index[index].title
+            rows.append({
+                "date": date.fromisoformat(workout["date"]),
+                "name": title or workout["name"],
+                "notes": workout.get("notes"),
+                "logged_exercises": workout["logged_exercises"],
+            })
+        progress["failed_entries"] = len(entries) - len(rows)
+        errors.sort(key=lambda e: e["entry"])
+        imported = await run_in_threadpool(
+            _db_call, crud.import_workout_logs, user_id, rows, job_id, attempt, **progress,
+            errors=json.dumps(errors[:MAX_ERRORS]),
+            unmatched_exercises=json.dumps(sorted(unmatched, key=unmatched.get, reverse=True)[:MAX_UNMATCHED]),
+        )
+        if imported is None:
+            raise _Lost()
+        logger.info(
+            f"Workout import {job_id}: {imported} of {len(entries)} entries imported "
+            f"({progress['parsed_locally']} locally, {progress['parsed_by_ai']} via {progress['ai_calls']} AI calls, "
+            f"{len(unmatched)} unmatched exercise names)"
+        )
+    except _Lost:
+        logger.info(f"Workout import {job_id} was taken over by another worker; abandoning attempt {attempt}")
+    except Exception:
+        logger.exception(f"Workout import {job_id} failed")
+        try:
+            await report(status="failed", finished_at=datetime.utcnow())
+        except _Lost:
+            pass
+
+
+async def run_pending():
+    """Claims queued import jobs (and ones orphaned by a dead worker) and runs them."""
+    stale_before = datetime.utcnow() - timedelta(seconds=STALE_SECONDS)
+    claimed = await run_in_threadpool(_db_call, crud.claim_workout_import_jobs, JOBS_PER_WORKER, stale_before)
+    await asyncio.gather(*[process(*job) for job in claimed])
+
+
+_kicked = set()
+
+
+def kick():
+    """Starts on queued jobs now instead of at the next poll."""
+    task = asyncio.create_task(run_pending())
+    _kicked.add(task)
+    task.add_done_callback(_kicked.discard)
+
+
+def job_status(job: models.WorkoutImportJob) -> dict:
+    return {
+        "id": job.id,
+        "status": job.status,
+        "total_entries": job.total_entries,
+        "parsed_locally": job.parsed_locally,
+        "parsed_by_ai": job.parsed_by_ai,
+        "failed_entries": job.failed_entries,
+        "ai_calls": job.ai_calls,
+        "imported_workouts": job.imported_workouts,
+        "unmatched_exercises": json.loads(job.unmatched_exercises) if job.unmatched_exercises else [],
+        "errors": json.loads(job.errors) if job.errors else [],
+        "created_at": job.created_at,
+        "finished_at": job.finished_at,
+    }
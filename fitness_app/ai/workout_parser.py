@@ -1,14 +1,210 @@
 import json
 import logging
+import re
+from datetime import date
+from typing import List, Optional
 from .. import schemas
 from .gemini_api import _call_gemini_api
 
 logger = logging.getLogger(__name__)
 
+# --- Local shorthand parser ---
+# Handles the common gym shorthand without an AI call:
+#   "bench 3x10 @ 60kg, squat 5x5 100"      sets x reps, optional @weight
+#   "deadlift 140kg 3x5", "row 3 sets of 12 at 50"
+#   "bench 60x10, 70x8, 80x6"               set-by-set weight x reps (continues the previous exercise)
+#   "press 10/8/6 @ 40lb"                   reps per set
+#   "pullups 3x8 + dips 3x10"               supersets ("+" or "superset:")
+# Every segment must parse completely, otherwise the whole text goes to the LLM. So does
+# a lone unit-less "NxM" with N up to MAX_SETS ("curls 8x10", "bench 12x10": N sets of M, or
+# M reps at N?), "bench 3x10 60x8" (a sets x reps block mixed into set-by-set pairs) and a
+# missing weight on an exercise that isn't a bodyweight one, rather than guessing a set count
+# or recording 0 kg.
+
+MAX_SETS = 20
+MAX_REPS = 100
+MAX_WEIGHT = 1000
+MAX_UNAMBIGUOUS_SETS = 5 # Weight-less "NxM" with more sets than this (up to MAX_SETS) is ambiguous
+
+BODYWEIGHT_EXERCISES = {
+    "pullup", "chinup", "pushup", "dip", "situp", "crunch", "plank", "burpee", "muscleup",
+    "airsquat", "bodyweightsquat", "legraise", "hangingkneeraise", "mountainclimber", "jumpingjack",
+}
+
+_UNITS = {"kg": "kg", "kgs": "kg", "kilo": "kg", "kilos": "kg", "lb": "lbs", "lbs": "lbs", "pound": "lbs", "pounds": "lbs"}
+_NUM = r"\d+(?:\.\d+)?"
+_UNIT = r"(?:kgs?|kilos?|lbs?|pounds?)"
+_WEIGHT = rf"(?P<weight>{_NUM})\s*(?P<unit>{_UNIT})?"
+_AT = r"(?:\s*(?:@|at|with|w/)?\s*)"
+_BODYWEIGHT = r"(?:\s*(?:bw|bodyweight|body weight))"
+
+_SET_PATTERNS = [
+    # 3x10, 3x10 @ 60kg, 3x10x60
+    re.compile(rf"^(?P<sets>\d+)\s*x\s*(?P<reps>\d+)(?:(?:\s*x\s*|{_AT}){_WEIGHT}|{_BODYWEIGHT})?$"),
+    # 140kg 3x5, 140kg for 3x5
+    re.compile(rf"^(?P<weight>{_NUM})\s*(?P<unit>{_UNIT})\s*(?:for\s*)?(?P<sets>\d+)\s*x\s*(?P<reps>\d+)$"),
+    # 3 sets of 12 (reps) (at 50)
+    re.compile(rf"^(?P<sets>\d+)\s*sets?\s*(?:of|x)?\s*(?P<reps>\d+)(?:\s*reps?)?(?:{_AT}{_WEIGHT}|{_BODYWEIGHT})?$"),
+]
+_REPS_LIST = re.compile(rf"^(?P<reps>\d+(?:\s*/\s*\d+)+)(?:\s*reps?)?(?:{_AT}{_WEIGHT}|{_BODYWEIGHT})?$")
+_WEIGHT_X_REPS = re.compile(rf"(?P<weight>{_NUM})\s*(?P<unit>{_UNIT})?\s*x\s*(?P<reps>\d+)")
+_NAME = re.compile(r"^(?P<name>[a-z][a-z '\-]*?)\s*:?\s*(?=\d|$)")
+
+local_stats = {"local": 0, "llm": 0}
+
+
+def _unit(raw: Optional[str]) -> str:
+    return _UNITS.get(raw or "kg", "kg")
+
+
+def _sets(count: int, reps: int, weight: float, unit: str) -> List[dict]:
+    return [{"set_number": n, "reps": reps, "weight": weight, "weight_unit": unit} for n in range(1, count + 1)]
+
+
+def _weight(match: re.Match) -> Optional[float]:
+    # None when no weight was given; explicit bodyweight ("bw") is 0.
+    if match.group("weight"):
+        return float(match.group("weight"))
+    return 0.0 if re.search(_BODYWEIGHT + "$", match.group(0)) else None
+
+
+def _is_bodyweight(name: str) -> bool:
+    key = re.sub(r"[^a-z]", "", name.lower())
+    return any(k in BODYWEIGHT_EXERCISES for k in (key, key[:-1], key[:-2]))
+
+
+def _mixes_sets_x_reps(pairs: List[re.Match]) -> bool:
+    """
+    True if a unit-less pair reads as sets x reps next to real weight x reps pairs,
+    e.g. the "3x10" in "3x10 60x8": a set count, not 3 kg, so the spec is ambiguous.
+    """
+    heaviest = max(float(m.group("weight")) for m in pairs)
+    return len(pairs) > 1 and any(
+        not m.group("unit") and float(m.group("weight")) <= MAX_SETS and float(m.group("weight")) * 2 < heaviest
+        for m in pairs
+    )
+
+
+def _parse_sets(spec: str) -> Optional[List[dict]]:
+    """
+    Parses what follows the exercise name; None if it isn't recognised or is ambiguous.
+    Sets without a given weight have weight None.
+    """
+    spec = spec.strip()
+    for index, pattern in enumerate(_SET_PATTERNS):
+        match = pattern.match(spec)
+        if not match:
+            continue
+        count = int(match.group("sets"))
+        weight = _weight(match)
+        if index == 0 and weight is None and count > MAX_SETS:
+            break # "60x10" is weight x reps, handled below
+        if index == 0 and weight is None and count > MAX_UNAMBIGUOUS_SETS:
+            return None
+        return _sets(count, int(match.group("reps")), weight, _unit(match.group("unit")))
+
+    match = _REPS_LIST.match(spec)
+    if match:
+        weight = _weight(match)
+        reps = [int(r) for r in match.group("reps").split("/")]
+        return [
+            {"set_number": n, "reps": r, "weight": weight, "weight_unit": _unit(match.group("unit"))}
+            for n, r in enumerate(reps, start=1)
+        ]
+
+    # Set-by-set: "60x10 70x8 80kg x6"
+    pairs = list(_WEIGHT_X_REPS.finditer(spec))
+    if pairs and _WEIGHT_X_REPS.sub("", spec).strip(" ,") == "":
+        if _mixes_sets_x_reps(pairs):
+            return None
+        return [
+            {"set_number": n, "reps": int(m.group("reps")), "weight": float(m.group("weight")), "weight_unit": _unit(m.group("unit"))}
+            for n, m in enumerate(pairs, start=1)
+        ]
+    return None
+
+
+def _plausible(sets: List[dict]) -> bool:
+    return 0 < len(sets) <= MAX_SETS and all(0 < s["reps"] <= MAX_REPS and 0 <= s["weight"] <= MAX_WEIGHT for s in sets)
+
+
+def _fill_weights(name: str, sets: List[dict]) -> bool:
+    """Missing weights become 0 for bodyweight exercises; False if any other exercise lacks one."""
+    for s in sets:
+        if s["weight"] is None:
+            if not _is_bodyweight(name):
+                return False
+            s["weight"] = 0.0
+    return True
+
+
+def parse_locally(text: str, today: Optional[date] = None) -> Optional[dict]:
+    """
+    Parses common workout shorthand into the same shape the LLM returns.
+    Returns None when any part of the text isn't confidently understood.
+    """
+    normalized = text.lower().replace("×", "x").replace("superset:", "+").replace("superset", "+")
+    segments = [s.strip() for s in re.split(r"[,;\n]|\bthen\b", normalized) if s.strip()]
+    if not segments:
+        return None
+
+    exercises: List[dict] = []
+    for segment in segments:
+        superset = [part.strip() for part in segment.split("+") if part.strip()]
+        for part in superset:
+            if part[0].isdigit():
+                # Continuation of the previous exercise ("bench 60x10, 70x8")
+                if not exercises:
+                    return None
+                sets = _parse_sets(part)
+                if sets is None:
+                    return None
+                previous = exercises[-1]["sets"]
+                for extra in sets:
+                    extra["set_number"] = len(previous) + 1
+                    previous.append(extra)
+                continue
+            match = _NAME.match(part)
+            if not match or not match.group("name").strip():
+                return None
+            sets = _parse_sets(part[match.end():])
+            if sets is None:
+                return None
+            exercises.append({
+                "exercise_id": None,
+                "exercise_name_guess": match.group("name").strip().title(),
+                "notes": "Superset" if len(superset) > 1 else None,
+                "sets": sets,
+            })
+
+    if not exercises or not all(_fill_weights(e["exercise_name_guess"], e["sets"]) for e in exercises):
+        return None
+    if not all(_plausible(e["sets"]) for e in exercises):
+        return None
+    names = [e["exercise_name_guess"] for e in exercises]
+    return {
+        "name": " & ".join(names[:3]) + (" +" if len(names) > 3 else ""),
+        "date": (today or date.today()).isoformat(),
+        "notes": text,
+        "logged_exercises": exercises,
+    }
+
+
+def parser_stats() -> dict:
+    total = local_stats["local"] + local_stats["llm"]
+    return {**local_stats, "local_hit_rate": round(local_stats["local"] / total, 4) if total else 0.0}
+
+
 async def parse_workout_text(text: str) -> schemas.WorkoutLogCreate:
     """
     Parses natural language workout text into a structured WorkoutLogCreate object.
+    Common shorthand is parsed locally; anything else goes to the LLM.
     """
+    parsed = parse_locally(text)
+    if parsed is not None:
+        local_stats["local"] += 1
+        return parsed
+    local_stats["llm"] += 1
     
     system_prompt = """
     You are an AI assistant that parses workout logs.
@@ -57,7 +253,7 @@ async def parse_workout_text(text: str) -> schemas.WorkoutLogCreate:
     
     prompt = f"{system_prompt}\n\nUser Input: {text}\nJSON Output:"
     
-    response_text = await _call_gemini_api(prompt)
+    response_text = await _call_gemini_api(prompt, feature="workout_parse")
     
     # cleaning
     response_text = response_text.replace("```json", "").replace("```", "").strip()
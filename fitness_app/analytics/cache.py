@@ -0,0 +1,8 @@
+import os
+from ..core.cache import UserScopedCache
+
+# Results of crud.get_analytics_data, invalidated whenever the user's workout data changes.
+analytics_cache = UserScopedCache("analytics", max_entries=int(os.getenv("ANALYTICS_CACHE_SIZE", 5000)))
+
+# Rendered AI coach context (ai/user_context.py), invalidated on any write to the user's profile, workouts, meals or habits.
+user_context_cache = UserScopedCache("user_context", max_entries=int(os.getenv("USER_CONTEXT_CACHE_SIZE", 10000)))
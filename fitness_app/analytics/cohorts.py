@@ -0,0 +1,280 @@
+"""
+Weekly cohort, retention and conversion tables, materialized by a batch job.
+
+Each run only reads the raw logs for days after the job's watermark (plus a
+short lookback, so workouts and meals logged a few days late are still
+picked up) and folds them into compact tables. Writers that add history
+further back (workout imports) move the watermark back with rescan_from.
+
+    daily_user_activity  one row per user per active day
+    user_cohorts         each user's cohort (week of first activity)
+    cohort_retention     active users per (cohort week, activity week)
+    cohort_summaries     cohort size and paid conversions
+
+Admin endpoints read only the materialized tables. Cohorts are assigned from a
+user's earliest logged day when they are first seen and never move afterwards.
+"""
+import logging
+import os
+from datetime import date, timedelta
+from typing import Optional
+
+from sqlalchemy import func, or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from .. import models
+from ..core.database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+JOB_NAME = "cohorts"
+RUN_SECONDS = int(os.getenv("COHORT_JOB_SECONDS", 3600))
+LOOKBACK_DAYS = int(os.getenv("COHORT_LOOKBACK_DAYS", 7))
+
+
+def week_start(day: date) -> date:
+    return day - timedelta(days=day.weekday())
+
+
+def _first_activity_date(db: Session) -> Optional[date]:
+    dates = [
+        db.query(func.min(models.WorkoutLog.date)).filter(models.WorkoutLog.owner_id.isnot(None)).scalar(),
+        db.query(func.min(models.MealLog.date)).filter(models.MealLog.owner_id.isnot(None)).scalar(),
+    ]
+    dates = [d for d in dates if d is not None]
+    return min(dates) if dates else None
+
+
+def _activity_by_day(db: Session, start: date, end: date) -> dict:
+    activity = {}
+    for model, index in ((models.WorkoutLog, 0), (models.MealLog, 1)):
+        rows = (
+            db.query(model.date, model.owner_id, func.count(model.id))
+            .filter(model.date >= start, model.date <= end, model.owner_id.isnot(None))
+            .group_by(model.date, model.owner_id)
+        )
+        for day, user_id, count in rows:
+            activity.setdefault((day, user_id), [0, 0])[index] = count
+    return activity
+
+
+def _first_active_dates(db: Session, user_ids: list) -> dict:
+    # Earliest logged day per user over all history, not just the scanned window.
+    first = {}
+    for model in (models.WorkoutLog, models.MealLog):
+        rows = (
+            db.query(model.owner_id, func.min(model.date))
+            .filter(model.owner_id.in_(user_ids), model.date.isnot(None))
+            .group_by(model.owner_id)
+        )
+        for user_id, day in rows:
+            if user_id not in first or day < first[user_id]:
+                first[user_id] = day
+    return first
+
+
+def _assign_cohorts(db: Session, activity: dict):
+    user_ids = {user_id for _, user_id in activity}
+    if not user_ids:
+        return
+    known = {
+        row[0] for row in db.query(models.UserCohort.user_id).filter(models.UserCohort.user_id.in_(list(user_ids)))
+    }
+    new_users = list(user_ids - known)
+    if not new_users:
+        return
+    first_seen = _first_active_dates(db, new_users)
+    for (day, user_id) in activity:
+        if user_id in new_users and (user_id not in first_seen or day < first_seen[user_id]):
+            first_seen[user_id] = day
+    db.add_all([
+        models.UserCohort(user_id=user_id, cohort_week=week_start(day), first_active_date=day)
+        for user_id, day in first_seen.items()
+    ])
+    db.flush()
+
+
+def _refresh_retention(db: Session, first_week: date, end: date):
+    # Recomputes the retention cells of every activity week touched by this run.
+    db.query(models.CohortRetention).filter(models.CohortRetention.activity_week >= first_week).delete(synchronize_session=False)
+    active = set()
+    rows = (
+        db.query(models.UserCohort.cohort_week, models.DailyUserActivity.date, models.DailyUserActivity.user_id)
+        .join(models.UserCohort, models.UserCohort.user_id == models.DailyUserActivity.user_id)
+        .filter(models.DailyUserActivity.date >= first_week, models.DailyUserActivity.date <= end)
+    )
+    for cohort_week, day, user_id in rows:
+        active.add((cohort_week, week_start(day), user_id))
+    cells = {}
+    for cohort_week, activity_week, _ in active:
+        cells[(cohort_week, activity_week)] = cells.get((cohort_week, activity_week), 0) + 1
+    db.add_all([
+        models.CohortRetention(
+            cohort_week=cohort_week,
+            activity_week=activity_week,
+            week_offset=(activity_week - cohort_week).days // 7,
+            active_users=count,
+        )
+        for (cohort_week, activity_week), count in cells.items()
+        if activity_week >= cohort_week
+    ])
+
+
+def _refresh_summaries(db: Session):
+    sizes = dict(
+        db.query(models.UserCohort.cohort_week, func.count(models.UserCohort.user_id)).group_by(models.UserCohort.cohort_week)
+    )
+    ever_paid = db.query(models.UserRoleChange.user_id).filter(models.UserRoleChange.new_role == models.UserRole.PAID)
+    converted = dict(
+        db.query(models.UserCohort.cohort_week, func.count(models.UserCohort.user_id))
+        .join(models.User, models.User.id == models.UserCohort.user_id)
+        .filter(or_(models.User.role == models.UserRole.PAID, models.UserCohort.user_id.in_(ever_paid)))
+        .group_by(models.UserCohort.cohort_week)
+    )
+    db.query(models.CohortSummary).delete(synchronize_session=False)
+    db.add_all([
+        models.CohortSummary(cohort_week=week, users=size, converted_users=converted.get(week, 0))
+        for week, size in sizes.items()
+    ])
+
+
+def _lock_state(db: Session) -> models.BatchJobState:
+    # Row lock held until the run commits: a second worker waits here, then sees the advanced watermark.
+    query = db.query(models.BatchJobState).filter(models.BatchJobState.name == JOB_NAME).with_for_update()
+    state = query.first()
+    if state is None:
+        try:
+            db.add(models.BatchJobState(name=JOB_NAME, watermark=None))
+            db.flush()
+        except IntegrityError:
+            # Another worker created it first; wait for its run
+            db.rollback()
+        state = query.first()
+    return state
+
+
+def run(db: Session, until: Optional[date] = None) -> int:
+    """
+    Processes complete days up to `until` (default: yesterday). Returns the number of days processed.
+    """
+    end = until or date.today() - timedelta(days=1)
+    state = _lock_state(db)
+    if state.watermark is not None and end <= state.watermark:
+        # Nothing new since the last run (the job is scheduled hourly but days complete daily)
+        db.rollback()
+        return 0
+
+    if state.watermark is None:
+        start = _first_activity_date(db)
+        if start is None:
+            db.rollback()
+            return 0
+    else:
+        start = state.watermark + timedelta(days=1) - timedelta(days=LOOKBACK_DAYS)
+    if start > end:
+        db.rollback()
+        return 0
+
+    db.query(models.DailyUserActivity).filter(
+        models.DailyUserActivity.date >= start, models.DailyUserActivity.date <= end
+    ).delete(synchronize_session=False)
+    activity = _activity_by_day(db, start, end)
+    db.add_all([
+        models.DailyUserActivity(date=day, user_id=user_id, workouts=counts[0], meals=counts[1])
+        for (day, user_id), counts in activity.items()
+    ])
+    _assign_cohorts(db, activity)
+    db.flush()
+    _refresh_retention(db, week_start(start), end)
+    _refresh_summaries(db)
+
+    state.watermark = end
+    db.commit()
+    days = (end - start).days + 1
+    logger.info(f"Cohort job processed {start}..{end} ({days} days, {len(activity)} user-days)")
+    return days
+
+
+def rescan_from(db: Session, day: date):
+    """
+    Makes the next run re-read the raw logs from `day`, for history written further back than the
+    lookback (e.g. imported workouts). Call inside the writer's transaction. Reports show the earlier
+    watermark until that run.
+    """
+    watermark = day - timedelta(days=1) + timedelta(days=LOOKBACK_DAYS)
+    db.query(models.BatchJobState).filter(
+        models.BatchJobState.name == JOB_NAME, models.BatchJobState.watermark > watermark
+    ).update({"watermark": watermark}, synchronize_session=False)
+
+
+def run_job():
+    db = SessionLocal()
+    try:
+        run(db)
+    finally:
+        db.close()
+
+
+# --- Reads (materialized tables only) ---
+
+def computed_through(db: Session) -> Optional[date]:
+    state = db.get(models.BatchJobState, JOB_NAME)
+    return state.watermark if state else None
+
+
+def cohort_report(db: Session, cohorts: int, max_offset: int) -> list:
+    summaries = db.query(models.CohortSummary).order_by(models.CohortSummary.cohort_week.desc()).limit(cohorts).all()
+    if not summaries:
+        return []
+    weeks = [s.cohort_week for s in summaries]
+    cells = {}
+    for row in db.query(models.CohortRetention).filter(
+        models.CohortRetention.cohort_week.in_(weeks), models.CohortRetention.week_offset <= max_offset
+    ):
+        cells[(row.cohort_week, row.week_offset)] = row.active_users
+
+    through = computed_through(db)
+    report = []
+    for summary in sorted(summaries, key=lambda s: s.cohort_week):
+        # Only offsets whose week has (at least partly) been processed
+        observed = max_offset if through is None else min(max_offset, (week_start(through) - summary.cohort_week).days // 7)
+        active = [cells.get((summary.cohort_week, offset), 0) for offset in range(observed + 1)]
+        report.append({
+            "cohort_week": summary.cohort_week,
+            "users": summary.users,
+            "converted_users": summary.converted_users,
+            "conversion_rate": round(summary.converted_users / summary.users, 4) if summary.users else 0.0,
+            "active_users": active,
+            "retention": [round(count / summary.users, 4) if summary.users else 0.0 for count in active],
+        })
+    return report
+
+
+def funnel(db: Session, registered_users: int) -> list:
+    activated, converted = db.query(
+        func.coalesce(func.sum(models.CohortSummary.users), 0),
+        func.coalesce(func.sum(models.CohortSummary.converted_users), 0),
+    ).one()
+    retained = dict(
+        db.query(models.CohortRetention.week_offset, func.sum(models.CohortRetention.active_users))
+        .filter(models.CohortRetention.week_offset.in_([1, 4]))
+        .group_by(models.CohortRetention.week_offset)
+    )
+    stages = [
+        ("registered", registered_users),
+        ("activated", int(activated)),
+        ("active_week_1", int(retained.get(1, 0))),
+        ("active_week_4", int(retained.get(4, 0))),
+        ("converted_to_paid", int(converted)),
+    ]
+    result = []
+    previous = None
+    for name, users in stages:
+        result.append({
+            "stage": name,
+            "users": users,
+            "rate_from_previous": round(users / previous, 4) if previous else None,
+        })
+        previous = users
+    return result
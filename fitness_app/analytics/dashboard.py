@@ -0,0 +1,75 @@
+import asyncio
+import re
+from datetime import date, timedelta
+from typing import List, Optional
+
+from fastapi.concurrency import run_in_threadpool
+
+from .. import crud, models, schemas
+from ..core.database import SessionLocal
+
+RANGE_UNITS = {"d": 1, "w": 7, "m": 30, "y": 365}
+NAMED_RANGES = {"week": 7, "month": 30, "quarter": 90, "year": 365}
+RANGE_PATTERN = re.compile(r"^(\d+)\s*([dwmy])$")
+
+
+def _start_date_for(time_range: Optional[str], today: date) -> Optional[date]:
+    """
+    Converts a widget time range ("7d", "4w", "3m", "1y", "month", "all") to a start date.
+    """
+    value = (time_range or "all").strip().lower()
+    if value in ("", "all", "all_time", "none"):
+        return None
+    if value in NAMED_RANGES:
+        return today - timedelta(days=NAMED_RANGES[value])
+    match = RANGE_PATTERN.match(value)
+    if not match:
+        raise ValueError(f"Unknown time range '{time_range}'")
+    return today - timedelta(days=int(match.group(1)) * RANGE_UNITS[match.group(2)])
+
+
+def widget_to_request(widget: models.DashboardWidget, today: Optional[date] = None) -> schemas.AnalyticsRequest:
+    filter_ids = []
+    if widget.filter_type not in (None, "", "none") and widget.filter_id:
+        filter_ids = [int(widget.filter_id)]
+    return schemas.AnalyticsRequest(
+        metric=widget.metric,
+        group_by=widget.group_by,
+        start_date=_start_date_for(widget.time_range, today or date.today()),
+        filter_ids=filter_ids,
+    )
+
+
+def _evaluate_in_session(user_id: int, requests: List[schemas.AnalyticsRequest]):
+    # Each concurrent group gets its own session; sessions are not thread-safe.
+    db = SessionLocal()
+    try:
+        return crud.get_analytics_data_batch(db, user_id, requests)
+    finally:
+        db.close()
+
+
+async def evaluate_widgets(user_id: int, widgets: List[models.DashboardWidget]) -> List[schemas.DashboardWidgetData]:
+    """
+    Evaluates all of a user's widgets in one go.
+    Widgets reading the same rollup rows are batched into one scan; unrelated scans run concurrently.
+    """
+    results = [schemas.DashboardWidgetData(widget=schemas.DashboardWidget.model_validate(w)) for w in widgets]
+    groups = {}
+    for i, widget in enumerate(widgets):
+        try:
+            request = widget_to_request(widget)
+        except ValueError as e:
+            results[i].error = str(e)
+            continue
+        groups.setdefault(crud.analytics_scan_key(request), []).append((i, request))
+
+    group_items = list(groups.values())
+    group_results = await asyncio.gather(*(
+        run_in_threadpool(_evaluate_in_session, user_id, [request for _, request in items])
+        for items in group_items
+    ))
+    for items, data in zip(group_items, group_results):
+        for (i, _), points in zip(items, data):
+            results[i].data = points
+    return results
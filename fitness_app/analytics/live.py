@@ -0,0 +1,100 @@
+import asyncio
+import json
+import os
+from typing import Dict, List
+
+from fastapi import Request
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from .. import models
+from ..core.events import TooManyConnections, user_events
+
+HEARTBEAT_SECONDS = int(os.getenv("LIVE_HEARTBEAT_SECONDS", 15))
+# Clients reconnect (EventSource does so automatically) so no connection lives forever.
+MAX_STREAM_SECONDS = int(os.getenv("LIVE_MAX_STREAM_SECONDS", 1800))
+
+
+def previous_bests(db: Session, user_id: int, exercise_ids: List[int]) -> Dict[int, float]:
+    # Read before the new workout is folded into the rollups.
+    if not exercise_ids:
+        return {}
+    rows = db.query(models.TrainingDailyRollup.exercise_id, func.max(models.TrainingDailyRollup.max_weight))\
+             .filter(models.TrainingDailyRollup.user_id == user_id, models.TrainingDailyRollup.exercise_id.in_(exercise_ids))\
+             .group_by(models.TrainingDailyRollup.exercise_id).all()
+    return dict(rows)
+
+
+def workout_delta(workout_log: models.WorkoutLog, bests: Dict[int, float]) -> dict:
+    """
+    Metric changes caused by one new workout, built from the in-memory objects.
+    """
+    volume, set_count, reps = 0.0, 0, 0
+    heaviest = {}
+    for logged_exercise in workout_log.logged_exercises:
+        for set_log in logged_exercise.sets:
+            weight = set_log.weight or 0.0
+            volume += weight * (set_log.reps or 0)
+            reps += set_log.reps or 0
+            set_count += 1
+            heaviest[logged_exercise.exercise_id] = max(heaviest.get(logged_exercise.exercise_id, 0.0), weight)
+
+    personal_records = [
+        {"exercise_id": exercise_id, "weight": weight, "previous_best": bests.get(exercise_id)}
+        for exercise_id, weight in heaviest.items()
+        if exercise_id is not None and weight > (bests.get(exercise_id) or 0.0)
+    ]
+    return {
+        "date": str(workout_log.date),
+        "volume": volume,
+        "sets": set_count,
+        "reps": reps,
+        "personal_records": personal_records,
+    }
+
+
+def meal_delta(meal_log: models.MealLog) -> dict:
+    return {
+        "date": str(meal_log.date),
+        "calories": meal_log.calories or 0,
+        "protein_g": meal_log.protein_g or 0.0,
+        "carbs_g": meal_log.carbs_g or 0.0,
+        "fats_g": meal_log.fats_g or 0.0,
+    }
+
+
+def habit_delta(habit: models.Habit) -> dict:
+    return {
+        "date": str(habit.date),
+        "sleep_hours": habit.sleep_hours,
+        "water_liters": habit.water_liters,
+        "steps": habit.steps,
+    }
+
+
+async def stream_events(request: Request, user_id: int):
+    """
+    Server-Sent Events body for one client. Ends on disconnect or after MAX_STREAM_SECONDS.
+    Subscribes only once the body starts, so a response that is never sent holds no connection slot.
+    """
+    try:
+        subscription = user_events.subscribe(user_id)
+    except TooManyConnections as e:
+        # Lost a race for the last slot after the endpoint's capacity check.
+        yield f"event: error\ndata: {json.dumps({'detail': str(e)})}\n\n"
+        return
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + MAX_STREAM_SECONDS
+    try:
+        yield "retry: 5000\n\n"
+        while loop.time() < deadline:
+            if await request.is_disconnected():
+                break
+            try:
+                event = await asyncio.wait_for(subscription.queue.get(), timeout=HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            yield f"event: {event['type']}\ndata: {json.dumps(event['data'])}\n\n"
+    finally:
+        user_events.unsubscribe(subscription)
@@ -0,0 +1,107 @@
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from .. import models
+
+logger = logging.getLogger(__name__)
+
+# How an exercise's sets are attributed to the muscle groups it trains:
+#   full  - every muscle group gets the full volume (the join fan-out behaviour clients rely on)
+#   split - divided equally (a 2-muscle exercise gives each half its volume); opt-in, as it
+#           changes the numbers /analytics/progress returns and makes reps and sets fractional
+WEIGHTING = os.getenv("MUSCLE_GROUP_WEIGHTING", "full")
+# Other workers can change the catalog too, so reload at least this often.
+REFRESH_SECONDS = int(os.getenv("MUSCLE_MAP_REFRESH_SECONDS", 300))
+
+
+class MuscleGroupMapping:
+    def __init__(self, version: int, exercises: Dict[int, List[Tuple[int, float]]], names: Dict[int, str]):
+        self.version = version
+        self.exercises = exercises # exercise id -> [(muscle group id, attribution weight)]
+        self.names = names # muscle group id -> name
+        self.loaded_at = time.monotonic()
+
+    def exercises_for(self, muscle_group_ids: List[int]) -> List[int]:
+        wanted = set(muscle_group_ids)
+        return [exercise_id for exercise_id, groups in self.exercises.items() if any(mg_id in wanted for mg_id, _ in groups)]
+
+
+_mapping: Optional[MuscleGroupMapping] = None
+_version = 0
+_stale = True
+_lock = threading.Lock()
+
+
+def _load(db: Session, version: int) -> MuscleGroupMapping:
+    names = dict(db.query(models.MuscleGroup.id, models.MuscleGroup.name).all())
+    groups_by_exercise: Dict[int, List[int]] = {}
+    for exercise_id, muscle_group_id in db.query(
+        models.ExerciseMuscleGroupAssociation.exercise_id,
+        models.ExerciseMuscleGroupAssociation.muscle_group_id,
+    ).order_by(models.ExerciseMuscleGroupAssociation.muscle_group_id):
+        groups_by_exercise.setdefault(exercise_id, []).append(muscle_group_id)
+
+    exercises = {}
+    for exercise_id, muscle_group_ids in groups_by_exercise.items():
+        weight = 1.0 / len(muscle_group_ids) if WEIGHTING == "split" else 1.0
+        exercises[exercise_id] = [(mg_id, weight) for mg_id in muscle_group_ids]
+    return MuscleGroupMapping(version, exercises, names)
+
+
+def get_mapping(db: Session) -> MuscleGroupMapping:
+    global _mapping, _version, _stale
+    with _lock:
+        expired = _mapping is not None and time.monotonic() - _mapping.loaded_at > REFRESH_SECONDS
+        if _mapping is None or _stale:
+            _version += 1
+            _mapping = _load(db, _version)
+            _stale = False
+            logger.info(f"Loaded muscle group mapping v{_version} ({len(_mapping.exercises)} exercises, weighting={WEIGHTING})")
+        elif expired:
+            # Timed refresh: only a mapping another worker actually changed gets a new version.
+            loaded = _load(db, _version)
+            if loaded.exercises != _mapping.exercises or loaded.names != _mapping.names:
+                _version += 1
+                loaded.version = _version
+                logger.info(f"Muscle group mapping changed, now v{_version} ({len(loaded.exercises)} exercises)")
+            _mapping = loaded
+        return _mapping
+
+
+def invalidate():
+    # Call after committing changes to exercises, muscle groups or their associations.
+    global _stale
+    with _lock:
+        _stale = True
+
+
+def project(rows: list, mapping: MuscleGroupMapping, muscle_group_ids: List[int]) -> list:
+    """
+    Folds per-(exercise, day) aggregate rows into per-muscle-group rows.
+    Additive metrics are multiplied by the attribution weight; max weight and
+    session counts are not (a session hits a muscle group or it doesn't).
+    """
+    wanted = set(muscle_group_ids)
+    per_day_sessions = {}
+    groups = {}
+    for r in rows:
+        for mg_id, weight in mapping.exercises.get(r.exercise_id, []):
+            if wanted and mg_id not in wanted:
+                continue
+            group = groups.setdefault(mg_id, {"label": mapping.names.get(mg_id), "volume": 0.0, "max_weight": 0.0, "total_reps": 0.0, "set_count": 0.0, "workout_count": 0})
+            group["volume"] += (r.volume or 0) * weight
+            group["total_reps"] += (r.total_reps or 0) * weight
+            group["set_count"] += (r.set_count or 0) * weight
+            group["max_weight"] = max(group["max_weight"], r.max_weight or 0)
+            # Sessions hitting a muscle group on a day = max over its exercises (summing would double count)
+            key = (mg_id, r.date)
+            per_day_sessions[key] = max(per_day_sessions.get(key, 0), r.workout_count or 0)
+
+    for (mg_id, _), sessions in per_day_sessions.items():
+        groups[mg_id]["workout_count"] += sessions
+    return list(groups.values())
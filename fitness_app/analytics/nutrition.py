@@ -0,0 +1,180 @@
+import logging
+from datetime import date, timedelta
+
+from sqlalchemy import func, insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from .. import models
+from .rollups import upsert_aggregates
+
+logger = logging.getLogger(__name__)
+
+SUMMED_COLUMNS = ("calories", "protein_g", "carbs_g", "fats_g", "meal_count")
+MACRO_COLUMNS = ("calories", "protein_g", "carbs_g", "fats_g")
+
+
+def apply_meal(db: Session, meal_log: models.MealLog):
+    """
+    Adds a new meal to its day's nutrition totals. Call inside the same transaction as the meal insert.
+    """
+    upsert_aggregates(
+        db,
+        models.NutritionDaily,
+        ["owner_id", "date"],
+        [{
+            "owner_id": meal_log.owner_id,
+            "date": meal_log.date or date.today(),
+            "calories": meal_log.calories or 0,
+            "protein_g": meal_log.protein_g or 0.0,
+            "carbs_g": meal_log.carbs_g or 0.0,
+            "fats_g": meal_log.fats_g or 0.0,
+            "meal_count": 1,
+        }],
+        summed_columns=SUMMED_COLUMNS,
+        max_columns=(),
+    )
+
+
+def delete_user_nutrition(db: Session, user_id: int):
+    db.query(models.NutritionDaily).filter(models.NutritionDaily.owner_id == user_id).delete(synchronize_session=False)
+
+
+def rebuild_user_nutrition(db: Session, user_id: int) -> int:
+    """
+    Recomputes a user's daily nutrition totals from the raw meal logs (backfill/repair).
+    Waits for in-flight meal writes and blocks new ones until it commits.
+    """
+    if _state(db, user_id).with_for_update().first() is None:
+        db.add(models.NutritionRollupState(user_id=user_id))
+        db.flush()
+    delete_user_nutrition(db, user_id)
+    rows = (
+        db.query(
+            models.MealLog.date,
+            func.coalesce(func.sum(models.MealLog.calories), 0),
+            func.coalesce(func.sum(models.MealLog.protein_g), 0.0),
+            func.coalesce(func.sum(models.MealLog.carbs_g), 0.0),
+            func.coalesce(func.sum(models.MealLog.fats_g), 0.0),
+            func.count(models.MealLog.id),
+        )
+        .filter(models.MealLog.owner_id == user_id, models.MealLog.date.isnot(None))
+        .group_by(models.MealLog.date)
+        .all()
+    )
+    if rows:
+        db.execute(insert(models.NutritionDaily), [
+            {
+                "owner_id": user_id,
+                "date": r[0],
+                "calories": int(r[1]),
+                "protein_g": float(r[2]),
+                "carbs_g": float(r[3]),
+                "fats_g": float(r[4]),
+                "meal_count": int(r[5]),
+            }
+            for r in rows
+        ])
+    db.commit()
+    return len(rows)
+
+
+def rebuild_all_nutrition(db: Session) -> int:
+    user_ids = {row[0] for row in db.query(models.MealLog.owner_id).filter(models.MealLog.owner_id.isnot(None)).distinct()}
+    user_ids |= {row[0] for row in db.query(models.NutritionDaily.owner_id).distinct()}
+    for user_id in user_ids:
+        rows = rebuild_user_nutrition(db, user_id)
+        logger.info(f"Rebuilt {rows} nutrition rows for user {user_id}")
+    return len(user_ids)
+
+
+def _state(db: Session, user_id: int):
+    return db.query(models.NutritionRollupState).filter(models.NutritionRollupState.user_id == user_id)
+
+
+def ensure_backfilled(db: Session, user_id: int, for_write: bool = False):
+    """
+    Builds a user's daily totals from the raw meal logs the first time they are read or written, so meals
+    from before the aggregate existed show up. Writers pass for_write=True before adding the new meal:
+    they hold a share lock on the user's state row until commit, which any rebuild waits for.
+    """
+    state = _state(db, user_id)
+    if for_write:
+        state = state.with_for_update(read=True)
+    if state.first() is not None:
+        return
+    try:
+        db.add(models.NutritionRollupState(user_id=user_id))
+        # The primary key is the claim; a concurrent claimer waits here, then fails once this rebuild commits.
+        db.flush()
+    except IntegrityError:
+        db.rollback()
+    else:
+        rows = rebuild_user_nutrition(db, user_id)
+        logger.info(f"Backfilled {rows} nutrition rows for user {user_id}")
+    if for_write:
+        state.first()
+
+
+def delete_user_state(db: Session, user_id: int):
+    _state(db, user_id).delete(synchronize_session=False)
+
+
+def _totals(rows: list) -> dict:
+    totals = {name: 0.0 for name in MACRO_COLUMNS}
+    totals["meal_count"] = 0
+    for row in rows:
+        for name in MACRO_COLUMNS:
+            totals[name] += row[name]
+        totals["meal_count"] += row["meal_count"]
+    return totals
+
+
+def _averages(totals: dict, days_logged: int) -> dict:
+    # meal_count becomes meals per logged day
+    return {name: round(totals[name] / days_logged, 1) if days_logged else 0.0 for name in MACRO_COLUMNS + ("meal_count",)}
+
+
+def summary(db: Session, user_id: int, start: date, end: date) -> dict:
+    """
+    Per-day and per-week (Monday-based) macro totals, averaged over days with logged meals.
+    Reads one aggregate row per logged day.
+    """
+    ensure_backfilled(db, user_id)
+    days = [
+        {
+            "date": row.date,
+            "calories": row.calories,
+            "protein_g": round(row.protein_g, 1),
+            "carbs_g": round(row.carbs_g, 1),
+            "fats_g": round(row.fats_g, 1),
+            "meal_count": row.meal_count,
+        }
+        for row in db.query(models.NutritionDaily)
+        .filter(models.NutritionDaily.owner_id == user_id, models.NutritionDaily.date >= start, models.NutritionDaily.date <= end)
+        .order_by(models.NutritionDaily.date)
+    ]
+
+    weeks = {}
+    for day in days:
+        weeks.setdefault(day["date"] - timedelta(days=day["date"].weekday()), []).append(day)
+    week_summaries = []
+    for week_start, week_days in sorted(weeks.items()):
+        totals = _totals(week_days)
+        week_summaries.append({
+            "week_start": week_start,
+            "days_logged": len(week_days),
+            "totals": {name: round(value, 1) for name, value in totals.items()},
+            "averages": _averages(totals, len(week_days)),
+        })
+
+    totals = _totals(days)
+    return {
+        "start": start,
+        "end": end,
+        "days_logged": len(days),
+        "totals": {name: round(value, 1) for name, value in totals.items()},
+        "averages": _averages(totals, len(days)),
+        "days": days,
+        "weeks": week_summaries,
+    }
@@ -0,0 +1,212 @@
+"""
+Platform-wide stats for admins, without full-table scans.
+
+Totals are counters in platform_counters, incremented in the same transaction
+as the writes they count. Distinct active users come from one HyperLogLog
+sketch per day (keyed by workout date); a window is the union of its days.
+Admin reads get an in-memory snapshot refreshed by a periodic job. A slower
+reconcile job recounts everything, correcting drift from writes that bypass
+crud (seed scripts, manual SQL).
+"""
+import logging
+import os
+import threading
+from datetime import date, datetime, timedelta
+from typing import Dict, Optional
+
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from .. import models
+from ..core.database import SessionLocal
+from ..core.hll import HyperLogLog
+
+logger = logging.getLogger(__name__)
+
+REFRESH_SECONDS = int(os.getenv("PLATFORM_STATS_REFRESH_SECONDS", 60))
+RECONCILE_SECONDS = int(os.getenv("PLATFORM_STATS_RECONCILE_SECONDS", 86400))
+ACTIVE_WINDOWS = (1, 7, 30) # days; a window of N covers dates >= today - N
+
+USERS_TOTAL = "users_total"
+WORKOUTS_TOTAL = "workouts_total"
+MEALS_TOTAL = "meals_total"
+
+
+def role_counter(role) -> str:
+    return f"users_role_{models.UserRole(role).value}"
+
+
+# --- Write path ---
+
+def increment(db: Session, name: str, delta: int = 1):
+    """
+    Adjusts a counter inside the caller's transaction.
+    Before the first backfill there are no rows, so this is a no-op until then.
+    """
+    db.query(models.PlatformCounter).filter(models.PlatformCounter.name == name).update(
+        {models.PlatformCounter.value: models.PlatformCounter.value + delta}, synchronize_session=False
+    )
+
+
+_pending: Dict[date, HyperLogLog] = {}
+_pending_lock = threading.Lock()
+
+
+def record_active(user_id: int, day: date):
+    # In-memory only; flushed to the daily sketches by the refresh job.
+    if day < date.today() - timedelta(days=max(ACTIVE_WINDOWS)):
+        return
+    with _pending_lock:
+        _pending.setdefault(day, HyperLogLog()).add(user_id)
+
+
+def flush_active_users():
+    with _pending_lock:
+        pending = dict(_pending)
+        _pending.clear()
+    if not pending:
+        return
+    db = SessionLocal()
+    try:
+        for day, sketch in pending.items():
+            _merge_day_sketch(db, day, sketch)
+    finally:
+        db.close()
+
+
+def _merge_day_sketch(db: Session, day: date, sketch: HyperLogLog):
+    for _ in range(2):
+        try:
+            row = db.query(models.DailyActiveSketch).filter(models.DailyActiveSketch.date == day).with_for_update().first()
+            if row is None:
+                db.add(models.DailyActiveSketch(date=day, registers=sketch.to_bytes()))
+            else:
+                row.registers = HyperLogLog(registers=row.registers).merge(sketch).to_bytes()
+            db.commit()
+            return
+        except IntegrityError:
+            # Another worker inserted the day's row first; merge into it.
+            db.rollback()
+    logger.warning(f"Could not merge active-user sketch for {day}")
+
+
+# --- Backfill / reconcile ---
+
+def rebuild(db: Session):
+    """
+    Recounts all counters and rebuilds the daily sketches from the database.
+    The counter rows stay locked from before the recount until the commit, so
+    increments from concurrent writes are either counted or applied on top.
+    """
+    counters = {
+        row.name: row
+        for row in db.query(models.PlatformCounter).order_by(models.PlatformCounter.name).with_for_update()
+    }
+    counts = {
+        USERS_TOTAL: db.query(models.User).count(),
+        WORKOUTS_TOTAL: db.query(models.WorkoutLog).count(),
+        MEALS_TOTAL: db.query(models.MealLog).count(),
+    }
+    for role in models.UserRole:
+        counts[role_counter(role)] = 0
+    for role, count in db.query(models.User.role, func.count(models.User.id)).group_by(models.User.role):
+        counts[role_counter(role)] = count
+
+    since = date.today() - timedelta(days=max(ACTIVE_WINDOWS))
+    sketches: Dict[date, HyperLogLog] = {}
+    active = db.query(models.WorkoutLog.date, models.WorkoutLog.owner_id).filter(
+        models.WorkoutLog.date >= since, models.WorkoutLog.owner_id.isnot(None)
+    ).distinct()
+    for day, user_id in active:
+        sketches.setdefault(day, HyperLogLog()).add(user_id)
+
+    for name, value in counts.items():
+        if name in counters:
+            counters[name].value = value
+        else:
+            db.add(models.PlatformCounter(name=name, value=value))
+    db.query(models.DailyActiveSketch).delete(synchronize_session=False)
+    db.add_all([models.DailyActiveSketch(date=day, registers=sketch.to_bytes()) for day, sketch in sketches.items()])
+    db.commit()
+    logger.info(f"Rebuilt platform counters ({counts[USERS_TOTAL]} users) and {len(sketches)} daily active-user sketches")
+
+
+def reconcile():
+    db = SessionLocal()
+    try:
+        rebuild(db)
+    except IntegrityError:
+        # Another worker reconciled at the same moment
+        db.rollback()
+    finally:
+        db.close()
+    refresh_snapshot()
+
+
+# --- Read path ---
+
+_snapshot: Optional[dict] = None
+
+
+def _compute(db: Session) -> dict:
+    counters = dict(db.query(models.PlatformCounter.name, models.PlatformCounter.value).all())
+    if not counters:
+        rebuild(db)
+        counters = dict(db.query(models.PlatformCounter.name, models.PlatformCounter.value).all())
+
+    today = date.today()
+    oldest = today - timedelta(days=max(ACTIVE_WINDOWS))
+    # Old days age out of every window; nothing reads them any more.
+    db.query(models.DailyActiveSketch).filter(models.DailyActiveSketch.date < oldest).delete(synchronize_session=False)
+    db.commit()
+    # Callers flush this worker's pending activity first
+    day_sketches = {
+        row.date: HyperLogLog(registers=row.registers)
+        for row in db.query(models.DailyActiveSketch).filter(models.DailyActiveSketch.date >= oldest)
+    }
+
+    active = {}
+    for days in ACTIVE_WINDOWS:
+        window = HyperLogLog()
+        for day, sketch in day_sketches.items():
+            if day >= today - timedelta(days=days):
+                window.merge(sketch)
+        active[days] = window.count()
+
+    return {
+        "user_stats": {
+            "total_users": counters.get(USERS_TOTAL, 0),
+            "active_users_1d": active[1],
+            "active_users_7d": active[7],
+            "active_users_30d": active[30],
+            "paid_users": counters.get(role_counter(models.UserRole.PAID), 0),
+            "trainers": counters.get(role_counter(models.UserRole.TRAINER), 0),
+            "admins": counters.get(role_counter(models.UserRole.ADMIN), 0),
+        },
+        "engagement_stats": {
+            "total_workouts_logged": counters.get(WORKOUTS_TOTAL, 0),
+            "total_meals_logged": counters.get(MEALS_TOTAL, 0),
+        },
+        "system_status": "Operational",
+        "last_updated": datetime.now().isoformat(timespec="seconds"),
+    }
+
+
+def refresh_snapshot():
+    global _snapshot
+    flush_active_users()
+    db = SessionLocal()
+    try:
+        _snapshot = _compute(db)
+    finally:
+        db.close()
+
+
+def get_snapshot(db: Session) -> dict:
+    # Active-user counts are estimates (~1.6% error) and up to REFRESH_SECONDS old.
+    global _snapshot
+    if _snapshot is None:
+        flush_active_users()
+        _snapshot = _compute(db)
+    return _snapshot
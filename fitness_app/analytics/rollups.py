@@ -0,0 +1,223 @@
+import logging
+from typing import Optional
+
+from sqlalchemy import and_, case, func, insert
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from .. import models
+
+logger = logging.getLogger(__name__)
+
+SUMMED_COLUMNS = ("volume", "total_reps", "set_count", "workout_count")
+MAX_COLUMNS = ("max_weight",)
+
+
+def _empty_aggregate() -> dict:
+    return {"volume": 0.0, "max_weight": 0.0, "total_reps": 0, "set_count": 0, "workout_count": 0}
+
+
+def _add_set(aggregate: dict, weight: Optional[float], reps: Optional[int]):
+    weight = weight or 0.0
+    reps = reps or 0
+    aggregate["volume"] += weight * reps
+    aggregate["max_weight"] = max(aggregate["max_weight"], weight)
+    aggregate["total_reps"] += reps
+    aggregate["set_count"] += 1
+
+
+def upsert_aggregates(db: Session, model, key_columns: list, rows: list, summed_columns=SUMMED_COLUMNS, max_columns=MAX_COLUMNS):
+    """
+    Adds each row's aggregates onto the existing rollup row (or inserts it).
+    Uses INSERT .. ON CONFLICT so concurrent writers for the same day don't lose updates.
+    """
+    if not rows:
+        return
+    table = model.__table__
+    dialect = db.get_bind().dialect.name
+
+    if dialect in ("postgresql", "sqlite"):
+        dialect_insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+        stmt = dialect_insert(table).values(rows)
+        excluded = stmt.excluded
+        update = {name: table.c[name] + excluded[name] for name in summed_columns}
+        for name in max_columns:
+            update[name] = case(
+                (excluded[name] > table.c[name], excluded[name]),
+                else_=table.c[name],
+            )
+        db.execute(stmt.on_conflict_do_update(index_elements=key_columns, set_=update))
+        return
+
+    # Generic fallback: read-modify-write.
+    for row in rows:
+        existing = db.get(model, tuple(row[k] for k in key_columns))
+        if existing is None:
+            db.add(model(**row))
+            continue
+        for name in summed_columns:
+            setattr(existing, name, getattr(existing, name) + row[name])
+        for name in max_columns:
+            setattr(existing, name, max(getattr(existing, name), row[name]))
+
+
+def apply_workout(db: Session, workout_log: models.WorkoutLog):
+    """
+    Folds a newly created workout (and its exercises/sets) into the daily rollups.
+    Call inside the same transaction as the workout insert.
+    """
+    exercises = [
+        (logged_exercise.exercise_id, [(set_log.weight, set_log.reps) for set_log in logged_exercise.sets])
+        for logged_exercise in workout_log.logged_exercises
+    ]
+    apply_workouts(db, workout_log.owner_id, [(workout_log.date, workout_log.name, exercises)])
+
+
+def apply_workouts(db: Session, user_id: int, workouts: list):
+    """
+    Folds new workouts, given as (date, name, [(exercise_id, [(weight, reps), ...]), ...]),
+    into the daily rollups with one upsert per rollup table.
+    """
+    per_exercise = {}
+    per_session = {}
+    for workout_date, name, exercises in workouts:
+        session_total = per_session.setdefault((workout_date, name or ""), _empty_aggregate())
+        session_total["workout_count"] += 1
+        for exercise_id in {exercise_id for exercise_id, _ in exercises if exercise_id is not None}:
+            per_exercise.setdefault((workout_date, exercise_id), _empty_aggregate())["workout_count"] += 1
+        for exercise_id, sets in exercises:
+            if exercise_id is None:
+                continue
+            aggregate = per_exercise[(workout_date, exercise_id)]
+            for weight, reps in sets:
+                _add_set(aggregate, weight, reps)
+                _add_set(session_total, weight, reps)
+
+    upsert_aggregates(
+        db,
+        models.TrainingDailyRollup,
+        ["user_id", "date", "exercise_id"],
+        [
+            {"user_id": user_id, "date": workout_date, "exercise_id": exercise_id, **aggregate}
+            for (workout_date, exercise_id), aggregate in per_exercise.items()
+        ],
+    )
+    upsert_aggregates(
+        db,
+        models.TrainingDailyWorkoutRollup,
+        ["user_id", "date", "workout_name"],
+        [
+            {"user_id": user_id, "date": workout_date, "workout_name": name, **aggregate}
+            for (workout_date, name), aggregate in per_session.items()
+        ],
+    )
+
+
+def delete_user_rollups(db: Session, user_id: int):
+    db.query(models.TrainingDailyRollup).filter(models.TrainingDailyRollup.user_id == user_id).delete(synchronize_session=False)
+    db.query(models.TrainingDailyWorkoutRollup).filter(models.TrainingDailyWorkoutRollup.user_id == user_id).delete(synchronize_session=False)
+
+
+def _state(db: Session, user_id: int):
+    return db.query(models.TrainingRollupState).filter(models.TrainingRollupState.user_id == user_id)
+
+
+def ensure_backfilled(db: Session, user_id: int, for_write: bool = False):
+    """
+    Builds a user's rollups from the raw logs the first time they are read or written, so history from
+    before the rollups existed shows up (and doesn't count as new personal bests) without a manual backfill.
+    Writers pass for_write=True before adding the new workout: they hold a share lock on the user's state
+    row until commit, which any rebuild waits for.
+    """
+    state = _state(db, user_id)
+    if for_write:
+        state = state.with_for_update(read=True)
+    if state.first() is not None:
+        return
+    try:
+        db.add(models.TrainingRollupState(user_id=user_id))
+        # The primary key is the claim; a concurrent claimer waits here, then fails once this rebuild commits.
+        db.flush()
+    except IntegrityError:
+        db.rollback()
+    else:
+        rows = rebuild_user_rollups(db, user_id)
+        logger.info(f"Backfilled {rows} rollup rows for user {user_id}")
+    if for_write:
+        state.first()
+
+
+def delete_user_state(db: Session, user_id: int):
+    _state(db, user_id).delete(synchronize_session=False)
+
+
+def rebuild_user_rollups(db: Session, user_id: int):
+    """
+    Recomputes a user's rollups from the raw set logs. Used for backfills and repairs.
+    Waits for in-flight workout writes and blocks new ones until it commits.
+    """
+    if _state(db, user_id).with_for_update().first() is None:
+        db.add(models.TrainingRollupState(user_id=user_id))
+        db.flush()
+    delete_user_rollups(db, user_id)
+
+    aggregates = (
+        func.coalesce(func.sum(models.SetLog.weight * models.SetLog.reps), 0.0),
+        func.coalesce(func.max(models.SetLog.weight), 0.0),
+        func.coalesce(func.sum(models.SetLog.reps), 0),
+        func.count(models.SetLog.id),
+        func.count(models.WorkoutLog.id.distinct()),
+    )
+
+    exercise_rows = (
+        db.query(models.WorkoutLog.date, models.LoggedExercise.exercise_id, *aggregates)
+        .select_from(models.WorkoutLog)
+        .join(models.LoggedExercise)
+        .outerjoin(models.SetLog)
+        .filter(models.WorkoutLog.owner_id == user_id, models.LoggedExercise.exercise_id.isnot(None))
+        .group_by(models.WorkoutLog.date, models.LoggedExercise.exercise_id)
+        .all()
+    )
+    # Sets of exercises without an exercise_id are left out, as in apply_workouts; their workouts still count.
+    workout_rows = (
+        db.query(models.WorkoutLog.date, func.coalesce(models.WorkoutLog.name, ""), *aggregates)
+        .select_from(models.WorkoutLog)
+        .outerjoin(
+            models.LoggedExercise,
+            and_(models.LoggedExercise.workout_log_id == models.WorkoutLog.id, models.LoggedExercise.exercise_id.isnot(None)),
+        )
+        .outerjoin(models.SetLog)
+        .filter(models.WorkoutLog.owner_id == user_id)
+        .group_by(models.WorkoutLog.date, func.coalesce(models.WorkoutLog.name, ""))
+        .all()
+    )
+
+    def to_row(key_name, row):
+        return {
+            "user_id": user_id,
+            "date": row[0],
+            key_name: row[1],
+            "volume": float(row[2]),
+            "max_weight": float(row[3]),
+            "total_reps": int(row[4]),
+            "set_count": int(row[5]),
+            "workout_count": int(row[6]),
+        }
+
+    if exercise_rows:
+        db.execute(insert(models.TrainingDailyRollup), [to_row("exercise_id", r) for r in exercise_rows])
+    if workout_rows:
+        db.execute(insert(models.TrainingDailyWorkoutRollup), [to_row("workout_name", r) for r in workout_rows])
+    db.commit()
+    return len(exercise_rows) + len(workout_rows)
+
+
+def rebuild_all_rollups(db: Session) -> int:
+    user_ids = {row[0] for row in db.query(models.WorkoutLog.owner_id).filter(models.WorkoutLog.owner_id.isnot(None)).distinct()}
+    # Users whose workouts were all removed still need their stale rollups cleared.
+    user_ids |= {row[0] for row in db.query(models.TrainingDailyWorkoutRollup.user_id).distinct()}
+    for user_id in user_ids:
+        rows = rebuild_user_rollups(db, user_id)
+        logger.info(f"Rebuilt {rows} rollup rows for user {user_id}")
+    return len(user_ids)
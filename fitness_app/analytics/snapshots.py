@@ -0,0 +1,321 @@
+"""
+Columnar per-user set history.
+
+Each user's sets are stored as one .npy file per column under SNAPSHOT_DIR/<user_id>/:
+
+    base-<n>/          compacted history, memory-mapped on read (zero-copy)
+    segments/<name>/   small appends, one per logged workout
+
+Appends never touch existing files, so concurrent writers only need a lock for
+compaction, which runs from a periodic job (compact_pending) rather than in the
+request that logged the workout. Readers skip segments whose workout is already in the base, so a
+reader that lists a new base before old segments are deleted (or a segment
+written while a rebuild was reading the database) doesn't count sets twice.
+"""
+import fcntl
+import json
+import logging
+import os
+import shutil
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from .. import models
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "snapshots")
+COMPACT_AFTER_SEGMENTS = int(os.getenv("SNAPSHOT_COMPACT_AFTER", 8))
+COMPACT_SECONDS = int(os.getenv("SNAPSHOT_COMPACT_SECONDS", 300))
+
+COLUMNS = {
+    "date": "datetime64[D]",
+    "workout_id": "int64",
+    "exercise_id": "int32",
+    "reps": "int32",
+    "weight": "float32",
+}
+
+
+def _user_dir(user_id: int) -> str:
+    return os.path.join(SNAPSHOT_DIR, str(user_id))
+
+
+def _stale_marker(user_dir: str) -> str:
+    return os.path.join(user_dir, ".stale")
+
+
+def _empty_columns() -> dict:
+    return {name: np.empty(0, dtype=dtype) for name, dtype in COLUMNS.items()}
+
+
+def _write_part(path: str, columns: dict, meta: dict):
+    # Written to a temp dir and renamed so readers never see a partial part.
+    tmp_path = f"{path}.tmp-{os.getpid()}-{time.time_ns()}"
+    os.makedirs(tmp_path)
+    for name, dtype in COLUMNS.items():
+        np.save(os.path.join(tmp_path, f"{name}.npy"), np.asarray(columns[name], dtype=dtype))
+    with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+        json.dump(meta, f)
+    os.rename(tmp_path, path)
+
+
+def _read_part(path: str, mmap: bool):
+    with open(os.path.join(path, "meta.json")) as f:
+        meta = json.load(f)
+    columns = {
+        name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r" if mmap else None)
+        for name in COLUMNS
+    }
+    return columns, meta
+
+
+def _latest_base(user_dir: str) -> Optional[str]:
+    bases = [d for d in os.listdir(user_dir) if d.startswith("base-") and ".tmp-" not in d]
+    if not bases:
+        return None
+    return max(bases, key=lambda d: int(d.split("-", 1)[1]))
+
+
+def _segment_names(user_dir: str) -> list:
+    segments_dir = os.path.join(user_dir, "segments")
+    if not os.path.isdir(segments_dir):
+        return []
+    return sorted(d for d in os.listdir(segments_dir) if ".tmp-" not in d)
+
+
+@contextmanager
+def _compaction_lock(user_dir: str):
+    with open(os.path.join(user_dir, ".lock"), "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _columns_from_rows(rows: list) -> dict:
+    # rows are (date, workout_id, exercise_id, reps, weight) tuples, in COLUMNS order
+    if not rows:
+        return _empty_columns()
+    return {name: np.array([r[i] for r in rows], dtype=dtype) for i, (name, dtype) in enumerate(COLUMNS.items())}
+
+
+def workout_rows(workout_log: models.WorkoutLog) -> list:
+    # Needs the workout flushed (id assigned); reads only the in-memory objects.
+    return [
+        (workout_log.date, workout_log.id, logged_exercise.exercise_id, set_log.reps or 0, set_log.weight or 0.0)
+        for logged_exercise in workout_log.logged_exercises
+        if logged_exercise.exercise_id is not None
+        for set_log in logged_exercise.sets
+    ]
+
+
+def append_workout(user_id: int, workout_id: int, rows: list):
+    """
+    Appends a committed workout's sets as a new segment; compact_pending merges them later.
+    """
+    user_dir = _user_dir(user_id)
+    if not os.path.isdir(user_dir) or _latest_base(user_dir) is None:
+        # No snapshot yet; the first read builds the full history from the database.
+        return
+    segment_name = f"{time.time_ns():020d}-{os.getpid()}"
+    os.makedirs(os.path.join(user_dir, "segments"), exist_ok=True)
+    _write_part(os.path.join(user_dir, "segments", segment_name), _columns_from_rows(rows), {"workout_id": workout_id})
+
+
+def mark_stale(user_id: int):
+    """
+    Records a failed append. A later append raises max_workout_id past the lost workout,
+    so the next read can't tell from the ids alone and rebuilds because of this marker.
+    """
+    user_dir = _user_dir(user_id)
+    if not os.path.isdir(user_dir):
+        return
+    try:
+        open(_stale_marker(user_dir), "w").close()
+    except OSError:
+        logger.exception(f"Could not mark set history snapshot of user {user_id} stale")
+
+
+def compact(user_id: int, min_segments: int = 1) -> bool:
+    """
+    Merges the current base and all segments into a new date-sorted base.
+    Returns False if fewer than min_segments were waiting (e.g. another worker just compacted).
+    """
+    user_dir = _user_dir(user_id)
+    if not os.path.isdir(user_dir):
+        return False
+    with _compaction_lock(user_dir):
+        segment_names = _segment_names(user_dir)
+        if len(segment_names) < min_segments or _latest_base(user_dir) is None:
+            return False
+        history, meta = _load(user_dir, mmap=False, segment_names=segment_names)
+        order = np.argsort(history["date"], kind="stable")
+        _replace_base(user_dir, {name: column[order] for name, column in history.items()}, meta["max_workout_id"], segment_names)
+    return True
+
+
+def compact_pending():
+    """
+    Periodic job: compacts every user with at least COMPACT_AFTER_SEGMENTS segments waiting.
+    """
+    if not os.path.isdir(SNAPSHOT_DIR):
+        return
+    compacted = 0
+    for name in os.listdir(SNAPSHOT_DIR):
+        if not name.isdigit() or len(_segment_names(os.path.join(SNAPSHOT_DIR, name))) < COMPACT_AFTER_SEGMENTS:
+            continue
+        try:
+            if compact(int(name), COMPACT_AFTER_SEGMENTS):
+                compacted += 1
+        except Exception:
+            # A broken snapshot is rebuilt on its next read; keep compacting the others.
+            logger.exception(f"Compacting set history snapshot for user {name} failed")
+    if compacted:
+        logger.info(f"Compacted set history snapshots for {compacted} users")
+
+
+def _replace_base(user_dir: str, columns: dict, max_workout_id: int, segment_names: list):
+    # Caller holds the compaction lock and has folded segment_names into columns.
+    old_base = _latest_base(user_dir)
+    next_number = int(old_base.split("-", 1)[1]) + 1 if old_base else 1
+    _write_part(os.path.join(user_dir, f"base-{next_number}"), columns, {"max_workout_id": max_workout_id})
+    # Open memory maps of the old files stay valid after unlinking.
+    for name in segment_names:
+        shutil.rmtree(os.path.join(user_dir, "segments", name), ignore_errors=True)
+    if old_base:
+        shutil.rmtree(os.path.join(user_dir, old_base), ignore_errors=True)
+
+
+def _load(user_dir: str, mmap: bool = True, segment_names: Optional[list] = None):
+    """
+    Returns (columns, meta). Zero-copy when the history is fully compacted.
+    """
+    base_name = _latest_base(user_dir)
+    if base_name is None:
+        raise FileNotFoundError(user_dir)
+    if segment_names is None:
+        segment_names = _segment_names(user_dir)
+    base, base_meta = _read_part(os.path.join(user_dir, base_name), mmap)
+    segments = [_read_part(os.path.join(user_dir, "segments", name), mmap=False) for name in segment_names]
+
+    max_workout_id = max([base_meta["max_workout_id"]] + [meta["workout_id"] for _, meta in segments])
+    if segments:
+        already_in_base = np.isin([meta["workout_id"] for _, meta in segments], base["workout_id"])
+        segments = [part for part, skip in zip(segments, already_in_base) if not skip]
+    if not segments:
+        return base, {"max_workout_id": max_workout_id}
+    columns = {name: np.concatenate([base[name]] + [part[name] for part, _ in segments]) for name in COLUMNS}
+    return columns, {"max_workout_id": max_workout_id}
+
+
+def rebuild_user_snapshot(db: Session, user_id: int):
+    """
+    Writes a fresh base from the set logs in the database (backfill/repair).
+    """
+    user_dir = _user_dir(user_id)
+    os.makedirs(user_dir, exist_ok=True)
+    # Cleared before the query, so an append that fails from here on marks the new base stale again.
+    try:
+        os.remove(_stale_marker(user_dir))
+    except FileNotFoundError:
+        pass
+    # Segments that exist now belong to already committed workouts, so the query below covers them.
+    segment_names = _segment_names(user_dir)
+    rows = (
+        db.query(models.WorkoutLog.date, models.WorkoutLog.id, models.LoggedExercise.exercise_id, models.SetLog.reps, models.SetLog.weight)
+        .select_from(models.SetLog)
+        .join(models.LoggedExercise)
+        .join(models.WorkoutLog)
+        .filter(models.WorkoutLog.owner_id == user_id, models.LoggedExercise.exercise_id.isnot(None))
+        .order_by(models.WorkoutLog.date)
+        .all()
+    )
+    max_workout_id = db.query(func.max(models.WorkoutLog.id)).filter(models.WorkoutLog.owner_id == user_id).scalar() or 0
+    columns = _columns_from_rows([(r[0], r[1], r[2], r[3] or 0, r[4] or 0.0) for r in rows])
+
+    with _compaction_lock(user_dir):
+        _replace_base(user_dir, columns, max_workout_id, segment_names)
+    logger.info(f"Rebuilt set history snapshot for user {user_id} ({len(rows)} sets)")
+
+
+def load_user_history(db: Session, user_id: int) -> dict:
+    """
+    Returns the user's set history as column arrays.
+    Only one indexed lookup hits the database, to detect a missing or stale snapshot;
+    snapshots marked stale by a failed append are rebuilt.
+    """
+    latest_workout_id = db.query(func.max(models.WorkoutLog.id)).filter(models.WorkoutLog.owner_id == user_id).scalar() or 0
+    user_dir = _user_dir(user_id)
+    for _ in range(3):
+        try:
+            columns, meta = _load(user_dir)
+        except FileNotFoundError:
+            # Missing snapshot, or a compaction removed files while we were listing them.
+            if not os.path.isdir(user_dir) or _latest_base(user_dir) is None:
+                rebuild_user_snapshot(db, user_id)
+            continue
+        if meta["max_workout_id"] >= latest_workout_id and not os.path.exists(_stale_marker(user_dir)):
+            return columns
+        # A failed append left the snapshot behind the database.
+        rebuild_user_snapshot(db, user_id)
+    logger.warning(f"Falling back to empty history for user {user_id}; snapshot unavailable")
+    return _empty_columns()
+
+
+def delete_user_snapshot(user_id: int):
+    shutil.rmtree(_user_dir(user_id), ignore_errors=True)
+
+
+# --- Analytics over history columns ---
+
+def estimated_one_rep_max(weight: np.ndarray, reps: np.ndarray) -> np.ndarray:
+    # Epley formula
+    return weight * (1.0 + reps / 30.0)
+
+
+def exercise_history(history: dict, exercise_id: int) -> list:
+    mask = history["exercise_id"] == exercise_id
+    if not mask.any():
+        return []
+    dates = history["date"][mask]
+    weight = history["weight"][mask].astype("float64")
+    reps = history["reps"][mask]
+
+    days, index = np.unique(dates, return_inverse=True)
+    max_weight = np.zeros(len(days))
+    volume = np.zeros(len(days))
+    best_e1rm = np.zeros(len(days))
+    np.maximum.at(max_weight, index, weight)
+    np.add.at(volume, index, weight * reps)
+    np.maximum.at(best_e1rm, index, estimated_one_rep_max(weight, reps))
+
+    return [
+        {"date": str(day), "max_weight": round(float(mw), 2), "volume": round(float(v), 2), "estimated_1rm": round(float(e), 2)}
+        for day, mw, v, e in zip(days, max_weight, volume, best_e1rm)
+    ]
+
+
+def personal_records(history: dict) -> list:
+    if len(history["exercise_id"]) == 0:
+        return []
+    e1rm = estimated_one_rep_max(history["weight"].astype("float64"), history["reps"])
+    records = []
+    for exercise_id in np.unique(history["exercise_id"]):
+        positions = np.flatnonzero(history["exercise_id"] == exercise_id)
+        heaviest = positions[np.argmax(history["weight"][positions])]
+        strongest = positions[np.argmax(e1rm[positions])]
+        records.append({
+            "exercise_id": int(exercise_id),
+            "max_weight": round(float(history["weight"][heaviest]), 2),
+            "max_weight_date": str(history["date"][heaviest]),
+            "estimated_1rm": round(float(e1rm[strongest]), 2),
+            "estimated_1rm_date": str(history["date"][strongest]),
+        })
+    return records
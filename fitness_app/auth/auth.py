@@ -18,9 +18,13 @@ load_dotenv()
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = os.getenv("ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 30))
+# Stream tickets end up in URLs and access logs, so they only open streams and expire quickly
+STREAM_TICKET_EXPIRE_SECONDS = int(os.getenv("STREAM_TICKET_EXPIRE_SECONDS", 60))
+STREAM_SCOPE = "stream"
 
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+oauth2_scheme_optional = OAuth2PasswordBearer(tokenUrl="token", auto_error=False)
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
@@ -40,7 +44,13 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def get_current_user(token: str = Depends(oauth2_scheme)):
+def create_stream_ticket(user: models.User) -> str:
+    return create_access_token(
+        {"sub": user.email, "scope": STREAM_SCOPE},
+        expires_delta=timedelta(seconds=STREAM_TICKET_EXPIRE_SECONDS),
+    )
+
+def _user_from_token(token: str, scope: Optional[str] = None):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -49,7 +59,8 @@ def get_current_user(token: str = Depends(oauth2_scheme)):
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         email: str = payload.get("sub")
-        if email is None:
+        # Access tokens carry no scope; a stream ticket must not work as one
+        if email is None or payload.get("scope") != scope:
             raise credentials_exception
     except JWTError:
         raise credentials_exception
@@ -62,6 +73,15 @@ def get_current_user(token: str = Depends(oauth2_scheme)):
         raise credentials_exception
     return user
 
+def get_current_user(token: str = Depends(oauth2_scheme)):
+    return _user_from_token(token)
+
+def get_current_user_for_stream(token: Optional[str] = Depends(oauth2_scheme_optional), ticket: Optional[str] = None):
+    # Browsers' EventSource can't send headers, so streams also accept a short-lived ?ticket=
+    if token:
+        return _user_from_token(token)
+    return _user_from_token(ticket or "", scope=STREAM_SCOPE)
+
 # New dependency to get an admin user
 def get_current_admin_user(current_user: models.User = Depends(get_current_user)):
     if current_user.role != models.UserRole.ADMIN:
@@ -0,0 +1,82 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Optional
+
+from pydantic import BaseModel
+
+
+def canonical_key(payload: BaseModel) -> str:
+    """
+    Stable hash of a request model. Lists are sorted so that equivalent
+    requests (e.g. filter_ids=[2, 1] vs [1, 2]) share one cache entry.
+    """
+    data = payload.model_dump(mode="json")
+    for key, value in data.items():
+        if isinstance(value, list):
+            data[key] = sorted(value, key=str)
+    raw = json.dumps(data, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class UserScopedCache:
+    """
+    In-memory LRU cache for results computed from a single user's data.
+
+    Every user has a generation counter. Entries remember the generation they
+    were computed at, so bumping it (on any write to that user's data) makes
+    all older entries stale without having to find and delete them.
+    """
+
+    def __init__(self, name: str, max_entries: int = 5000):
+        self.name = name
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._generations: dict = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def generation(self, user_id: int) -> int:
+        with self._lock:
+            return self._generations.get(user_id, 0)
+
+    def get(self, user_id: int, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get((user_id, key))
+            if entry is None or entry[0] != self._generations.get(user_id, 0):
+                self.misses += 1
+                return None
+            self._entries.move_to_end((user_id, key))
+            self.hits += 1
+            return entry[1]
+
+    def set(self, user_id: int, key: str, value: Any, generation: int):
+        with self._lock:
+            # Result was computed before a concurrent write landed; don't keep it.
+            if generation != self._generations.get(user_id, 0):
+                return
+            self._entries[(user_id, key)] = (generation, value)
+            self._entries.move_to_end((user_id, key))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: int):
+        with self._lock:
+            self._generations[user_id] = self._generations.get(user_id, 0) + 1
+            self.invalidations += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "name": self.name,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "invalidations": self.invalidations,
+            }
@@ -0,0 +1,88 @@
+import asyncio
+import logging
+import os
+import threading
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+MAX_CONNECTIONS_PER_USER = int(os.getenv("LIVE_MAX_CONNECTIONS_PER_USER", 3))
+MAX_CONNECTIONS = int(os.getenv("LIVE_MAX_CONNECTIONS", 1000))
+QUEUE_SIZE = int(os.getenv("LIVE_QUEUE_SIZE", 50))
+
+
+class TooManyConnections(Exception):
+    pass
+
+
+class Subscription:
+    def __init__(self, user_id: int, loop: asyncio.AbstractEventLoop):
+        self.user_id = user_id
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        self.dropped = 0
+
+    def _put(self, event: dict):
+        # Runs on the subscriber's loop. A slow client loses its oldest events, never blocks writers.
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(event)
+
+
+class UserEventBroker:
+    """
+    In-process fan-out of per-user events to connected stream clients.
+    Publishing is thread-safe, so sync endpoints running in the threadpool can call it.
+    Events only reach clients connected to the same worker process.
+    """
+
+    def __init__(self):
+        self._subscriptions = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def _check_capacity(self, user_id: int):
+        if len(self._subscriptions.get(user_id, ())) >= MAX_CONNECTIONS_PER_USER:
+            raise TooManyConnections("Too many live connections for this user")
+        if self.connection_count() >= MAX_CONNECTIONS:
+            raise TooManyConnections("Live update capacity reached")
+
+    def check_capacity(self, user_id: int):
+        """Raises TooManyConnections if subscribe would; reserves nothing."""
+        with self._lock:
+            self._check_capacity(user_id)
+
+    def subscribe(self, user_id: int) -> Subscription:
+        with self._lock:
+            self._check_capacity(user_id)
+            subscription = Subscription(user_id, asyncio.get_running_loop())
+            self._subscriptions[user_id].add(subscription)
+            return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            subscribers = self._subscriptions.get(subscription.user_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscriptions[subscription.user_id]
+
+    def has_subscribers(self, user_id: int) -> bool:
+        return bool(self._subscriptions.get(user_id))
+
+    def connection_count(self) -> int:
+        return sum(len(s) for s in self._subscriptions.values())
+
+    def publish(self, user_id: int, event_type: str, data: dict):
+        with self._lock:
+            subscribers = list(self._subscriptions.get(user_id, ()))
+        event = {"type": event_type, "data": data}
+        for subscription in subscribers:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription._put, event)
+            except RuntimeError:
+                # Loop already closed; the stream's cleanup will unsubscribe it.
+                pass
+
+
+user_events = UserEventBroker()
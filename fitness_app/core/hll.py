@@ -0,0 +1,53 @@
+import hashlib
+import math
+
+import numpy as np
+
+
+class HyperLogLog:
+    """
+    Fixed-size sketch for counting distinct items.
+
+    With the default precision (2^12 registers, 4 KB) the standard error is
+    about 1.6%. Sketches merge losslessly (register-wise max), so per-day
+    sketches can be unioned into any window.
+    """
+
+    def __init__(self, precision: int = 12, registers: bytes = None):
+        self.precision = precision
+        self.size = 1 << precision
+        if registers is not None:
+            if len(registers) != self.size:
+                raise ValueError(f"Expected {self.size} registers, got {len(registers)}")
+            self.registers = np.frombuffer(registers, dtype=np.uint8).copy()
+        else:
+            self.registers = np.zeros(self.size, dtype=np.uint8)
+
+    def add(self, item) -> None:
+        x = int.from_bytes(hashlib.blake2b(str(item).encode("utf-8"), digest_size=8).digest(), "big")
+        index = x >> (64 - self.precision)
+        remaining_bits = 64 - self.precision
+        rest = x & ((1 << remaining_bits) - 1)
+        # Position of the leftmost 1-bit in the remaining bits (1-based)
+        rank = remaining_bits - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other: "HyperLogLog") -> "HyperLogLog":
+        if other.precision != self.precision:
+            raise ValueError("Cannot merge sketches with different precision")
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def count(self) -> int:
+        m = self.size
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / float(np.sum(np.ldexp(1.0, -self.registers.astype(np.int32))))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * m and zeros:
+            # Small-range correction (linear counting)
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def to_bytes(self) -> bytes:
+        return self.registers.tobytes()
@@ -0,0 +1,58 @@
+import logging
+import os
+import threading
+from typing import Dict, Hashable
+
+logger = logging.getLogger(__name__)
+
+
+class SampleBuffer:
+    """
+    Coalesces additive samples per key in memory until they are flushed.
+
+    Thousands of readings for the same (user, day) collapse into one set of
+    running totals, so a flush writes one row per key instead of one per sample.
+    Totals not yet flushed are lost if the process dies.
+    """
+
+    def __init__(self, name: str, max_keys: int = 10000):
+        self.name = name
+        self.max_keys = max_keys
+        self._totals: Dict[Hashable, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+        self.samples_added = 0
+        self.flushes = 0
+
+    def add(self, key: Hashable, values: Dict[str, float]) -> bool:
+        """
+        Adds values onto the key's totals. Returns True once the buffer is full and should be flushed.
+        """
+        with self._lock:
+            totals = self._totals.setdefault(key, {})
+            for name, value in values.items():
+                totals[name] = totals.get(name, 0) + value
+            self.samples_added += 1
+            return len(self._totals) >= self.max_keys
+
+    def drain(self) -> Dict[Hashable, Dict[str, float]]:
+        with self._lock:
+            totals, self._totals = self._totals, {}
+            if totals:
+                self.flushes += 1
+            return totals
+
+    def restore(self, totals: Dict[Hashable, Dict[str, float]]):
+        # Puts drained totals back after a failed flush, so the next flush retries them.
+        for key, values in totals.items():
+            with self._lock:
+                current = self._totals.setdefault(key, {})
+                for name, value in values.items():
+                    current[name] = current.get(name, 0) + value
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._totals)
+
+
+FLUSH_SECONDS = int(os.getenv("HABIT_SAMPLE_FLUSH_SECONDS", 30))
+habit_samples = SampleBuffer("habit-samples", max_keys=int(os.getenv("HABIT_SAMPLE_BUFFER_KEYS", 10000)))
@@ -0,0 +1,61 @@
+"""
+Minimal in-process runner for periodic background jobs.
+
+Every worker process runs its own copy of each job, so jobs must be safe to run
+concurrently across workers (idempotent, or coordinated through the database).
+Sync jobs run in the threadpool; coroutine functions are awaited on the loop.
+"""
+import asyncio
+import logging
+from typing import Callable, List
+
+from starlette.concurrency import run_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+
+class PeriodicJob:
+    def __init__(self, name: str, interval_seconds: float, func: Callable[[], None], run_on_start: bool = False):
+        self.name = name
+        self.interval_seconds = interval_seconds
+        self.func = func
+        self.run_on_start = run_on_start
+
+
+_jobs: List[PeriodicJob] = []
+_tasks: List[asyncio.Task] = []
+
+
+def register(name: str, interval_seconds: float, func: Callable[[], None], run_on_start: bool = False):
+    if interval_seconds <= 0:
+        logger.info(f"Periodic job '{name}' disabled (interval {interval_seconds})")
+        return
+    _jobs.append(PeriodicJob(name, interval_seconds, func, run_on_start))
+
+
+async def _run(job: PeriodicJob):
+    if not job.run_on_start:
+        await asyncio.sleep(job.interval_seconds)
+    while True:
+        try:
+            if asyncio.iscoroutinefunction(job.func):
+                await job.func()
+            else:
+                await run_in_threadpool(job.func)
+        except Exception:
+            logger.exception(f"Periodic job '{job.name}' failed")
+        await asyncio.sleep(job.interval_seconds)
+
+
+async def start():
+    for job in _jobs:
+        _tasks.append(asyncio.create_task(_run(job), name=f"job:{job.name}"))
+    if _jobs:
+        logger.info(f"Started {len(_jobs)} periodic jobs: {', '.join(job.name for job in _jobs)}")
+
+
+async def stop():
+    for task in _tasks:
+        task.cancel()
+    await asyncio.gather(*_tasks, return_exceptions=True)
+    _tasks.clear()
@@ -1,9 +1,19 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import func
-from typing import Optional
-from datetime import datetime
+from sqlalchemy import Date, Integer, String, case, cast, func, insert, inspect, literal_column, or_, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from typing import List, Optional
+from datetime import date, datetime, timedelta
 from . import models, schemas
+from .core.cache import canonical_key
+from .analytics.cache import analytics_cache, user_context_cache
+from .analytics import cohorts, live, muscle_map, nutrition, platform_stats, rollups, snapshots
+from .core.events import user_events
+from .core.sample_buffer import habit_samples
 from passlib.context import CryptContext
+import logging
+
+logger = logging.getLogger(__name__)
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
@@ -24,6 +34,8 @@ def create_user(db: Session, user: schemas.UserCreate):
         goals=user.goals
     )
     db.add(db_user)
+    platform_stats.increment(db, platform_stats.USERS_TOTAL)
+    platform_stats.increment(db, platform_stats.role_counter(models.UserRole.unpaid))
     db.commit()
     db.refresh(db_user)
     return db_user
@@ -34,6 +46,7 @@ def update_user(db: Session, user: models.User, user_update: schemas.UserUpdate)
         setattr(user, key, value)
     db.add(user)
     db.commit()
+    user_context_cache.invalidate(user.id)
     db.refresh(user)
     return user
 
@@ -43,6 +56,10 @@ def get_all_users(db: Session, skip: int = 0, limit: int = 100):
 def update_user_role(db: Session, user_id: int, role: str):
     user = db.query(models.User).filter(models.User.id == user_id).first()
     if user:
+        if user.role != role:
+            platform_stats.increment(db, platform_stats.role_counter(user.role), -1)
+            platform_stats.increment(db, platform_stats.role_counter(role))
+            db.add(models.UserRoleChange(user_id=user.id, old_role=user.role, new_role=role))
         user.role = role
         db.commit()
         db.refresh(user)
@@ -51,14 +68,116 @@ def update_user_role(db: Session, user_id: int, role: str):
 def delete_user(db: Session, user_id: int):
     user = db.query(models.User).filter(models.User.id == user_id).first()
     if user:
+        rollups.delete_user_rollups(db, user_id)
+        rollups.delete_user_state(db, user_id)
+        nutrition.delete_user_nutrition(db, user_id)
+        nutrition.delete_user_state(db, user_id)
+        db.query(models.UserSummary).filter(models.UserSummary.user_id == user_id).delete(synchronize_session=False)
+        db.query(models.UserRoleChange).filter(models.UserRoleChange.user_id == user_id).delete(synchronize_session=False)
+        _delete_chat_sessions(db, db.query(models.ChatSession.id).filter(models.ChatSession.user_id == user_id))
+        # A worker still holding one of these jobs loses its compare-and-set and writes nothing
+        db.query(models.WorkoutImportJob).filter(models.WorkoutImportJob.user_id == user_id).delete(synchronize_session=False)
+        platform_stats.increment(db, platform_stats.USERS_TOTAL, -1)
+        platform_stats.increment(db, platform_stats.role_counter(user.role), -1)
         db.delete(user)
         db.commit()
+        analytics_cache.invalidate(user_id)
+        user_context_cache.invalidate(user_id)
+        snapshots.delete_user_snapshot(user_id)
     return user
 
+# --- User Summary ---
+def _current_month_start() -> date:
+    return date.today().replace(day=1)
+
+def rebuild_user_summary(db: Session, user_id: int):
+    """
+    Computes a user's summary row from scratch. Only needed once per user (or for repairs);
+    afterwards writes keep it up to date.
+    """
+    latest_progress = db.query(models.Progress).filter(models.Progress.owner_id == user_id).order_by(models.Progress.date.desc()).first()
+    first_progress = db.query(models.Progress).filter(models.Progress.owner_id == user_id).order_by(models.Progress.date.asc()).first()
+    summary = models.UserSummary(
+        user_id=user_id,
+        month_start=_current_month_start(),
+        workouts_this_month=count_workouts_this_month(db, user_id),
+        total_workouts=db.query(models.WorkoutLog).filter(models.WorkoutLog.owner_id == user_id).count(),
+        total_meals=db.query(models.MealLog).filter(models.MealLog.owner_id == user_id).count(),
+        first_weight=first_progress.weight if first_progress else None,
+        first_weight_date=first_progress.date if first_progress else None,
+        last_weight=latest_progress.weight if latest_progress else None,
+        last_weight_date=latest_progress.date if latest_progress else None,
+    )
+    try:
+        summary = db.merge(summary)
+        db.commit()
+    except IntegrityError:
+        # Another request created it concurrently
+        db.rollback()
+        summary = db.get(models.UserSummary, user_id)
+    return summary
+
+def _ensure_user_summary(db: Session, user_id: int):
+    # Call before adding the new row, so a first-time rebuild doesn't count it twice.
+    if db.get(models.UserSummary, user_id) is None:
+        rebuild_user_summary(db, user_id)
+
+def _workouts_since(user_id: int, month_start: date):
+    # Indexed (owner_id, date) count, used to recount the month on rollover
+    W = models.WorkoutLog
+    return select(func.count(W.id)).where(W.owner_id == user_id, W.date >= month_start).scalar_subquery()
+
+def get_user_summary(db: Session, user_id: int):
+    summary = db.get(models.UserSummary, user_id)
+    if summary is None:
+        return rebuild_user_summary(db, user_id)
+    month_start = _current_month_start()
+    if summary.month_start < month_start:
+        # Monthly rollover: recount, since workouts dated in the new month may have been logged in advance
+        db.query(models.UserSummary).filter(
+            models.UserSummary.user_id == user_id,
+            models.UserSummary.month_start < month_start
+        ).update({"month_start": month_start, "workouts_this_month": _workouts_since(user_id, month_start)}, synchronize_session=False)
+        db.commit()
+        db.refresh(summary)
+    return summary
+
+def _summary_record_workout(db: Session, user_id: int, workout_date: date):
+    _summary_record_workouts(db, user_id, [workout_date])
+
+def _summary_record_workouts(db: Session, user_id: int, workout_dates: List[date]):
+    # Atomic in-place update, part of the caller's transaction
+    S = models.UserSummary
+    month_start = _current_month_start()
+    increment = sum(1 for d in workout_dates if d >= month_start)
+    db.flush() # The rollover recount must see the new workouts
+    db.query(S).filter(S.user_id == user_id).update({
+        S.workouts_this_month: case((S.month_start < month_start, _workouts_since(user_id, month_start)), else_=S.workouts_this_month + increment),
+        S.month_start: month_start,
+        S.total_workouts: S.total_workouts + len(workout_dates),
+    }, synchronize_session=False)
+
+def _summary_record_meal(db: Session, user_id: int):
+    S = models.UserSummary
+    db.query(S).filter(S.user_id == user_id).update({S.total_meals: S.total_meals + 1}, synchronize_session=False)
+
+def _summary_record_weight(db: Session, user_id: int, weight: float, weight_date: date):
+    S = models.UserSummary
+    is_first = or_(S.first_weight_date.is_(None), S.first_weight_date > weight_date)
+    is_last = or_(S.last_weight_date.is_(None), S.last_weight_date <= weight_date)
+    db.query(S).filter(S.user_id == user_id).update({
+        S.first_weight: case((is_first, weight), else_=S.first_weight),
+        S.first_weight_date: case((is_first, weight_date), else_=S.first_weight_date),
+        S.last_weight: case((is_last, weight), else_=S.last_weight),
+        S.last_weight_date: case((is_last, weight_date), else_=S.last_weight_date),
+    }, synchronize_session=False)
+
 # --- Progress CRUD ---
 def create_progress_entry(db: Session, progress: schemas.ProgressCreate, user_id: int):
+    _ensure_user_summary(db, user_id)
     db_progress = models.Progress(**progress.dict(), owner_id=user_id)
     db.add(db_progress)
+    _summary_record_weight(db, user_id, db_progress.weight, db_progress.date)
     db.commit()
     db.refresh(db_progress)
     return db_progress
@@ -67,22 +186,159 @@ def get_progress_entries_by_user(db: Session, user_id: int, skip: int = 0, limit
     return db.query(models.Progress).filter(models.Progress.owner_id == user_id).order_by(models.Progress.date.desc()).offset(skip).limit(limit).all()
 
 # --- Habit CRUD ---
+HABIT_FIELDS = ("sleep_hours", "water_liters", "steps", "daily_notes")
+WEARABLE_FIELDS = {
+    schemas.WearableMetric.STEPS: "steps",
+    schemas.WearableMetric.SLEEP: "sleep_hours",
+    schemas.WearableMetric.WATER: "water_liters",
+}
+
+def _dialect_insert(db: Session):
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        return postgresql.insert
+    if dialect == "sqlite":
+        return sqlite.insert
+    return None
+
+_habits_unique_index = None
+
+def _habit_upsert_insert(db: Session):
+    """
+    Dialect insert for ON CONFLICT (owner_id, date) upserts, or None to use select-then-update.
+    Databases created before the unique index existed need migration_habits_unique_v1.py
+    (create_all doesn't add it to an existing table); until then, and until workers restart
+    after it ran, writes take the fallback.
+    """
+    global _habits_unique_index
+    dialect_insert = _dialect_insert(db)
+    if dialect_insert is None:
+        return None
+    if _habits_unique_index is None:
+        inspector = inspect(db.get_bind())
+        keys = [c["column_names"] for c in inspector.get_unique_constraints("habits")]
+        keys += [i["column_names"] for i in inspector.get_indexes("habits") if i.get("unique")]
+        _habits_unique_index = any(sorted(k) == ["date", "owner_id"] for k in keys)
+        if not _habits_unique_index:
+            logger.warning("habits has no unique (owner_id, date) index; run data/migration_habits_unique_v1.py")
+    return dialect_insert if _habits_unique_index else None
+
 def create_habit(db: Session, habit: schemas.HabitCreate, user_id: int):
-    db_habit = models.Habit(**habit.dict(), owner_id=user_id)
-    db.add(db_habit)
+    """
+    Records a day's habits. There is one row per user per day: fields sent for a day
+    that already has an entry overwrite it, fields left out keep their value.
+    """
+    values = {**habit.dict(), "owner_id": user_id}
+    dialect_insert = _habit_upsert_insert(db)
+    if dialect_insert is not None:
+        table = models.Habit.__table__
+        stmt = dialect_insert(table).values(values)
+        update = {name: func.coalesce(stmt.excluded[name], table.c[name]) for name in HABIT_FIELDS}
+        db.execute(stmt.on_conflict_do_update(index_elements=["owner_id", "date"], set_=update))
+    else:
+        existing = db.query(models.Habit).filter(models.Habit.owner_id == user_id, models.Habit.date == habit.date).first()
+        if existing is None:
+            db.add(models.Habit(**values))
+        else:
+            for name in HABIT_FIELDS:
+                if values[name] is not None:
+                    setattr(existing, name, values[name])
     db.commit()
-    db.refresh(db_habit)
+    user_context_cache.invalidate(user_id)
+    db_habit = db.query(models.Habit).filter(models.Habit.owner_id == user_id, models.Habit.date == habit.date).first()
+    user_events.publish(user_id, "habit_logged", live.habit_delta(db_habit))
     return db_habit
 
+def ingest_habit_samples(db: Session, samples: List[schemas.WearableSample], user_id: int) -> int:
+    """
+    Buffers wearable readings (increments since the previous reading) per user and day.
+    Returns the number of distinct days they touched.
+    """
+    days = set()
+    full = False
+    for sample in samples:
+        day = sample.timestamp.date()
+        full = habit_samples.add((user_id, day), {WEARABLE_FIELDS[sample.metric]: sample.value}) or full
+        days.add(day)
+    if full:
+        flush_habit_samples(db)
+    return len(days)
+
+def flush_habit_samples(db: Session, chunk_size: int = 500) -> int:
+    """
+    Adds the buffered daily totals onto the habit rows in bulk. Returns the number of rows written.
+    """
+    totals = habit_samples.drain()
+    if not totals:
+        return 0
+    rows = [
+        {
+            "owner_id": user_id,
+            "date": day,
+            "steps": int(round(values["steps"])) if "steps" in values else None,
+            "sleep_hours": values.get("sleep_hours"),
+            "water_liters": values.get("water_liters"),
+        }
+        for (user_id, day), values in totals.items()
+    ]
+    try:
+        dialect_insert = _habit_upsert_insert(db)
+        table = models.Habit.__table__
+        for start in range(0, len(rows), chunk_size):
+            chunk = rows[start:start + chunk_size]
+            if dialect_insert is not None:
+                stmt = dialect_insert(table).values(chunk)
+                update = {
+                    name: case((stmt.excluded[name].is_(None), table.c[name]), else_=func.coalesce(table.c[name], 0) + stmt.excluded[name])
+                    for name in WEARABLE_FIELDS.values()
+                }
+                db.execute(stmt.on_conflict_do_update(index_elements=["owner_id", "date"], set_=update))
+                continue
+            for row in chunk:
+                existing = db.query(models.Habit).filter(models.Habit.owner_id == row["owner_id"], models.Habit.date == row["date"]).first()
+                if existing is None:
+                    db.add(models.Habit(**row))
+                    continue
+                for name in WEARABLE_FIELDS.values():
+                    if row[name] is not None:
+                        setattr(existing, name, (getattr(existing, name) or 0) + row[name])
+        db.commit()
+    except IntegrityError:
+        # e.g. a user deleted since their samples were buffered; retrying can't succeed
+        db.rollback()
+        logger.exception(f"Dropped {len(rows)} buffered habit rows that could not be written")
+        return 0
+    except Exception:
+        db.rollback()
+        habit_samples.restore(totals)
+        logger.exception(f"Failed to flush {len(rows)} buffered habit rows; will retry")
+        return 0
+
+    for user_id in {row["owner_id"] for row in rows}:
+        user_context_cache.invalidate(user_id)
+        if user_events.has_subscribers(user_id):
+            for day in sorted(row["date"] for row in rows if row["owner_id"] == user_id):
+                db_habit = db.query(models.Habit).filter(models.Habit.owner_id == user_id, models.Habit.date == day).first()
+                user_events.publish(user_id, "habit_logged", live.habit_delta(db_habit))
+    logger.info(f"Flushed {len(rows)} buffered habit rows")
+    return len(rows)
+
 def get_habits_by_user(db: Session, user_id: int, skip: int = 0, limit: int = 30):
     return db.query(models.Habit).filter(models.Habit.owner_id == user_id).order_by(models.Habit.date.desc()).offset(skip).limit(limit).all()
 
 # --- Meal Log CRUD ---
 def create_meal_log(db: Session, meal_log: schemas.MealLogCreate, user_id: int):
+    _ensure_user_summary(db, user_id)
+    nutrition.ensure_backfilled(db, user_id, for_write=True)
     db_meal_log = models.MealLog(**meal_log.dict(), owner_id=user_id)
     db.add(db_meal_log)
+    nutrition.apply_meal(db, db_meal_log)
+    _summary_record_meal(db, user_id)
+    platform_stats.increment(db, platform_stats.MEALS_TOTAL)
     db.commit()
+    user_context_cache.invalidate(user_id)
     db.refresh(db_meal_log)
+    user_events.publish(user_id, "meal_logged", live.meal_delta(db_meal_log))
     return db_meal_log
 
 def get_meal_logs_by_user(db: Session, user_id: int, skip: int = 0, limit: int = 30):
@@ -106,6 +362,7 @@ def create_muscle_group(db: Session, muscle_group: schemas.MuscleGroupCreate):
     db_muscle_group = models.MuscleGroup(name=muscle_group.name)
     db.add(db_muscle_group)
     db.commit()
+    muscle_map.invalidate()
     db.refresh(db_muscle_group)
     return db_muscle_group
 
@@ -117,12 +374,15 @@ def create_exercise(db: Session, exercise: schemas.ExerciseCreate, user_id: Opti
             db_exercise.muscle_groups.append(mg)
     db.add(db_exercise)
     db.commit()
+    muscle_map.invalidate()
     db.refresh(db_exercise)
     return db_exercise
 
 # --- Detailed Workout Log CRUD ---
 
 def create_workout_log(db: Session, workout_log: schemas.WorkoutLogCreate, user_id: int):
+    _ensure_user_summary(db, user_id)
+    rollups.ensure_backfilled(db, user_id, for_write=True)
     db_workout_log = models.WorkoutLog(
         date=workout_log.date,
         name=workout_log.name,
@@ -148,11 +408,219 @@ def create_workout_log(db: Session, workout_log: schemas.WorkoutLogCreate, user_
                 weight_unit=set_log_in.weight_unit
             )
             db.add(db_set_log)
-            
+
+    # Live deltas are only worth computing when a client is listening
+    live_delta = None
+    if user_events.has_subscribers(user_id):
+        exercise_ids = [e.exercise_id for e in workout_log.logged_exercises]
+        live_delta = live.workout_delta(db_workout_log, live.previous_bests(db, user_id, exercise_ids))
+
+    rollups.apply_workout(db, db_workout_log)
+    _summary_record_workout(db, user_id, workout_log.date)
+    platform_stats.increment(db, platform_stats.WORKOUTS_TOTAL)
+    db.flush()
+    workout_id = db_workout_log.id
+    snapshot_rows = snapshots.workout_rows(db_workout_log)
     db.commit()
+    on_workout_data_changed(user_id)
+    platform_stats.record_active(user_id, workout_log.date)
+    if live_delta is not None:
+        live_delta["workout_id"] = workout_id
+        live_delta["workouts_this_month"] = get_user_summary(db, user_id).workouts_this_month
+        user_events.publish(user_id, "workout_logged", live_delta)
+    try:
+        snapshots.append_workout(user_id, workout_id, snapshot_rows)
+    except Exception as e:
+        # The snapshot is derived data; a stale one is rebuilt on its next read.
+        logger.error(f"Failed to append workout {workout_id} to history snapshot: {e}")
+        snapshots.mark_stale(user_id)
     db.refresh(db_workout_log)
     return db_workout_log
 
+def on_workout_data_changed(user_id: int):
+    # Call after any commit that creates, edits or deletes a user's workout logs.
+    analytics_cache.invalidate(user_id)
+    user_context_cache.invalidate(user_id)
+
+# --- AI Chat Sessions ---
+
+def create_chat_session(db: Session, user_id: int):
+    db_session = models.ChatSession(user_id=user_id)
+    db.add(db_session)
+    db.commit()
+    db.refresh(db_session)
+    return db_session
+
+def get_chat_session(db: Session, session_id: int, user_id: int):
+    return db.query(models.ChatSession).filter(models.ChatSession.id == session_id, models.ChatSession.user_id == user_id).first()
+
+def get_chat_sessions(db: Session, user_id: int, skip: int = 0, limit: int = 20):
+    return db.query(models.ChatSession).filter(models.ChatSession.user_id == user_id).order_by(models.ChatSession.updated_at.desc()).offset(skip).limit(limit).all()
+
+def _delete_chat_sessions(db: Session, session_ids):
+    # Turns first: SQLite doesn't enforce the ON DELETE CASCADE
+    db.query(models.ChatTurn).filter(models.ChatTurn.session_id.in_(session_ids)).delete(synchronize_session=False)
+    db.query(models.ChatSession).filter(models.ChatSession.id.in_(session_ids)).delete(synchronize_session=False)
+
+def delete_chat_session(db: Session, session_id: int, user_id: int) -> bool:
+    if get_chat_session(db, session_id, user_id) is None:
+        return False
+    _delete_chat_sessions(db, [session_id])
+    db.commit()
+    return True
+
+def get_recent_chat_turns(db: Session, session_id: int, after_turn_id: int = 0, limit: int = 50):
+    """Newest first; only turns after after_turn_id (i.e. not yet in the session summary)."""
+    return (
+        db.query(models.ChatTurn)
+        .filter(models.ChatTurn.session_id == session_id, models.ChatTurn.id > after_turn_id)
+        .order_by(models.ChatTurn.id.desc())
+        .limit(limit)
+        .all()
+    )
+
+def add_chat_turns(db: Session, session_id: int, turns: List[tuple]):
+    """turns: (role, content, tokens). Stored together, so a failed reply leaves no dangling question."""
+    db.add_all([models.ChatTurn(session_id=session_id, role=role, content=content, tokens=tokens) for role, content, tokens in turns])
+    session = db.get(models.ChatSession, session_id)
+    if session.title is None:
+        first_user_message = next((content for role, content, _ in turns if role == "user"), None)
+        if first_user_message:
+            session.title = " ".join(first_user_message.split())[:60]
+    session.updated_at = datetime.utcnow()
+    db.commit()
+
+def unsummarized_chat_tokens(db: Session, session_id: int, after_turn_id: int) -> int:
+    return db.query(func.coalesce(func.sum(models.ChatTurn.tokens), 0)).filter(
+        models.ChatTurn.session_id == session_id, models.ChatTurn.id > after_turn_id
+    ).scalar()
+
+def update_chat_summary(db: Session, session_id: int, summary: str, previous_through: int, summarized_through: int) -> bool:
+    """
+    Compare-and-set on summarized_through, so concurrent summarizers can't overwrite each other.
+    Leaves updated_at alone: it orders sessions by last message.
+    """
+    S = models.ChatSession
+    won = db.query(S).filter(S.id == session_id, S.summarized_through == previous_through).update(
+        {"summary": summary, "summarized_through": summarized_through, "updated_at": S.updated_at}, synchronize_session=False
+    )
+    db.commit()
+    return won == 1
+
+# --- Workout History Import ---
+
+def create_workout_import_job(db: Session, user_id: int, text: str):
+    db_job = models.WorkoutImportJob(user_id=user_id, source_text=text, status="pending")
+    db.add(db_job)
+    db.commit()
+    db.refresh(db_job)
+    return db_job
+
+def count_active_workout_import_jobs(db: Session, user_id: int) -> int:
+    J = models.WorkoutImportJob
+    return db.query(J).filter(J.user_id == user_id, J.status.in_(("pending", "running"))).count()
+
+def get_workout_import_job(db: Session, job_id: int, user_id: int):
+    return db.query(models.WorkoutImportJob).filter(models.WorkoutImportJob.id == job_id, models.WorkoutImportJob.user_id == user_id).first()
+
+def claim_workout_import_jobs(db: Session, limit: int, stale_before: datetime) -> List[tuple]:
+    """
+    Claims up to `limit` pending import jobs for this worker; returns (job_id, attempt, user_id, text).
+    Running jobs that stopped reporting progress before stale_before (dead worker) are queued again first.
+    """
+    J = models.WorkoutImportJob
+    db.query(J).filter(J.status == "running", J.updated_at < stale_before).update({"status": "pending"}, synchronize_session=False)
+    db.commit()
+    claimed = []
+    for job_id, attempt in db.query(J.id, J.attempt).filter(J.status == "pending").order_by(J.id).limit(limit).all():
+        # Compare-and-set on the attempt counter, so two workers can't both take a job
+        won = db.query(J).filter(J.id == job_id, J.status == "pending", J.attempt == attempt).update(
+            {"status": "running", "attempt": attempt + 1}, synchronize_session=False
+        )
+        db.commit()
+        if won == 1:
+            user_id, text = db.query(J.user_id, J.source_text).filter(J.id == job_id).one()
+            claimed.append((job_id, attempt + 1, user_id, text))
+    return claimed
+
+def update_workout_import_job(db: Session, job_id: int, attempt: int, **fields) -> bool:
+    """Records progress; False if the job has been taken over by another worker since this one claimed it."""
+    J = models.WorkoutImportJob
+    won = db.query(J).filter(J.id == job_id, J.status == "running", J.attempt == attempt).update(fields, synchronize_session=False)
+    db.commit()
+    return won == 1
+
+def import_workout_logs(db: Session, user_id: int, workouts: List[dict], job_id: int, attempt: int, **job_fields) -> Optional[int]:
+    """
+    Bulk-inserts an import job's workouts and marks the job completed, in one transaction.
+    workouts are WorkoutLogCreate-shaped dicts whose exercises all have an exercise_id.
+    Returns the number imported, or None (writing nothing) if another worker has taken over the job.
+    """
+    # Both may commit, so they run before the claim below
+    _ensure_user_summary(db, user_id)
+    rollups.ensure_backfilled(db, user_id, for_write=True)
+    J = models.WorkoutImportJob
+    won = db.query(J).filter(J.id == job_id, J.status == "running", J.attempt == attempt).update({
+        **job_fields,
+        "status": "completed",
+        "imported_workouts": len(workouts),
+        "finished_at": datetime.utcnow(),
+    }, synchronize_session=False)
+    if won != 1:
+        db.rollback()
+        return None
+    if not workouts:
+        db.commit()
+        return 0
+
+    workout_ids = db.scalars(
+        insert(models.WorkoutLog).returning(models.WorkoutLog.id, sort_by_parameter_order=True),
+        [{"date": w["date"], "name": w["name"], "notes": w.get("notes"), "owner_id": user_id} for w in workouts],
+    ).all()
+    exercises = [
+        (workout_id, e["exercise_id"], e)
+        for workout_id, w in zip(workout_ids, workouts)
+        for e in w["logged_exercises"]
+    ]
+    logged_exercise_ids = db.scalars(
+        insert(models.LoggedExercise).returning(models.LoggedExercise.id, sort_by_parameter_order=True),
+        [{"workout_log_id": workout_id, "exercise_id": exercise_id, "notes": e.get("notes")} for workout_id, exercise_id, e in exercises],
+    ).all()
+    set_rows = [
+        {"logged_exercise_id": logged_exercise_id, "set_number": s["set_number"], "reps": s["reps"], "weight": s["weight"], "weight_unit": s["weight_unit"]}
+        for logged_exercise_id, (_, _, e) in zip(logged_exercise_ids, exercises)
+        for s in e["sets"]
+    ]
+    if set_rows:
+        db.execute(insert(models.SetLog), set_rows)
+
+    # Derived data, same as create_workout_log but one statement per table
+    by_workout = {}
+    for workout_id, exercise_id, e in exercises:
+        by_workout.setdefault(workout_id, []).append((exercise_id, [(s["weight"], s["reps"]) for s in e["sets"]]))
+    rollups.apply_workouts(db, user_id, [(w["date"], w["name"], by_workout.get(workout_id, [])) for workout_id, w in zip(workout_ids, workouts)])
+    _summary_record_workouts(db, user_id, [w["date"] for w in workouts])
+    platform_stats.increment(db, platform_stats.WORKOUTS_TOTAL, len(workouts))
+    dates = dict(zip(workout_ids, (w["date"] for w in workouts)))
+    snapshot_rows = [
+        (dates[workout_id], workout_id, exercise_id, s["reps"] or 0, s["weight"] or 0.0)
+        for workout_id, exercise_id, e in exercises
+        for s in e["sets"]
+    ]
+    # Imported history is usually older than the cohort job's lookback
+    cohorts.rescan_from(db, min(dates.values()))
+    db.commit()
+
+    on_workout_data_changed(user_id)
+    for workout_date in set(dates.values()):
+        platform_stats.record_active(user_id, workout_date)
+    try:
+        snapshots.append_workout(user_id, max(workout_ids), snapshot_rows)
+    except Exception as e:
+        logger.error(f"Failed to append imported workouts to history snapshot of user {user_id}: {e}")
+        snapshots.mark_stale(user_id)
+    return len(workouts)
+
 def get_workout_log(db: Session, workout_log_id: int, user_id: int):
     return db.query(models.WorkoutLog).filter(models.WorkoutLog.id == workout_log_id, models.WorkoutLog.owner_id == user_id).first()
 
@@ -210,7 +678,6 @@ def create_challenge(db: Session, challenge: schemas.ChallengeCreate):
 def get_challenges(db: Session, skip: int = 0, limit: int = 100):
     return db.query(models.Challenge).offset(skip).limit(limit).all()
 
-from .ai import moderator
 from .mind import models as mind_models
 
 # --- Community Posts ---
@@ -222,30 +689,35 @@ async def create_post(db: Session, post: schemas.PostCreate, user_id: int):
     db.refresh(db_post)
     return db_post
 
-async def process_post_moderation(db: Session, post_id: int):
-    # Background Task Logic
-    post = db.query(models.Post).filter(models.Post.id == post_id).first()
-    if not post:
-        return
-
-    # 1. Content Moderation
-    is_safe, reason = await moderator.check_content(post.content)
-    
-    if not is_safe:
-        # Log the violation
-        log = mind_models.MonitoringLog(
-            user_id=post.user_id,
-            action=mind_models.MonitoringAction.WARNING,
-            reason=f"Toxic: {reason} | Content: '{post.content[:50]}...'",
-            timestamp=datetime.utcnow(),
-            source="AI"
-        )
-        db.add(log)
-        
-        # Delete the toxic post
-        db.delete(post)
-        db.commit()
-        # In a real app, we might push a notification to the user saying "Post removed"
+def get_posts_by_ids(db: Session, post_ids: List[int]) -> List[models.Post]:
+    if not post_ids:
+        return []
+    return db.query(models.Post).filter(models.Post.id.in_(post_ids)).all()
+
+def remove_unsafe_posts(db: Session, removals: List[tuple]) -> int:
+    """
+    removals: (post_id, user_id, content, reason). Logs a WARNING for each and deletes the posts, in one transaction.
+    """
+    if not removals:
+        return 0
+    now = datetime.utcnow()
+    db.execute(mind_models.MonitoringLog.__table__.insert(), [
+        {
+            "user_id": user_id,
+            "action": mind_models.MonitoringAction.WARNING,
+            "reason": f"Toxic: {reason} | Content: '{content[:50]}...'",
+            "timestamp": now,
+            "source": "AI",
+        }
+        for _, user_id, content, reason in removals
+    ])
+    post_ids = [post_id for post_id, _, _, _ in removals]
+    # Reports filed against these posts keep their log rows but lose the link
+    db.query(mind_models.MonitoringLog).filter(mind_models.MonitoringLog.post_id.in_(post_ids)).update({"post_id": None}, synchronize_session=False)
+    deleted = db.query(models.Post).filter(models.Post.id.in_(post_ids)).delete(synchronize_session=False)
+    db.commit()
+    # In a real app, we might push a notification to the user saying "Post removed"
+    return deleted
 
 def get_posts(db: Session, skip: int = 0, limit: int = 50):
     return db.query(models.Post).order_by(models.Post.created_at.desc()).offset(skip).limit(limit).all()
@@ -265,96 +737,183 @@ def delete_challenge(db: Session, challenge_id: int):
     return db_challenge
 
 # --- Analytics ---
+METRIC_COLUMNS = {
+    schemas.AnalyticsMetric.VOLUME: "volume",
+    schemas.AnalyticsMetric.MAX_WEIGHT: "max_weight",
+    schemas.AnalyticsMetric.TOTAL_REPS: "total_reps",
+    schemas.AnalyticsMetric.TOTAL_SETS: "set_count",
+    schemas.AnalyticsMetric.FREQUENCY: "workout_count",
+}
+
 def get_analytics_data(db: Session, user_id: int, request: schemas.AnalyticsRequest):
-    query = db.query()
-    
-    group_label = None
-    metric_calc = None
-    
-    # 1. Select Metric Calculation
-    if request.metric == schemas.AnalyticsMetric.VOLUME:
-        metric_calc = func.sum(models.SetLog.weight * models.SetLog.reps)
-    elif request.metric == schemas.AnalyticsMetric.MAX_WEIGHT:
-        metric_calc = func.max(models.SetLog.weight)
-    elif request.metric == schemas.AnalyticsMetric.TOTAL_REPS:
-        metric_calc = func.sum(models.SetLog.reps)
-    elif request.metric == schemas.AnalyticsMetric.TOTAL_SETS:
-        metric_calc = func.count(models.SetLog.id)
-    elif request.metric == schemas.AnalyticsMetric.FREQUENCY:
-        metric_calc = func.count(models.WorkoutLog.id.distinct())
-
-    # 2. Build Query & Joins
-    if request.metric == schemas.AnalyticsMetric.FREQUENCY:
-        # Frequency: Count distinct workouts
-        query = query.select_from(models.WorkoutLog)
-        
+    return get_analytics_data_batch(db, user_id, [request])[0]
+
+def get_analytics_data_batch(db: Session, user_id: int, requests: List[schemas.AnalyticsRequest]):
+    """
+    Answers several analytics requests for one user.
+    Results are served from memory until the user's next workout write bumps their generation,
+    and requests that differ only in metric share a single rollup scan.
+    """
+    rollups.ensure_backfilled(db, user_id)
+    generation = analytics_cache.generation(user_id)
+    results = [None] * len(requests)
+    pending = {}
+    mapping_version = None
+
+    for i, request in enumerate(requests):
+        cache_key = canonical_key(request)
         if request.group_by == schemas.AnalyticsGroupBy.MUSCLE_GROUP:
-             query = query.join(models.LoggedExercise).join(models.Exercise).join(models.ExerciseMuscleGroupAssociation).join(models.MuscleGroup)
-             group_label = models.MuscleGroup.name
-             if request.filter_ids:
-                query = query.filter(models.MuscleGroup.id.in_(request.filter_ids))
-                
-        elif request.group_by == schemas.AnalyticsGroupBy.EXERCISE:
-             query = query.join(models.LoggedExercise).join(models.Exercise)
-             group_label = models.Exercise.name
-             if request.filter_ids:
-                 query = query.filter(models.Exercise.id.in_(request.filter_ids))
-                 
-        elif request.group_by == schemas.AnalyticsGroupBy.WORKOUT_TEMPLATE:
-             group_label = models.WorkoutLog.name
-             
-        elif request.group_by == schemas.AnalyticsGroupBy.DATE:
-             group_label = models.WorkoutLog.date
-             
+            # Muscle-group results also depend on the exercise catalog
+            if mapping_version is None:
+                mapping_version = muscle_map.get_mapping(db).version
+            cache_key = f"{cache_key}:catalog-{mapping_version}"
+        cached = analytics_cache.get(user_id, cache_key)
+        if cached is not None:
+            results[i] = cached
+        else:
+            pending.setdefault(analytics_scan_key(request), []).append((i, cache_key))
+
+    for items in pending.values():
+        rows = _scan_rollups(db, user_id, requests[items[0][0]])
+        for i, cache_key in items:
+            results[i] = _analytics_points(rows, requests[i])
+            analytics_cache.set(user_id, cache_key, results[i], generation)
+
+    return results
+
+def analytics_scan_key(request: schemas.AnalyticsRequest):
+    # Everything that changes which rollup rows are read; the metric is picked afterwards.
+    granularity = request.granularity if request.group_by == schemas.AnalyticsGroupBy.DATE else None
+    return (request.group_by, granularity, request.start_date, request.end_date, tuple(sorted(request.filter_ids)))
+
+def _date_bucket(db: Session, column, granularity: schemas.AnalyticsGranularity):
+    # Bucketing happens in SQL so only one row per bucket comes back.
+    if granularity == schemas.AnalyticsGranularity.DAY:
+        return column
+    if db.get_bind().dialect.name == "postgresql":
+        # Inline literal: a bound parameter would make SELECT and GROUP BY expressions differ
+        return cast(func.date_trunc(literal_column(f"'{granularity.value}'"), column), Date)
+    # SQLite
+    if granularity == schemas.AnalyticsGranularity.WEEK:
+        return func.date(column, "weekday 0", "-6 days")
+    if granularity == schemas.AnalyticsGranularity.MONTH:
+        return func.strftime("%Y-%m-01", column)
+    quarter_month = (cast(func.strftime("%m", column), Integer) - 1) // 3 * 3 + 1
+    return func.strftime("%Y-", column, type_=String) + func.printf("%02d", quarter_month, type_=String) + "-01"
+
+def _previous_bucket(bucket: date, granularity: schemas.AnalyticsGranularity) -> date:
+    if granularity == schemas.AnalyticsGranularity.DAY:
+        return bucket - timedelta(days=1)
+    if granularity == schemas.AnalyticsGranularity.WEEK:
+        return bucket - timedelta(days=7)
+    months = 1 if granularity == schemas.AnalyticsGranularity.MONTH else 3
+    month_index = bucket.year * 12 + bucket.month - 1 - months
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+def _scan_rollups(db: Session, user_id: int, request: schemas.AnalyticsRequest):
+    # Reads the daily rollups (analytics.rollups), so cost scales with days in range, not sets logged.
+
+    # 1. Pick the rollup table and group label
+    if request.group_by in (schemas.AnalyticsGroupBy.DATE, schemas.AnalyticsGroupBy.WORKOUT_TEMPLATE):
+        source = models.TrainingDailyWorkoutRollup
+        query = db.query().select_from(source)
+        if request.group_by == schemas.AnalyticsGroupBy.DATE:
+            group_label = _date_bucket(db, source.date, request.granularity)
+        else:
+            group_label = source.workout_name
+
+    elif request.group_by == schemas.AnalyticsGroupBy.EXERCISE:
+        source = models.TrainingDailyRollup
+        query = db.query().select_from(source).join(models.Exercise, source.exercise_id == models.Exercise.id)
+        group_label = models.Exercise.name
+        if request.filter_ids:
+            query = query.filter(source.exercise_id.in_(request.filter_ids))
+
     else:
-        # Volume/Strength: Use SetLogs
-        query = query.select_from(models.SetLog)
-        query = query.join(models.LoggedExercise).join(models.WorkoutLog)
-        
-        if request.group_by == schemas.AnalyticsGroupBy.MUSCLE_GROUP:
-             query = query.join(models.Exercise, models.LoggedExercise.exercise_id == models.Exercise.id)\
-                          .join(models.ExerciseMuscleGroupAssociation)\
-                          .join(models.MuscleGroup)
-             group_label = models.MuscleGroup.name
-             if request.filter_ids:
-                 query = query.filter(models.MuscleGroup.id.in_(request.filter_ids))
-                 
-        elif request.group_by == schemas.AnalyticsGroupBy.EXERCISE:
-             query = query.join(models.Exercise, models.LoggedExercise.exercise_id == models.Exercise.id)
-             group_label = models.Exercise.name
-             if request.filter_ids:
-                 query = query.filter(models.Exercise.id.in_(request.filter_ids))
-                 
-        elif request.group_by == schemas.AnalyticsGroupBy.WORKOUT_TEMPLATE:
-             group_label = models.WorkoutLog.name
-             
-        elif request.group_by == schemas.AnalyticsGroupBy.DATE:
-             group_label = models.WorkoutLog.date
-
-    # 3. Apply Common Filters
-    query = query.filter(models.WorkoutLog.owner_id == user_id)
+        # Muscle groups are projected from per-exercise rows via the in-memory mapping (no join fan-out)
+        source = models.TrainingDailyRollup
+        query = db.query().select_from(source)
+        mapping = muscle_map.get_mapping(db)
+        if request.filter_ids:
+            query = query.filter(source.exercise_id.in_(mapping.exercises_for(request.filter_ids)))
+
+    # 2. Apply Common Filters
+    query = query.filter(source.user_id == user_id)
     if request.start_date:
-        query = query.filter(models.WorkoutLog.date >= request.start_date)
+        query = query.filter(source.date >= request.start_date)
     if request.end_date:
-        query = query.filter(models.WorkoutLog.date <= request.end_date)
-        
-    # 4. Execute
-    if group_label is not None:
-        query = query.group_by(group_label)
-        query = query.with_entities(group_label.label("label"), metric_calc.label("value"))
-    else:
-        query = query.with_entities(func.literal("Total").label("label"), metric_calc.label("value"))
-        
-    results = query.all()
-    
+        query = query.filter(source.date <= request.end_date)
+
+    # 3. Execute, computing every metric in one pass
+    if request.group_by == schemas.AnalyticsGroupBy.MUSCLE_GROUP:
+        # Rollup rows are already one per (day, exercise)
+        query = query.with_entities(
+            source.exercise_id, source.date, source.volume, source.max_weight,
+            source.total_reps, source.set_count, source.workout_count,
+        )
+        return muscle_map.project(query.all(), mapping, request.filter_ids)
+
+    query = query.group_by(group_label).with_entities(
+        group_label.label("label"),
+        func.sum(source.volume).label("volume"),
+        func.max(source.max_weight).label("max_weight"),
+        func.sum(source.total_reps).label("total_reps"),
+        func.sum(source.set_count).label("set_count"),
+        func.sum(source.workout_count).label("workout_count"),
+    )
+    if request.group_by == schemas.AnalyticsGroupBy.DATE:
+        query = query.order_by(group_label)
+
     return [
+        {"label": r.label, **{name: getattr(r, name) or 0 for name in METRIC_COLUMNS.values()}}
+        for r in query.all()
+    ]
+
+def _analytics_points(rows: list, request: schemas.AnalyticsRequest):
+    column = METRIC_COLUMNS[request.metric]
+    points = [
         schemas.AnalyticsDataPoint(
-            label=str(r.label) if r.label else "Unknown",
-            value=float(r.value) if r.value else 0.0,
-            date=str(r.label) if request.group_by == schemas.AnalyticsGroupBy.DATE and r.label else None
+            label=str(r["label"]) if r["label"] else "Unknown",
+            value=float(r[column]) if r[column] else 0.0,
+            date=str(r["label"]) if request.group_by == schemas.AnalyticsGroupBy.DATE and r["label"] else None
         )
-        for r in results
+        for r in rows
+        # Set-based metrics only report groups that actually have sets logged
+        if request.metric == schemas.AnalyticsMetric.FREQUENCY or r["set_count"]
     ]
+    if request.group_by == schemas.AnalyticsGroupBy.DATE and (request.rolling_window or request.compare_previous):
+        _add_time_series_stats(points, request)
+    return points
+
+def _add_time_series_stats(points: list, request: schemas.AnalyticsRequest):
+    """
+    Fills rolling_avg and delta on a bucketed series. Empty buckets count as 0 for
+    additive metrics and are skipped for max_weight.
+    """
+    values = {p.date: p.value for p in points if p.date}
+    if not values:
+        return
+    first_bucket = min(date.fromisoformat(d) for d in values)
+    additive = request.metric != schemas.AnalyticsMetric.MAX_WEIGHT
+
+    for p in points:
+        if not p.date:
+            continue
+        bucket = date.fromisoformat(p.date)
+        previous = _previous_bucket(bucket, request.granularity)
+        if request.compare_previous:
+            previous_value = values.get(str(previous), 0.0 if additive else None)
+            p.delta = p.value - previous_value if previous_value is not None else None
+        if request.rolling_window:
+            window = []
+            for _ in range(request.rolling_window):
+                if bucket < first_bucket:
+                    break
+                value = values.get(str(bucket))
+                if value is not None or additive:
+                    window.append(value or 0.0)
+                bucket = _previous_bucket(bucket, request.granularity)
+            p.rolling_avg = round(sum(window) / len(window), 2) if window else None
 
 
 # --- Dashboard Widgets ---
@@ -0,0 +1,50 @@
+from sqlalchemy import create_engine, text
+import sys
+import os
+
+# Add parent dir to path to import core
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from fitness_app.core.database import SQLALCHEMY_DATABASE_URL
+
+HABIT_FIELDS = ("sleep_hours", "water_liters", "steps", "daily_notes")
+
+def migrate():
+    """
+    Merges duplicate habit rows per (owner_id, date) into the oldest row, then adds the unique index.
+    For each field the most recent non-empty value wins, matching the new upsert behaviour.
+    """
+    engine = create_engine(SQLALCHEMY_DATABASE_URL)
+    with engine.begin() as conn:
+        print("Running migration for Habit (one row per user per day)...")
+        duplicates = conn.execute(text(
+            "SELECT owner_id, date FROM habits GROUP BY owner_id, date HAVING COUNT(*) > 1"
+        )).fetchall()
+        print(f"Found {len(duplicates)} user-days with duplicate habit rows.")
+
+        for owner_id, day in duplicates:
+            rows = conn.execute(
+                text(f"SELECT id, {', '.join(HABIT_FIELDS)} FROM habits WHERE owner_id = :owner_id AND date = :day ORDER BY id"),
+                {"owner_id": owner_id, "day": day}
+            ).mappings().fetchall()
+            keep_id = rows[0]["id"]
+            merged = {}
+            for row in rows:
+                for field in HABIT_FIELDS:
+                    if row[field] is not None:
+                        merged[field] = row[field]
+            conn.execute(
+                text(f"UPDATE habits SET {', '.join(f'{field} = :{field}' for field in HABIT_FIELDS)} WHERE id = :id"),
+                {**{field: merged.get(field) for field in HABIT_FIELDS}, "id": keep_id}
+            )
+            conn.execute(
+                text("DELETE FROM habits WHERE owner_id = :owner_id AND date = :day AND id <> :id"),
+                {"owner_id": owner_id, "day": day, "id": keep_id}
+            )
+
+        conn.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS uq_habits_owner_date ON habits (owner_id, date)"))
+        print("Added unique index 'uq_habits_owner_date'.")
+    print("Migration complete.")
+
+if __name__ == "__main__":
+    migrate()
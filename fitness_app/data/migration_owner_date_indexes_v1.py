@@ -0,0 +1,29 @@
+from sqlalchemy import create_engine, text
+import sys
+import os
+
+# Add parent dir to path to import core
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from fitness_app.core.database import SQLALCHEMY_DATABASE_URL
+
+INDEXES = {
+    "ix_workout_logs_owner_date": "workout_logs (owner_id, date)",
+    "ix_meal_logs_owner_date": "meal_logs (owner_id, date)",
+}
+
+def migrate():
+    """
+    Adds (owner_id, date) indexes so a user's most recent workouts and meals are read with a
+    short index scan instead of loading everything they ever logged.
+    """
+    engine = create_engine(SQLALCHEMY_DATABASE_URL)
+    with engine.begin() as conn:
+        print("Running migration for per-user date indexes...")
+        for name, target in INDEXES.items():
+            conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {target}"))
+            print(f"Added index '{name}'.")
+    print("Migration complete.")
+
+if __name__ == "__main__":
+    migrate()
@@ -0,0 +1,40 @@
+import argparse
+import logging
+import sys
+import os
+
+# Add parent dir to path to import core
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from fitness_app.core.database import SessionLocal, engine
+from fitness_app import models
+from fitness_app.analytics import nutrition, rollups
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill/rebuild the daily training and nutrition rollup tables from raw logs.")
+    parser.add_argument("--user-id", type=int, help="Only rebuild this user's rollups")
+    args = parser.parse_args()
+
+    models.Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        if args.user_id:
+            rows = rollups.rebuild_user_rollups(db, args.user_id)
+            logger.info(f"Rebuilt {rows} rollup rows for user {args.user_id}.")
+            rows = nutrition.rebuild_user_nutrition(db, args.user_id)
+            logger.info(f"Rebuilt {rows} nutrition rows for user {args.user_id}.")
+        else:
+            users = rollups.rebuild_all_rollups(db)
+            logger.info(f"Rebuilt rollups for {users} users.")
+            users = nutrition.rebuild_all_nutrition(db)
+            logger.info(f"Rebuilt nutrition rollups for {users} users.")
+        # Running API workers keep cached analytics until the user's next write or a restart.
+        # Training rollups are also built lazily per user on first use; this is for repairs.
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
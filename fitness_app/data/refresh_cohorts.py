@@ -0,0 +1,37 @@
+import argparse
+import logging
+import sys
+import os
+from datetime import date
+
+# Add parent dir to path to import core
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from fitness_app.core.database import SessionLocal, engine
+from fitness_app import models
+from fitness_app.analytics import cohorts
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the cohort/retention batch job (only days after its watermark).")
+    parser.add_argument("--until", type=date.fromisoformat, help="Last day to process (YYYY-MM-DD, default: yesterday)")
+    parser.add_argument("--reset", action="store_true", help="Clear the watermark and recompute from the first activity")
+    args = parser.parse_args()
+
+    models.Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        if args.reset:
+            for model in (models.DailyUserActivity, models.UserCohort, models.CohortRetention, models.CohortSummary):
+                db.query(model).delete(synchronize_session=False)
+            db.query(models.BatchJobState).filter(models.BatchJobState.name == cohorts.JOB_NAME).delete(synchronize_session=False)
+            db.commit()
+        days = cohorts.run(db, until=args.until)
+        logger.info(f"Processed {days} days; cohorts computed through {cohorts.computed_through(db)}.")
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,25 @@
+import base64
 import logging
 import os
-from datetime import timedelta
-from typing import List
+from datetime import date, datetime, timedelta
+from typing import List, Optional
 
-from fastapi import Depends, FastAPI, HTTPException, status
+from fastapi import Depends, FastAPI, HTTPException, Query, Request, status
+from fastapi.responses import StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
 
 from .auth import auth
 from . import crud, models, schemas
 from .core.database import SessionLocal, engine
-from .ai import ai_meal, ai_workout, ai_chat
+from .core import sample_buffer, scheduler
+from .analytics import cohorts, nutrition, platform_stats, snapshots
+from .analytics.cache import user_context_cache
+from .ai import ai_meal, ai_workout, ai_chat, chat_sessions, gateway, meal_images, moderation_worker, resilience, user_context, workout_import, workout_parser
+from .ai.response_cache import response_cache
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -28,7 +35,7 @@ app.include_router(admin.router)
 app.include_router(analytics.router)
 app.include_router(users.router)
 
-from .mind import router as mind_router
+from .mind import models as mind_models, motivation, router as mind_router
 app.include_router(mind_router.router)
 
 # Compatibility redirect (optional, or just update frontend)
@@ -77,6 +84,72 @@ def on_startup():
     models.Base.metadata.create_all(bind=engine)
     logger.info("Application startup: Database schema verified.")
 
+scheduler.register("platform-stats-refresh", platform_stats.REFRESH_SECONDS, platform_stats.refresh_snapshot)
+scheduler.register("platform-stats-reconcile", platform_stats.RECONCILE_SECONDS, platform_stats.reconcile)
+scheduler.register("cohorts", cohorts.RUN_SECONDS, cohorts.run_job)
+scheduler.register("snapshot-compaction", snapshots.COMPACT_SECONDS, snapshots.compact_pending)
+
+def flush_habit_samples():
+    db = SessionLocal()
+    try:
+        crud.flush_habit_samples(db)
+    finally:
+        db.close()
+
+scheduler.register("habit-samples-flush", sample_buffer.FLUSH_SECONDS, flush_habit_samples)
+scheduler.register("ai-cache-prune", 3600, response_cache.prune)
+scheduler.register("post-moderation", moderation_worker.FLUSH_SECONDS, moderation_worker.drain)
+scheduler.register("workout-imports", workout_import.POLL_SECONDS, workout_import.run_pending, run_on_start=True)
+scheduler.register("motivation-prewarm", motivation.PREWARM_SECONDS, motivation.prewarm, run_on_start=True)
+
+@app.on_event("startup")
+async def start_background_jobs():
+    await scheduler.start()
+    await gateway.startup()
+
+@app.on_event("shutdown")
+async def stop_background_jobs():
+    await scheduler.stop()
+    # Don't lose activity and samples buffered since the last run
+    await run_in_threadpool(platform_stats.flush_active_users)
+    await run_in_threadpool(flush_habit_samples)
+    await moderation_worker.drain()
+    await gateway.shutdown()
+    meal_images.shutdown()
+
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", 0))
+MAX_REQUEST_DEADLINE_SECONDS = 120.0
+
+class DeadlineMiddleware:
+    """
+    Gives AI calls made for this request a deadline: the client's X-Request-Timeout
+    (seconds) if sent, else REQUEST_DEADLINE_SECONDS (0 = only the per-feature timeouts).
+    Plain ASGI rather than @app.middleware("http"), which would wrap every response,
+    SSE streams included, in BaseHTTPMiddleware's extra task and buffering.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        seconds = REQUEST_DEADLINE_SECONDS
+        header = dict(scope["headers"]).get(b"x-request-timeout")
+        if header:
+            try:
+                seconds = min(float(header), MAX_REQUEST_DEADLINE_SECONDS)
+            except ValueError:
+                pass
+        if seconds <= 0:
+            return await self.app(scope, receive, send)
+        token = gateway.set_deadline(seconds)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            gateway.reset_deadline(token)
+
+app.add_middleware(DeadlineMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -95,23 +168,19 @@ def update_user_me(user_update: schemas.UserUpdate, db: Session = Depends(get_db
 
 @app.get("/users/me/stats", response_model=schemas.UserStats, tags=["Users"])
 def read_user_stats(db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_user)):
-    workouts_count = crud.count_workouts_this_month(db, current_user.id)
-    
-    # Simple logic for weight (last entry) - could be moved to CRUD for efficiency
-    latest_progress = db.query(models.Progress).filter(models.Progress.owner_id == current_user.id).order_by(models.Progress.date.desc()).first()
-    first_progress = db.query(models.Progress).filter(models.Progress.owner_id == current_user.id).order_by(models.Progress.date.asc()).first()
-    
-    current_w = latest_progress.weight if latest_progress else None
-    start_w = first_progress.weight if first_progress else None
-    
+    # One primary-key lookup on the denormalized summary row
+    summary = crud.get_user_summary(db, current_user.id)
+
     total_change = None
-    if current_w is not None and start_w is not None:
-        total_change = current_w - start_w
+    if summary.last_weight is not None and summary.first_weight is not None:
+        total_change = summary.last_weight - summary.first_weight
         
     return schemas.UserStats(
-        workouts_this_month=workouts_count,
-        current_weight=current_w,
-        total_progress=total_change
+        workouts_this_month=summary.workouts_this_month,
+        current_weight=summary.last_weight,
+        total_progress=total_change,
+        total_workouts=summary.total_workouts,
+        total_meals=summary.total_meals
     )
 
 # --- Progress Tracking ---
@@ -167,6 +236,15 @@ def read_workout_log(log_id: int, db: Session = Depends(get_db), current_user: m
 def create_habit(habit: schemas.HabitCreate, db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_user)):
     return crud.create_habit(db=db, habit=habit, user_id=current_user.id)
 
+@app.post("/habits/samples", response_model=schemas.WearableIngestResult, status_code=202, tags=["Habits"])
+def ingest_habit_samples(batch: schemas.WearableSampleBatch, db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_user)):
+    """
+    Batch ingestion of wearable readings. Samples are aggregated in memory and
+    written to the daily habit rows in bulk every few seconds.
+    """
+    days = crud.ingest_habit_samples(db=db, samples=batch.samples, user_id=current_user.id)
+    return schemas.WearableIngestResult(accepted=len(batch.samples), days=days)
+
 @app.get("/habits/", response_model=List[schemas.Habit], tags=["Habits"])
 def read_habits(skip: int = 0, limit: int = 30, db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_user)):
     return crud.get_habits_by_user(db=db, user_id=current_user.id, skip=skip, limit=limit)
@@ -176,6 +254,24 @@ def read_habits(skip: int = 0, limit: int = 30, db: Session = Depends(get_db), c
 def create_meal_log(meal_log: schemas.MealLogCreate, db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_user)):
     return crud.create_meal_log(db=db, meal_log=meal_log, user_id=current_user.id)
 
+@app.get("/meals/summary", response_model=schemas.NutritionSummary, tags=["Nutrition"])
+def read_meal_summary(
+    from_date: Optional[date] = Query(None, alias="from"),
+    to_date: Optional[date] = Query(None, alias="to"),
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """
+    Daily and weekly calorie/macro totals and averages. Defaults to the last 30 days.
+    """
+    to_date = to_date or date.today()
+    from_date = from_date or to_date - timedelta(days=29)
+    if from_date > to_date:
+        raise HTTPException(status_code=400, detail="'from' must not be after 'to'")
+    if (to_date - from_date).days > 366:
+        raise HTTPException(status_code=400, detail="Date range cannot exceed one year")
+    return nutrition.summary(db, current_user.id, from_date, to_date)
+
 @app.get("/meals/", response_model=List[schemas.MealLog], tags=["Nutrition"])
 def read_meal_logs(skip: int = 0, limit: int = 30, db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_user)):
     return crud.get_meal_logs_by_user(db=db, user_id=current_user.id, skip=skip, limit=limit)
@@ -184,9 +280,52 @@ def read_meal_logs(skip: int = 0, limit: int = 30, db: Session = Depends(get_db)
 class ImageAnalysisRequest(BaseModel):
     image_base64: str
 
+@app.get("/ai/cache-stats", tags=["AI"])
+def get_ai_cache_stats(admin_user: models.User = Depends(auth.get_current_admin_user)):
+    """
+    Hit/miss counts and latency saved by the AI response cache, per feature. ADMIN ONLY.
+    """
+    return response_cache.stats()
+
+@app.get("/ai/metrics", tags=["AI"])
+def get_ai_metrics(admin_user: models.User = Depends(auth.get_current_admin_user)):
+    """
+    Circuit breaker state per model, the adaptive concurrency limit, per-feature bulkhead usage,
+    the post moderation queue, meal photo cache hits, the local workout parser hit rate and
+    coach context cache hits. ADMIN ONLY.
+    """
+    return {
+        **resilience.stats(),
+        "moderation": moderation_worker.queue_stats(),
+        "meal_photo_cache": meal_images.meal_photo_cache.stats(),
+        "workout_parser": workout_parser.parser_stats(),
+        "user_context_cache": user_context_cache.stats(),
+    }
+
 @app.post("/ai/analyze-meal", tags=["AI"])
 async def analyze_meal(request: ImageAnalysisRequest, current_user: models.User = Depends(auth.get_current_paid_user)):
-    return await ai_meal.analyze_meal_image(request.image_base64)
+    try:
+        data = base64.b64decode(request.image_base64, validate=True)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="image_base64 is not valid base64")
+    try:
+        return await ai_meal.analyze_meal_photo(current_user.id, data)
+    except meal_images.UploadError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/ai/analyze-meal/upload", tags=["AI"])
+async def analyze_meal_upload(request: Request, current_user: models.User = Depends(auth.get_current_paid_user)):
+    """
+    Same as /ai/analyze-meal, but takes the photo as a multipart/form-data file field named 'image'.
+    The body is streamed and rejected with 413 once it passes the size cap (MEAL_IMAGE_MAX_BYTES).
+    """
+    try:
+        data = await meal_images.read_multipart_file(request, "image")
+        return await ai_meal.analyze_meal_photo(current_user.id, data)
+    except meal_images.UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except meal_images.UploadError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 @app.post("/ai/generate-workout", tags=["AI"])
 async def generate_workout(request: ai_workout.WorkoutPlanRequest, current_user: models.User = Depends(auth.get_current_paid_user)):
@@ -195,12 +334,69 @@ async def generate_workout(request: ai_workout.WorkoutPlanRequest, current_user:
     return {"plan": plan}
 
 
+@app.post("/ai/generate-workout/stream", tags=["AI"])
+async def generate_workout_stream(request: ai_workout.WorkoutPlanRequest, http_request: Request, current_user: models.User = Depends(auth.get_current_paid_user)):
+    """Streams the workout plan as Server-Sent Events ('token' events, then 'done' or 'error')."""
+    return StreamingResponse(
+        gateway.sse_relay(http_request, ai_workout.stream_workout_plan(current_user, request)),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+def _get_chat_session_or_404(db: Session, session_id: int, user_id: int) -> models.ChatSession:
+    session = crud.get_chat_session(db, session_id, user_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="Chat session not found")
+    return session
+
 @app.post("/ai/chat", tags=["AI"])
-async def chat_with_ai(request: ai_chat.ChatRequest, current_user: models.User = Depends(auth.get_current_paid_user)):
-    """Interacts with the AI Fitness Coach."""
-    response = await ai_chat.chat_with_coach(request)
+async def chat_with_ai(request: ai_chat.ChatRequest, db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_paid_user)):
+    """
+    Interacts with the AI Fitness Coach.
+    With a session_id the server keeps the conversation; otherwise the client sends its history.
+    """
+    if request.session_id is not None:
+        session = await run_in_threadpool(_get_chat_session_or_404, db, request.session_id, current_user.id)
+        return {"response": await chat_sessions.reply(db, current_user, session, request.message), "session_id": session.id}
+    response = await ai_chat.chat_with_coach(request, await user_context.for_prompt(db, current_user))
     return {"response": response}
 
+@app.post("/ai/chat/stream", tags=["AI"])
+async def chat_with_ai_stream(request: ai_chat.ChatRequest, http_request: Request, db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_paid_user)):
+    """Streams the AI Coach's reply as Server-Sent Events ('token' events, then 'done' or 'error')."""
+    if request.session_id is not None:
+        session = await run_in_threadpool(_get_chat_session_or_404, db, request.session_id, current_user.id)
+        chunks = chat_sessions.stream_reply(db, current_user, session, request.message)
+    else:
+        chunks = ai_chat.stream_chat_with_coach(request, await user_context.for_prompt(db, current_user))
+    return StreamingResponse(
+        gateway.sse_relay(http_request, chunks),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.post("/ai/chat/sessions", response_model=schemas.ChatSession, status_code=201, tags=["AI"])
+def create_chat_session(db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_paid_user)):
+    """Starts a server-side conversation; pass its id as session_id to /ai/chat."""
+    return crud.create_chat_session(db, current_user.id)
+
+@app.get("/ai/chat/sessions", response_model=List[schemas.ChatSession], tags=["AI"])
+def read_chat_sessions(skip: int = 0, limit: int = 20, db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_paid_user)):
+    return crud.get_chat_sessions(db, current_user.id, skip=skip, limit=limit)
+
+@app.get("/ai/chat/sessions/{session_id}", response_model=schemas.ChatSessionDetail, tags=["AI"])
+def read_chat_session(session_id: int, limit: int = Query(50, le=200), db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_paid_user)):
+    """The session with its most recent turns, oldest first."""
+    session = _get_chat_session_or_404(db, session_id, current_user.id)
+    turns = crud.get_recent_chat_turns(db, session_id, limit=limit)[::-1]
+    return {**schemas.ChatSession.model_validate(session).model_dump(), "turns": turns}
+
+@app.delete("/ai/chat/sessions/{session_id}", tags=["AI"])
+def delete_chat_session(session_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_paid_user)):
+    if not crud.delete_chat_session(db, session_id, current_user.id):
+        raise HTTPException(status_code=404, detail="Chat session not found")
+    return {"message": "Chat session deleted"}
+
 # --- Workout Templates ---
 @app.post("/templates/", response_model=schemas.WorkoutTemplate, tags=["Workout Templates"])
 def create_workout_template(template: schemas.WorkoutTemplateCreate, db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_user)):
@@ -227,12 +423,10 @@ def delete_challenge(challenge_id: int, db: Session = Depends(get_db), admin_use
     return {"message": "Challenge deleted"}
 
 # --- Community ---
-from fastapi import BackgroundTasks
 
 @app.post("/community/posts/", response_model=schemas.Post, tags=["Community"])
 async def create_post(
     post: schemas.PostCreate, 
-    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db), 
     current_user: models.User = Depends(auth.get_current_user)
 ):
@@ -240,8 +434,8 @@ async def create_post(
         # Create immediately
         new_post = await crud.create_post(db=db, post=post, user_id=current_user.id)
         
-        # Schedule moderation
-        background_tasks.add_task(crud.process_post_moderation, db, new_post.id)
+        # Moderated in the next batch by the background worker
+        moderation_worker.enqueue(new_post.id)
         
         return new_post
     except ValueError as e:
@@ -260,13 +454,31 @@ def delete_post(post_id: int, db: Session = Depends(get_db), admin_user: models.
 
 @app.post("/ai/parse-workout", tags=["AI"])
 async def parse_workout(request: schemas.WorkoutParseRequest, db: Session = Depends(get_db)):
-    from fitness_app.ai.workout_parser import parse_workout_text
     try:
-        parsed_data = await parse_workout_text(request.text)
+        parsed_data = await workout_parser.parse_workout_text(request.text)
         return parsed_data
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/ai/import-workouts", response_model=schemas.WorkoutImportJob, status_code=202, tags=["AI"])
+async def import_workouts(request: schemas.WorkoutImportRequest, db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_paid_user)):
+    """
+    Queues a bulk import of pasted workout history; poll the returned job for progress.
+    """
+    active = await run_in_threadpool(crud.count_active_workout_import_jobs, db, current_user.id)
+    if active >= workout_import.MAX_ACTIVE_JOBS_PER_USER:
+        raise HTTPException(status_code=429, detail="An import is already in progress; wait for it to finish.")
+    job = await run_in_threadpool(crud.create_workout_import_job, db, current_user.id, request.text)
+    workout_import.kick()
+    return workout_import.job_status(job)
+
+@app.get("/ai/import-workouts/{job_id}", response_model=schemas.WorkoutImportJob, tags=["AI"])
+def read_workout_import(job_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_user)):
+    job = crud.get_workout_import_job(db, job_id, current_user.id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Import job not found")
+    return workout_import.job_status(job)
+
 @app.post("/community/posts/{post_id}/report", tags=["Community"])
 def report_post(post_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_user)):
     # Verify post exists
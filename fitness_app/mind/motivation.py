@@ -0,0 +1,147 @@
+"""
+Daily motivation quote: generated once per day, served from memory.
+
+- Concurrent misses in a process share one in-flight generation (single-flight).
+- Across workers, the generating transaction takes a Postgres advisory lock;
+  losers wait for the winner's row instead of calling Gemini themselves. On
+  other databases the unique for_date constraint decides the winner.
+- A periodic job generates tomorrow's quote ahead of time, so the midnight
+  rush is served from memory without touching the database.
+"""
+import asyncio
+import logging
+import os
+import time
+from datetime import date, timedelta
+from typing import Dict, Optional
+
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from ..ai import gateway
+from ..core.database import SessionLocal
+from . import models as mind_models
+
+logger = logging.getLogger(__name__)
+
+PREWARM_SECONDS = int(os.getenv("MOTIVATION_PREWARM_SECONDS", 3600))
+LOCK_WAIT_SECONDS = float(os.getenv("MOTIVATION_LOCK_WAIT_SECONDS", 20))
+FALLBACK_RETRY_SECONDS = 300
+FALLBACK_TEXT = "Consistency is the key to progress."
+PROMPT = "Generate a short, powerful, and unique fitness motivation quote for today. Do not use cliches. Keep it under 20 words. Return ONLY the quote text."
+ADVISORY_LOCK_BASE = 0x4D4F5456 # Distinguishes these locks from other advisory lock users
+
+_quotes: Dict[date, dict] = {}
+_fallback_until: Dict[date, float] = {}
+_inflight: Dict[date, asyncio.Task] = {}
+
+
+def _serialize(quote: mind_models.MotivationQuote) -> dict:
+    return {"id": quote.id, "text": quote.text, "for_date": quote.for_date}
+
+
+def _remember(for_date: date, quote: dict):
+    _quotes[for_date] = quote
+    # Only today and tomorrow are ever requested
+    for old in [d for d in _quotes if d < date.today() - timedelta(days=1)]:
+        del _quotes[old]
+
+
+def _find(db: Session, for_date: date) -> Optional[dict]:
+    quote = db.query(mind_models.MotivationQuote).filter(mind_models.MotivationQuote.for_date == for_date).first()
+    return _serialize(quote) if quote else None
+
+
+def _try_lock(db: Session, for_date: date) -> bool:
+    # Transaction-scoped, released by the commit/rollback that ends generation.
+    if db.get_bind().dialect.name != "postgresql":
+        return True
+    key = ADVISORY_LOCK_BASE * 100000 + for_date.toordinal()
+    return bool(db.execute(text("SELECT pg_try_advisory_xact_lock(:key)"), {"key": key}).scalar())
+
+
+def _insert(db: Session, for_date: date, quote_text: str) -> dict:
+    try:
+        quote = mind_models.MotivationQuote(text=quote_text, for_date=for_date)
+        db.add(quote)
+        db.commit()
+        return _serialize(quote)
+    except IntegrityError:
+        # Another worker stored the day's quote first; serve theirs.
+        db.rollback()
+        return _find(db, for_date)
+
+
+async def _generate_text() -> Optional[str]:
+    try:
+        quote_text = await gateway.generate(PROMPT, feature="motivation")
+    except gateway.AIError as e:
+        logger.warning(f"Motivation quote generation failed: {e}")
+        return None
+    # Cleanup quotes if any
+    return quote_text.replace('"', '').strip() or None
+
+
+async def _load_or_generate(for_date: date) -> dict:
+    db = SessionLocal()
+    try:
+        existing = await run_in_threadpool(_find, db, for_date)
+        if existing:
+            return existing
+
+        locked = await run_in_threadpool(_try_lock, db, for_date)
+        if not locked:
+            # Another worker is generating; wait for its row.
+            await run_in_threadpool(db.rollback)
+            deadline = time.monotonic() + LOCK_WAIT_SECONDS
+            while time.monotonic() < deadline:
+                await asyncio.sleep(0.5)
+                existing = await run_in_threadpool(_find, db, for_date)
+                await run_in_threadpool(db.rollback)
+                if existing:
+                    return existing
+            logger.warning(f"Timed out waiting for another worker's quote for {for_date}; generating here")
+        else:
+            # Re-check under the lock: the holder before us may have just committed.
+            existing = await run_in_threadpool(_find, db, for_date)
+            if existing:
+                return existing
+
+        quote_text = await _generate_text()
+        if quote_text is None:
+            await run_in_threadpool(db.rollback)
+            # Not persisted, so the next attempt after the retry window can still store a real quote.
+            return {"id": None, "text": FALLBACK_TEXT, "for_date": for_date}
+        return await run_in_threadpool(_insert, db, for_date, quote_text)
+    finally:
+        await run_in_threadpool(db.close)
+
+
+async def get_quote(for_date: Optional[date] = None) -> dict:
+    for_date = for_date or date.today()
+    quote = _quotes.get(for_date)
+    if quote is not None and (quote["id"] is not None or time.monotonic() < _fallback_until.get(for_date, 0)):
+        return quote
+
+    task = _inflight.get(for_date)
+    if task is None:
+        task = asyncio.ensure_future(_load_or_generate(for_date))
+        _inflight[for_date] = task
+        task.add_done_callback(lambda _: _inflight.pop(for_date, None))
+    # Shielded, so a client disconnecting doesn't cancel the generation others are waiting on.
+    quote = await asyncio.shield(task)
+    if quote["id"] is None:
+        _fallback_until[for_date] = time.monotonic() + FALLBACK_RETRY_SECONDS
+    _remember(for_date, quote)
+    return quote
+
+
+async def prewarm():
+    # Periodic job: makes sure today's and tomorrow's quotes are stored and cached.
+    today = date.today()
+    for for_date in (today, today + timedelta(days=1)):
+        quote = await get_quote(for_date)
+        if quote["id"] is None:
+            logger.warning(f"Could not pre-generate the motivation quote for {for_date}")
@@ -5,6 +5,7 @@ from .. import models, schemas
 from ..auth import auth
 from . import models as mind_models
 from ..ai import moderator
+from . import motivation
 from datetime import date, timedelta
 import json
 
@@ -81,24 +82,9 @@ from ..ai.gemini_api import _call_gemini_api
 # --- User Endpoints ---
 
 @router.get("/motivation")
-async def get_daily_motivation(db: Session = Depends(get_db)):
-    today = date.today()
-    quote = db.query(mind_models.MotivationQuote).filter(mind_models.MotivationQuote.for_date == today).first()
-    if not quote:
-        # Generate one via AI
-        prompt = "Generate a short, powerful, and unique fitness motivation quote for today. Do not use cliches. Keep it under 20 words. Return ONLY the quote text."
-        try:
-            quote_text = await _call_gemini_api(prompt)
-            # Cleanup quotes if any
-            quote_text = quote_text.replace('"', '').strip()
-        except Exception as e:
-            quote_text = "Consistency is the key to progress." # Fallback
-
-        quote = mind_models.MotivationQuote(text=quote_text, for_date=today)
-        db.add(quote)
-        db.commit()
-        db.refresh(quote)
-    return quote
+async def get_daily_motivation():
+    # Served from memory once warm; see motivation.py
+    return await motivation.get_quote()
 
 @router.post("/ask")
 async def ask_mind(
@@ -132,7 +118,7 @@ async def ask_mind(
     full_prompt = f"{system_context}\nUser: {query}\nResponse:"
     
     try:
-        answer = await _call_gemini_api(full_prompt)
+        answer = await _call_gemini_api(full_prompt, feature="mind")
     except Exception:
         answer = "My processing units are currently overloaded. Please try again later."
     
@@ -173,7 +159,7 @@ async def generate_challenge_proposal(
     """
     
     try:
-        response_text = await _call_gemini_api(prompt)
+        response_text = await _call_gemini_api(prompt, feature="challenge")
         # Clean up potential markdown
         response_text = response_text.replace("```json", "").replace("```", "").strip()
         data = json.loads(response_text)
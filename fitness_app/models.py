@@ -1,5 +1,5 @@
 import enum
-from sqlalchemy import Column, Integer, String, Float, Text, Date, ForeignKey, Enum, DateTime
+from sqlalchemy import Column, Integer, String, Float, Text, Date, ForeignKey, Enum, DateTime, Index, LargeBinary, UniqueConstraint
 from sqlalchemy.orm import relationship
 from datetime import date, datetime
 from .core.database import Base
@@ -42,6 +42,9 @@ class Habit(Base):
     
     owner = relationship("User", back_populates="habit_entries")
 
+    # One row per user per day; writes upsert into it (see migration_habits_unique_v1.py for existing DBs)
+    __table_args__ = (UniqueConstraint("owner_id", "date", name="uq_habits_owner_date"),)
+
 class MealLog(Base):
     __tablename__ = "meal_logs"
     id = Column(Integer, primary_key=True, index=True)
@@ -57,6 +60,9 @@ class MealLog(Base):
     
     owner = relationship("User", back_populates="meal_logs")
 
+    # Recent rows per user without scanning their whole history (see migration_owner_date_indexes_v1.py for existing DBs)
+    __table_args__ = (Index("ix_meal_logs_owner_date", "owner_id", "date"),)
+
 class Progress(Base):
     __tablename__ = "progress"
     id = Column(Integer, primary_key=True, index=True)
@@ -79,6 +85,9 @@ class WorkoutLog(Base):
     owner = relationship("User", back_populates="workout_logs")
     logged_exercises = relationship("LoggedExercise", back_populates="workout_log", cascade="all, delete-orphan")
 
+    # Same as meal_logs
+    __table_args__ = (Index("ix_workout_logs_owner_date", "owner_id", "date"),)
+
 class LoggedExercise(Base):
     __tablename__ = "logged_exercises"
     id = Column(Integer, primary_key=True, index=True)
@@ -120,6 +129,169 @@ class ExerciseMuscleGroupAssociation(Base):
     exercise_id = Column(Integer, ForeignKey("exercises.id"), primary_key=True)
     muscle_group_id = Column(Integer, ForeignKey("muscle_groups.id"), primary_key=True)
 
+class TrainingDailyRollup(Base):
+    # Pre-aggregated sets per user, day and exercise. Maintained by analytics.rollups.
+    __tablename__ = "training_daily_rollup"
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    date = Column(Date, primary_key=True)
+    exercise_id = Column(Integer, ForeignKey("exercises.id"), primary_key=True)
+    volume = Column(Float, default=0.0, nullable=False)
+    max_weight = Column(Float, default=0.0, nullable=False)
+    total_reps = Column(Integer, default=0, nullable=False)
+    set_count = Column(Integer, default=0, nullable=False)
+    workout_count = Column(Integer, default=0, nullable=False) # Workouts that included this exercise
+
+    exercise = relationship("Exercise")
+
+class TrainingDailyWorkoutRollup(Base):
+    # Same aggregates per user, day and workout name, for template/date grouping and exact session counts.
+    __tablename__ = "training_daily_workout_rollup"
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    date = Column(Date, primary_key=True)
+    workout_name = Column(String, primary_key=True)
+    volume = Column(Float, default=0.0, nullable=False)
+    max_weight = Column(Float, default=0.0, nullable=False)
+    total_reps = Column(Integer, default=0, nullable=False)
+    set_count = Column(Integer, default=0, nullable=False)
+    workout_count = Column(Integer, default=0, nullable=False)
+
+class TrainingRollupState(Base):
+    # One row per user whose rollups have been built from the raw logs; also the row rebuilds lock on
+    __tablename__ = "training_rollup_state"
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    built_at = Column(DateTime, default=datetime.utcnow)
+
+class NutritionDaily(Base):
+    # Per-day meal totals, maintained on meal writes (see analytics/nutrition.py)
+    __tablename__ = "nutrition_daily"
+    owner_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    date = Column(Date, primary_key=True)
+    calories = Column(Integer, default=0, nullable=False)
+    protein_g = Column(Float, default=0.0, nullable=False)
+    carbs_g = Column(Float, default=0.0, nullable=False)
+    fats_g = Column(Float, default=0.0, nullable=False)
+    meal_count = Column(Integer, default=0, nullable=False)
+
+class NutritionRollupState(Base):
+    # One row per user whose nutrition_daily rows have been built from the raw meal logs; also the row rebuilds lock on
+    __tablename__ = "nutrition_rollup_state"
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    built_at = Column(DateTime, default=datetime.utcnow)
+
+class UserSummary(Base):
+    # Denormalized per-user stats for /users/me/stats, maintained on progress/workout/meal writes.
+    __tablename__ = "user_summary"
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    month_start = Column(Date, nullable=False) # Month that workouts_this_month refers to
+    workouts_this_month = Column(Integer, default=0, nullable=False)
+    total_workouts = Column(Integer, default=0, nullable=False)
+    total_meals = Column(Integer, default=0, nullable=False)
+    first_weight = Column(Float, nullable=True)
+    first_weight_date = Column(Date, nullable=True)
+    last_weight = Column(Float, nullable=True)
+    last_weight_date = Column(Date, nullable=True)
+
+class PlatformCounter(Base):
+    # Platform-wide totals maintained on writes (see analytics/platform_stats.py)
+    __tablename__ = "platform_counters"
+    name = Column(String, primary_key=True)
+    value = Column(Integer, default=0, nullable=False)
+
+class DailyActiveSketch(Base):
+    # HyperLogLog registers of the users who logged a workout on a date
+    __tablename__ = "daily_active_sketches"
+    date = Column(Date, primary_key=True)
+    registers = Column(LargeBinary, nullable=False)
+
+class UserRoleChange(Base):
+    # Role change events, so conversions (e.g. unpaid -> paid) can be dated
+    __tablename__ = "user_role_changes"
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    old_role = Column(Enum(UserRole), nullable=True)
+    new_role = Column(Enum(UserRole), nullable=False)
+    changed_at = Column(DateTime, default=datetime.utcnow)
+
+class BatchJobState(Base):
+    # Watermark of the last day a batch job fully processed
+    __tablename__ = "batch_job_state"
+    name = Column(String, primary_key=True)
+    watermark = Column(Date, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class WorkoutImportJob(Base):
+    # Bulk import of pasted workout history, processed by ai/workout_import.py
+    __tablename__ = "workout_import_jobs"
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    status = Column(String, default="pending", index=True) # pending, running, completed, failed
+    source_text = Column(Text)
+    attempt = Column(Integer, default=0, nullable=False) # Claim token, bumped each time a worker picks the job up
+    total_entries = Column(Integer, default=0, nullable=False)
+    parsed_locally = Column(Integer, default=0, nullable=False)
+    parsed_by_ai = Column(Integer, default=0, nullable=False)
+    failed_entries = Column(Integer, default=0, nullable=False)
+    ai_calls = Column(Integer, default=0, nullable=False)
+    imported_workouts = Column(Integer, default=0, nullable=False)
+    unmatched_exercises = Column(Text, nullable=True) # JSON list of names not in the catalogue (left out of the import)
+    errors = Column(Text, nullable=True) # JSON list of {"entry", "reason"} samples
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+
+class ChatSession(Base):
+    # Server-side AI coach conversation (see ai/chat_sessions.py)
+    __tablename__ = "chat_sessions"
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    title = Column(String, nullable=True)
+    summary = Column(Text, nullable=True) # Rolling summary of the turns up to summarized_through
+    summarized_through = Column(Integer, default=0, nullable=False) # Last ChatTurn.id folded into the summary
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    turns = relationship("ChatTurn", back_populates="session", cascade="all, delete-orphan", passive_deletes=True)
+
+class ChatTurn(Base):
+    __tablename__ = "chat_turns"
+    id = Column(Integer, primary_key=True, index=True)
+    session_id = Column(Integer, ForeignKey("chat_sessions.id", ondelete="CASCADE"), index=True)
+    role = Column(String) # user, assistant
+    content = Column(Text)
+    tokens = Column(Integer, default=0, nullable=False) # Estimated, for history budgets
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    session = relationship("ChatSession", back_populates="turns")
+
+class DailyUserActivity(Base):
+    # Materialized by analytics/cohorts.py: one row per user per active day
+    __tablename__ = "daily_user_activity"
+    date = Column(Date, primary_key=True)
+    user_id = Column(Integer, primary_key=True, index=True)
+    workouts = Column(Integer, default=0, nullable=False)
+    meals = Column(Integer, default=0, nullable=False)
+
+class UserCohort(Base):
+    # Weekly cohort (Monday of the week of first activity)
+    __tablename__ = "user_cohorts"
+    user_id = Column(Integer, primary_key=True)
+    cohort_week = Column(Date, index=True, nullable=False)
+    first_active_date = Column(Date, nullable=False)
+
+class CohortRetention(Base):
+    # Users of a cohort active in a given week
+    __tablename__ = "cohort_retention"
+    cohort_week = Column(Date, primary_key=True)
+    activity_week = Column(Date, primary_key=True, index=True)
+    week_offset = Column(Integer, nullable=False)
+    active_users = Column(Integer, default=0, nullable=False)
+
+class CohortSummary(Base):
+    __tablename__ = "cohort_summaries"
+    cohort_week = Column(Date, primary_key=True)
+    users = Column(Integer, default=0, nullable=False)
+    converted_users = Column(Integer, default=0, nullable=False) # Now paid, or ever switched to paid
+
 class PasswordReset(Base):
     __tablename__ = "password_resets"
     id = Column(Integer, primary_key=True, index=True)
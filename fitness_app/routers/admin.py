@@ -1,8 +1,9 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
 from ..core.database import get_db
 from .. import models, schemas
 from ..auth import auth
+from ..analytics import cohorts, platform_stats
 
 router = APIRouter(
     prefix="/admin",
@@ -28,3 +29,33 @@ def log_missing_exercise(
         f.write(log_entry)
             
     return {"message": "Reported to admin"}
+
+@router.get("/analytics/cohorts", response_model=schemas.CohortReport)
+def read_cohort_retention(
+    cohort_count: int = Query(12, ge=1, le=104),
+    max_weeks: int = Query(12, ge=0, le=104),
+    db: Session = Depends(get_db),
+    admin_user: models.User = Depends(auth.get_current_admin_user)
+):
+    """
+    Weekly retention and paid conversion per cohort (users grouped by the week of their first logged workout or meal). ADMIN ONLY.
+    Reads tables materialized by the cohort batch job; see computed_through for freshness.
+    """
+    return schemas.CohortReport(
+        computed_through=cohorts.computed_through(db),
+        cohorts=cohorts.cohort_report(db, cohort_count, max_weeks)
+    )
+
+@router.get("/analytics/funnel", response_model=schemas.EngagementFunnel)
+def read_engagement_funnel(
+    db: Session = Depends(get_db),
+    admin_user: models.User = Depends(auth.get_current_admin_user)
+):
+    """
+    Registered -> activated -> retained -> paid funnel. ADMIN ONLY.
+    """
+    registered = platform_stats.get_snapshot(db)["user_stats"]["total_users"]
+    return schemas.EngagementFunnel(
+        computed_through=cohorts.computed_through(db),
+        stages=cohorts.funnel(db, registered)
+    )
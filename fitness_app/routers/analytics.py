@@ -1,11 +1,16 @@
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from fastapi.responses import StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from typing import List
 
 from .. import crud, schemas, models
 from ..core.database import get_db
 from ..auth import auth
+from ..analytics.cache import analytics_cache
+from ..analytics import dashboard, live, snapshots
+from ..core.events import TooManyConnections, user_events
 
 router = APIRouter(
     prefix="/analytics",
@@ -24,6 +29,65 @@ def get_analytics(
     """
     return crud.get_analytics_data(db=db, user_id=current_user.id, request=request)
 
+@router.post("/live/ticket", response_model=schemas.StreamTicket)
+def create_live_ticket(current_user: models.User = Depends(auth.get_current_user)):
+    """
+    Short-lived ticket for opening /analytics/live from an EventSource, which can't send an Authorization header.
+    """
+    return {"ticket": auth.create_stream_ticket(current_user), "expires_in": auth.STREAM_TICKET_EXPIRE_SECONDS}
+
+@router.get("/live")
+async def stream_live_updates(
+    request: Request,
+    current_user: models.User = Depends(auth.get_current_user_for_stream)
+):
+    """
+    Server-Sent Events stream of metric deltas (workout_logged, meal_logged, habit_logged)
+    pushed as soon as the user's writes commit, so clients don't need to poll.
+    """
+    try:
+        user_events.check_capacity(current_user.id)
+    except TooManyConnections as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    return StreamingResponse(
+        live.stream_events(request, current_user.id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@router.get("/personal-records", response_model=List[schemas.PersonalRecord])
+def get_personal_records(
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """
+    Heaviest set and best estimated 1RM per exercise, read from the columnar history snapshot.
+    """
+    history = snapshots.load_user_history(db, current_user.id)
+    records = snapshots.personal_records(history)
+    exercise_ids = [r["exercise_id"] for r in records]
+    names = dict(db.query(models.Exercise.id, models.Exercise.name).filter(models.Exercise.id.in_(exercise_ids)).all())
+    return [schemas.PersonalRecord(**r, exercise_name=names.get(r["exercise_id"], "Unknown")) for r in records]
+
+@router.get("/exercises/{exercise_id}/history", response_model=List[schemas.ExerciseHistoryPoint])
+def get_exercise_history(
+    exercise_id: int,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """
+    Per-day max weight, volume and estimated 1RM for one exercise, read from the columnar history snapshot.
+    """
+    history = snapshots.load_user_history(db, current_user.id)
+    return snapshots.exercise_history(history, exercise_id)
+
+@router.get("/cache-stats")
+def get_cache_stats(admin_user: models.User = Depends(auth.get_current_admin_user)):
+    """
+    Hit/miss counters for the per-user analytics result cache. ADMIN ONLY.
+    """
+    return analytics_cache.stats()
+
 # --- Dashboard Widgets ---
 
 @router.post("/widgets", response_model=schemas.DashboardWidget)
@@ -41,6 +105,17 @@ def read_widgets(
 ):
     return crud.get_widgets_by_user(db=db, user_id=current_user.id)
 
+@router.get("/dashboard", response_model=List[schemas.DashboardWidgetData])
+async def get_dashboard(
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    """
+    Evaluates every dashboard widget of the current user in a single request.
+    """
+    widgets = await run_in_threadpool(crud.get_widgets_by_user, db, current_user.id)
+    return await dashboard.evaluate_widgets(current_user.id, widgets)
+
 @router.put("/widgets/{widget_id}", response_model=schemas.DashboardWidget)
 def update_widget(
     widget_id: int,
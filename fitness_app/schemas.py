@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from datetime import date, datetime
 from typing import List, Optional, Union
 from .models import UserRole
@@ -17,6 +17,12 @@ class AnalyticsGroupBy(str, Enum):
     EXERCISE = "exercise"
     WORKOUT_TEMPLATE = "workout_template"
     DATE = "date" # Over time
+
+class AnalyticsGranularity(str, Enum):
+    DAY = "day"
+    WEEK = "week" # ISO week, starting Monday
+    MONTH = "month"
+    QUARTER = "quarter"
     
 class AnalyticsRequest(BaseModel):
     metric: AnalyticsMetric
@@ -24,11 +30,35 @@ class AnalyticsRequest(BaseModel):
     start_date: Optional[date] = None
     end_date: Optional[date] = None
     filter_ids: List[int] = [] # Optional IDs to filter by (e.g. specific exercises or muscles)
+    # Time-series options, only used with group_by=date
+    granularity: AnalyticsGranularity = AnalyticsGranularity.DAY
+    rolling_window: Optional[int] = Field(None, ge=2, le=52) # Rolling average over this many buckets
+    compare_previous: bool = False # Add the change vs. the previous bucket
 
 class AnalyticsDataPoint(BaseModel):
     label: str # The group name (e.g., "Chest", "Bench Press", "2023-10-27")
-    date: Optional[str] = None # For time-series data
+    date: Optional[str] = None # For time-series data (bucket start date)
     value: float
+    rolling_avg: Optional[float] = None
+    delta: Optional[float] = None # value - previous bucket's value; an empty one counts as 0, except for max_weight (None)
+
+class StreamTicket(BaseModel):
+    ticket: str # Pass as ?ticket= when opening /analytics/live
+    expires_in: int # Seconds
+
+class PersonalRecord(BaseModel):
+    exercise_id: int
+    exercise_name: str
+    max_weight: float
+    max_weight_date: str
+    estimated_1rm: float # Epley estimate from the best set
+    estimated_1rm_date: str
+
+class ExerciseHistoryPoint(BaseModel):
+    date: str
+    max_weight: float
+    volume: float
+    estimated_1rm: float
 
 # --- Progress Schemas ---
 class ProgressBase(BaseModel):
@@ -63,6 +93,23 @@ class Habit(HabitBase):
     class Config:
         from_attributes = True
 
+class WearableMetric(str, Enum):
+    STEPS = "steps"
+    SLEEP = "sleep_hours"
+    WATER = "water_liters"
+
+class WearableSample(BaseModel):
+    timestamp: datetime # Device local time; its date decides the habit day
+    metric: WearableMetric
+    value: float = Field(ge=0) # Increment since the previous reading
+
+class WearableSampleBatch(BaseModel):
+    samples: List[WearableSample] = Field(max_length=5000)
+
+class WearableIngestResult(BaseModel):
+    accepted: int
+    days: int
+
 # --- Meal Log Schemas ---
 class MealLogBase(BaseModel):
     date: date
@@ -83,14 +130,93 @@ class MealLog(MealLogBase):
     class Config:
         from_attributes = True
 
+class NutritionTotals(BaseModel):
+    calories: float = 0
+    protein_g: float = 0
+    carbs_g: float = 0
+    fats_g: float = 0
+    meal_count: int = 0
+
+class NutritionAverages(BaseModel):
+    # Per logged day
+    calories: float = 0
+    protein_g: float = 0
+    carbs_g: float = 0
+    fats_g: float = 0
+    meal_count: float = 0
+
+class NutritionDay(BaseModel):
+    date: date
+    calories: int
+    protein_g: float
+    carbs_g: float
+    fats_g: float
+    meal_count: int
+
+class NutritionWeek(BaseModel):
+    week_start: date
+    days_logged: int
+    totals: NutritionTotals
+    averages: NutritionAverages
+
+class NutritionSummary(BaseModel):
+    start: date
+    end: date
+    days_logged: int
+    totals: NutritionTotals
+    averages: NutritionAverages
+    days: List[NutritionDay] = []
+    weeks: List[NutritionWeek] = []
+
 # --- Chat Schema ---
 class ChatMessage(BaseModel):
     role: str
     content: str
 
+class ChatTurn(BaseModel):
+    id: int
+    role: str
+    content: str
+    created_at: datetime
+    class Config:
+        from_attributes = True
+
+class ChatSession(BaseModel):
+    id: int
+    title: Optional[str] = None
+    summary: Optional[str] = None
+    created_at: datetime
+    updated_at: datetime
+    class Config:
+        from_attributes = True
+
+class ChatSessionDetail(ChatSession):
+    turns: List[ChatTurn] = [] # Most recent, oldest first
+
 class WorkoutParseRequest(BaseModel):
     text: str
 
+class WorkoutImportRequest(BaseModel):
+    text: str = Field(min_length=1, max_length=500_000) # Months of pasted notes
+
+class WorkoutImportError(BaseModel):
+    entry: int
+    reason: str
+
+class WorkoutImportJob(BaseModel):
+    id: int
+    status: str
+    total_entries: int
+    parsed_locally: int
+    parsed_by_ai: int
+    failed_entries: int
+    ai_calls: int
+    imported_workouts: int
+    unmatched_exercises: List[str] = [] # Not in the exercise catalogue; their sets were not imported
+    errors: List[WorkoutImportError] = []
+    created_at: datetime
+    finished_at: Optional[datetime] = None
+
 # --- Master Data Schemas ---
 class MuscleGroupBase(BaseModel):
     name: str
@@ -192,6 +318,8 @@ class UserStats(BaseModel):
     workouts_this_month: int
     current_weight: Optional[float] = None
     total_progress: Optional[float] = None
+    total_workouts: Optional[int] = None
+    total_meals: Optional[int] = None
 
 # --- Workout Template Schemas ---
 class TemplateExerciseBase(BaseModel):
@@ -291,5 +419,31 @@ class DashboardWidget(DashboardWidgetBase):
     class Config:
         from_attributes = True
 
+class DashboardWidgetData(BaseModel):
+    widget: DashboardWidget
+    data: List[AnalyticsDataPoint] = []
+    error: Optional[str] = None # Set when the widget's configuration can't be evaluated
+
+class CohortRow(BaseModel):
+    cohort_week: date # Monday of the week of first activity
+    users: int
+    converted_users: int
+    conversion_rate: float
+    active_users: List[int] # Index = weeks since the cohort week
+    retention: List[float]
+
+class CohortReport(BaseModel):
+    computed_through: Optional[date] = None # Last day processed by the batch job
+    cohorts: List[CohortRow] = []
+
+class FunnelStage(BaseModel):
+    stage: str
+    users: int
+    rate_from_previous: Optional[float] = None
+
+class EngagementFunnel(BaseModel):
+    computed_through: Optional[date] = None
+    stages: List[FunnelStage] = []
+
 class AIInsightRequest(BaseModel):
     context: str
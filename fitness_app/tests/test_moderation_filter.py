@@ -0,0 +1,55 @@
+import pytest
+
+from fitness_app.ai.moderation_filter import ESCALATE, SAFE, UNSAFE, ModerationFilter
+
+
+@pytest.fixture
+def moderation_filter():
+    return ModerationFilter()
+
+
+@pytest.mark.parametrize("text", ["Hit 100kg", "ran 5km today", "5x5 at 100kg"])
+def test_workout_posts_with_numbers_pass_locally(moderation_filter, text):
+    assert moderation_filter.check(text).decision == SAFE
+
+
+def test_links_always_escalate(moderation_filter):
+    assert moderation_filter.check("Check my progress www.example.com").decision == ESCALATE
+    assert moderation_filter.check("New squat PR 140kg https://example.com/video").decision == ESCALATE
+
+
+def test_untargeted_profanity_is_not_removed_locally(moderation_filter):
+    verdict = moderation_filter.check("This is fucking shit")
+    assert verdict.score >= 4.0
+    assert verdict.decision == ESCALATE
+
+
+def test_targeted_abuse_is_removed_locally(moderation_filter):
+    assert moderation_filter.check("you are a stupid fucking idiot").decision == UNSAFE
+
+
+def test_block_phrase_is_removed_locally(moderation_filter):
+    assert moderation_filter.check("kys").decision == UNSAFE
+
+
+def test_leetspeak_abuse_is_still_matched(moderation_filter):
+    assert moderation_filter.check("you are a 1d10t and a l0ser").decision == UNSAFE
+
+
+def test_rejected_text_is_remembered(moderation_filter):
+    moderation_filter.remember_rejected("Buy cheap pills", "Spam")
+    verdict = moderation_filter.check("buy CHEAP pills!")
+    assert (verdict.decision, verdict.reason) == (UNSAFE, "Spam")
+
+
+def test_apostrophe_threat_is_removed_locally(moderation_filter):
+    assert moderation_filter.check("I'll kill you").decision == UNSAFE
+
+
+@pytest.mark.parametrize("text", [
+    "Deadlifts hurt, you will die tomorrow haha",
+    "This leg day is going to kill you, stupid hard lol",
+    "Hey you, that workout was stupid hard, I hate you for it haha",
+])
+def test_gym_banter_is_not_removed_locally(moderation_filter, text):
+    assert moderation_filter.check(text).decision == ESCALATE
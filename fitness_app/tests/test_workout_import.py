@@ -0,0 +1,20 @@
+from datetime import date
+
+from fitness_app.ai.workout_import import split_entries
+
+TODAY = date(2026, 1, 5)
+
+
+def test_entries_split_at_date_headings():
+    entries = split_entries("2024-03-05 Push day\nbench 3x10 @ 60\n\n2024-03-07 Legs\nsquat 5x5 @ 100", today=TODAY)
+    assert [(e.date, e.title, e.text) for e in entries] == [
+        (date(2024, 3, 5), "Push day", "bench 3x10 @ 60"),
+        (date(2024, 3, 7), "Legs", "squat 5x5 @ 100"),
+    ]
+
+
+def test_distance_line_is_not_a_heading():
+    entries = split_entries("2024-03-05 Push day\n2.5 km run\nohp 3x8 @ 40", today=TODAY)
+    assert [(e.date, e.title, e.text) for e in entries] == [
+        (date(2024, 3, 5), "Push day", "2.5 km run\nohp 3x8 @ 40"),
+    ]
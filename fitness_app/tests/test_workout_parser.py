@@ -0,0 +1,33 @@
+from datetime import date
+
+import pytest
+
+from fitness_app.ai.workout_parser import parse_locally
+
+TODAY = date(2026, 1, 5)
+
+
+def _sets(parsed, index=0):
+    return [(s["reps"], s["weight"]) for s in parsed["logged_exercises"][index]["sets"]]
+
+
+def test_sets_x_reps_at_weight():
+    parsed = parse_locally("bench 3x10 @ 60kg", today=TODAY)
+    assert _sets(parsed) == [(10, 60.0)] * 3
+
+
+def test_set_by_set_weight_x_reps():
+    parsed = parse_locally("bench 60x10, 70x8, 80x6", today=TODAY)
+    assert _sets(parsed) == [(10, 60.0), (8, 70.0), (6, 80.0)]
+
+
+@pytest.mark.parametrize("text", [
+    "bench 3x10 60x8", "bench 60x8 3x10", "curls 8x10", "bench 12x10", "bench 20x5", "bench 3x10",
+])
+def test_ambiguous_shorthand_goes_to_the_llm(text):
+    assert parse_locally(text, today=TODAY) is None
+
+
+def test_heavier_unit_less_pair_is_weight_x_reps():
+    parsed = parse_locally("bench 60x10", today=TODAY)
+    assert _sets(parsed) == [(10, 60.0)]